@@ -0,0 +1,138 @@
+"""This module is concerned with merging concurrent embedding requests into multi-input provider calls.
+
+The embeddings API accepts a list of inputs per request. `MicroBatcher` collects the texts submitted
+by concurrent callers for a short window, or until a batch is full, sends them as one request and hands
+each caller back the embedding of its own text.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+import httpx
+
+from api.core import metrics, vectors
+
+BatchHandler = Callable[[list[str]], Awaitable[list[vectors.Embedding]]]
+
+embedding_requests = metrics.counter("embedding_requests_total", "Requests sent to the embeddings API.")
+embedding_inputs = metrics.counter("embedding_inputs_total", "Texts embedded through the embeddings API.")
+
+
+def is_item_error(exc: BaseException) -> bool:
+    """
+    Whether an error from a batch request may have been caused by one of its inputs.
+
+    Client errors other than rate limiting, and invalid responses, are blamed on the inputs: the batch
+    is split so that only the offending text fails. Anything else fails the whole batch.
+
+    Parameters
+    ----------
+    exc : BaseException
+        The error raised by the batch request.
+
+    Returns
+    -------
+    bool
+        True if the batch should be split and retried.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        status_code = exc.response.status_code
+        return 400 <= status_code < 500 and status_code != 429  # noqa: PLR2004
+    return isinstance(exc, ValueError)
+
+
+class MicroBatcher:
+    """
+    Merges texts submitted concurrently into batched calls to `handler`.
+
+    Parameters
+    ----------
+    handler : BatchHandler
+        Coroutine function embedding a list of texts, returning one embedding per text in order.
+    max_batch_size : int
+        Maximum number of texts sent in one call.
+    max_wait : float
+        Seconds to wait for more texts after the first one of a batch arrives.
+
+    """
+
+    def __init__(self, handler: BatchHandler, max_batch_size: int, max_wait: float) -> None:
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, text: str) -> vectors.Embedding:
+        """
+        Embed `text` as part of the next batch.
+
+        Parameters
+        ----------
+        text : str
+            The text content to embed.
+
+        Returns
+        -------
+        vectors.Embedding
+            The vector embedding of `text`.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Pending work of another (closed) loop can never complete, so start afresh.
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed(self, texts: list[str]) -> list[vectors.Embedding]:
+        embedding_requests.inc()
+        embedding_inputs.inc(len(texts))
+        embeddings = await self.handler(texts)
+        if len(embeddings) != len(texts):
+            msg = f"Expected {len(texts)} embeddings, received {len(embeddings)}"
+            raise ValueError(msg)
+        return embeddings
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # Identical texts submitted together are only embedded once.
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = await self._embed(texts)
+        except Exception as exc:  # noqa: BLE001 - handed over to the waiting callers
+            if len(texts) > 1 and is_item_error(exc):
+                middle = len(texts) // 2
+                first = {*texts[:middle]}
+                await asyncio.gather(
+                    self._run([item for item in batch if item[0] in first]),
+                    self._run([item for item in batch if item[0] not in first]),
+                )
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        by_text = dict(zip(texts, embeddings, strict=True))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
@@ -0,0 +1,102 @@
+"""This module is concerned with writing many rows at once with PostgreSQL's `COPY`.
+
+One `COPY` statement streams every row to the server in a single round trip, where `INSERT` statements
+cost a round trip and a parse per statement. Rows are sent in the text format, which pgvector parses for
+both `vector` and `halfvec` columns.
+"""
+
+import io
+from collections.abc import Iterable, Sequence
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import Connection, text
+
+from api.core import vectors
+
+# Characters with a special meaning in the text format of `COPY`
+ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def format_value(value: object) -> str:
+    """
+    Format a value as a field of the text format of `COPY`.
+
+    Parameters
+    ----------
+    value : object
+        None, a string, a number, a boolean, a datetime or an embedding.
+
+    Returns
+    -------
+    str
+        The field, with special characters escaped.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, np.ndarray):
+        return vectors.to_text(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).translate(ESCAPES)
+
+
+def copy_rows(connection: Connection, table: str, columns: Sequence[str], rows: Iterable[Sequence[object]]) -> int:
+    """
+    Insert rows into a table with a single `COPY` statement.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database, whose transaction the rows are written in.
+    table : str
+        The name of the table.
+    columns : Sequence[str]
+        The columns the values of each row are given for, the others get their default.
+    rows : Iterable[Sequence[object]]
+        The values of each row, in the order of `columns`.
+
+    Returns
+    -------
+    int
+        The number of rows inserted.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(map(format_value, row)))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def reserve_ids(connection: Connection, table: str, count: int) -> list[int]:
+    """
+    Take the next values of the sequence of a table's `id` column, so that rows can refer to each other before `COPY`.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database.
+    table : str
+        The name of the table.
+    count : int
+        The number of IDs to reserve.
+
+    Returns
+    -------
+    list[int]
+        The reserved IDs, in increasing order.
+    """
+    return list(
+        connection.execute(
+            text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+            {"table": table, "count": count},
+        ).scalars(),
+    )
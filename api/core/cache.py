@@ -0,0 +1,295 @@
+"""This module is concerned with caching the embeddings of search queries.
+
+Search queries are often repeated, and embedding one is a paid round trip to the provider. The
+`QueryEmbeddingCache` stores embeddings under a hash of the normalized query and the model name,
+either in the memory of the current process or in a database table shared by every API process.
+"""
+
+import functools
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from typing import Protocol
+
+import numpy as np
+from sqlalchemy import Engine, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select
+
+from api.core import database, metrics, models, vectors
+from api.core.config import settings
+
+query_cache_hits = metrics.counter("query_embedding_cache_hits_total", "Query embeddings served from the cache.")
+query_cache_misses = metrics.counter("query_embedding_cache_misses_total", "Query embeddings not found in the cache.")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a search query so that trivially different spellings share a cache entry.
+
+    Parameters
+    ----------
+    query : str
+        The search query text.
+
+    Returns
+    -------
+    str
+        The query in NFKC form, case folded, with runs of whitespace collapsed.
+    """
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def cache_key(query: str, model: str) -> str:
+    """
+    Build the cache key of a query embedded with a given model.
+
+    Parameters
+    ----------
+    query : str
+        The search query text.
+    model : str
+        The name of the embedding model.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the normalized query and the model.
+    """
+    return hashlib.sha256(f"{model}\0{normalize_query(query)}".encode()).hexdigest()
+
+
+class CacheBackend(Protocol):
+    """Storage used by `QueryEmbeddingCache` to hold serialized embeddings."""
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value stored under `key`, or None if it is missing or expired."""
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store `value` under `key` for `ttl` seconds."""
+
+    def clear(self) -> None:
+        """Remove every entry."""
+
+
+class MemoryCacheBackend:
+    """
+    LRU cache held in the memory of the current process.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries kept.
+    max_bytes : int
+        Maximum total size of the stored values in bytes.
+    clock : Callable[[], float], optional
+        Source of the current time in seconds, by default `time.monotonic`.
+
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """Total size of the stored values in bytes."""
+        return self._size
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value stored under `key`, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store `value` under `key` for `ttl` seconds, evicting the least recently used entries."""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + ttl, value)
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+
+class DatabaseCacheBackend:
+    """
+    Cache stored in a database table, shared by every process connected to the database.
+
+    Its methods block on the database, so async code calls them in a worker thread.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+    max_entries : int
+        Maximum number of entries kept once expired entries have been purged.
+    purge_interval : int, optional
+        Number of writes between purges of expired and excess entries, by default 1000.
+
+    """
+
+    def __init__(self, engine: Engine, max_entries: int, purge_interval: int = 1000) -> None:
+        self.engine = engine
+        self.max_entries = max_entries
+        self.purge_interval = purge_interval
+        self._writes = 0
+
+    def get(self, key: str) -> bytes | None:
+        """Return the value stored under `key`, or None if it is missing or expired."""
+        with Session(self.engine) as session:
+            return session.exec(
+                select(models.QueryEmbeddingCacheEntry.value).where(
+                    models.QueryEmbeddingCacheEntry.key == key,
+                    models.QueryEmbeddingCacheEntry.expires_at > datetime.utcnow(),  # noqa: DTZ003
+                ),
+            ).first()
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store `value` under `key` for `ttl` seconds."""
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)  # noqa: DTZ003
+        stmt = insert(models.QueryEmbeddingCacheEntry).values(key=key, value=value, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(index_elements=["key"], set_={"value": value, "expires_at": expires_at})
+        with Session(self.engine) as session:
+            session.exec(stmt)
+            self._writes += 1
+            if self._writes % self.purge_interval == 0:
+                self._purge(session)
+            session.commit()
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with Session(self.engine) as session:
+            session.exec(delete(models.QueryEmbeddingCacheEntry))
+            session.commit()
+
+    def _purge(self, session: Session) -> None:
+        session.exec(
+            delete(models.QueryEmbeddingCacheEntry).where(
+                models.QueryEmbeddingCacheEntry.expires_at <= datetime.utcnow(),  # noqa: DTZ003
+            ),
+        )
+        newest = (
+            select(models.QueryEmbeddingCacheEntry.key)
+            .order_by(models.QueryEmbeddingCacheEntry.expires_at.desc())
+            .limit(self.max_entries)
+        )
+        session.exec(
+            delete(models.QueryEmbeddingCacheEntry).where(models.QueryEmbeddingCacheEntry.key.not_in(newest)),
+        )
+
+
+class QueryEmbeddingCache:
+    """
+    Cache of query embeddings keyed by the normalized query and the model name.
+
+    Embeddings are stored as float32 bytes, the precision pgvector stores them with.
+
+    Parameters
+    ----------
+    backend : CacheBackend
+        Storage used to hold the embeddings.
+    ttl : float
+        Seconds an embedding stays in the cache.
+
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str, model: str) -> vectors.Embedding | None:
+        """
+        Look up the embedding of a query.
+
+        Parameters
+        ----------
+        query : str
+            The search query text.
+        model : str
+            The name of the embedding model.
+
+        Returns
+        -------
+        vectors.Embedding | None
+            The cached embedding, or None on a miss.
+        """
+        value = self.backend.get(cache_key(query, model))
+        if value is None:
+            self.misses += 1
+            query_cache_misses.inc()
+            return None
+        self.hits += 1
+        query_cache_hits.inc()
+        return np.frombuffer(value, dtype=np.float32)
+
+    def set(self, query: str, model: str, embedding: vectors.Embedding) -> None:
+        """
+        Store the embedding of a query.
+
+        Parameters
+        ----------
+        query : str
+            The search query text.
+        model : str
+            The name of the embedding model.
+        embedding : vectors.Embedding
+            The embedding of the query.
+        """
+        self.backend.set(cache_key(query, model), np.asarray(embedding, dtype=np.float32).tobytes(), self.ttl)
+
+    def clear(self) -> None:
+        """Remove every cached embedding and reset the hit and miss counts."""
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+@functools.cache
+def get_query_cache() -> QueryEmbeddingCache:
+    """
+    Get the query embedding cache of the current process, creating it on first use.
+
+    Returns
+    -------
+    QueryEmbeddingCache
+        The cache using the backend selected by `settings.query_cache_backend`.
+    """
+    if settings.query_cache_backend == "database":
+        backend: CacheBackend = DatabaseCacheBackend(database.engine, settings.query_cache_max_entries)
+    else:
+        backend = MemoryCacheBackend(settings.query_cache_max_entries, settings.query_cache_max_bytes)
+    return QueryEmbeddingCache(backend, settings.query_cache_ttl)
@@ -1,30 +1,128 @@
 """This module is concerned with defining the Celery client that is used to send tasks to the broker queue."""
 
-from collections.abc import Generator
+import functools
 
 from celery import Celery
+from kombu import Queue
 
 from api.core.config import settings
 
+# Highest RabbitMQ message priority, messages with a higher priority are delivered first
+MAX_PRIORITY = 9
 
-def get_celery_client(host: str = "rabbitmq") -> Generator[Celery, None, None]:
+# Uploaded files are processed on separate queues by size, so that small files never wait behind large ones
+SMALL_FILES_QUEUE = "ingest_small"
+LARGE_FILES_QUEUE = "ingest_large"
+TASK_QUEUES = (
+    Queue("celery"),
+    Queue(SMALL_FILES_QUEUE, max_priority=MAX_PRIORITY),
+    Queue(LARGE_FILES_QUEUE, max_priority=MAX_PRIORITY),
+)
+
+
+def broker_url(host: str) -> str:
     """
-    get_celery_client creates a celery app that will be used to connect to the task queue
+    broker_url returns the URL of the rabbitmq broker at a host, with the credentials of the settings
+
+    Parameters
+    ----------
+    host : str
+        host of the rabbitmq broker
+
+    Returns
+    -------
+    str
+        URL of the broker, shared by the API and the workers
+    """
+    return f"amqp://{settings.default_user}:{settings.default_pass}@{host}:5672/"
+
+
+def create_celery_client(host: str = "rabbitmq") -> Celery:
+    """
+    create_celery_client creates a celery app that can send tasks to the task queue
 
     Parameters
     ----------
     host : str, optional
         host of the rabbitmq broker used for the celery task queue, by default "rabbitmq"
 
-    Yields
-    ------
+    Returns
+    -------
     Celery
         celery app used to send tasks to the celery task queue
     """
     client = Celery(
         "tasks",
-        broker=f"amqp://{settings.default_user}:{settings.default_pass}@{host}:5672/",
+        broker=broker_url(host),
         backend="rpc://",
     )
-    yield client
+    # Queues must be declared with the same arguments as the workers declare them
+    client.conf.task_queues = TASK_QUEUES
+    # Connections are kept open in a pool shared by every thread publishing with the client
+    client.conf.broker_pool_limit = settings.broker_pool_limit
+    # Wait for the broker to confirm each message, so that a message lost on its way raises
+    client.conf.broker_transport_options = {"confirm_publish": True}
+    # Publishing reconnects with an exponential backoff while the broker is unreachable, or after it
+    # closed a connection left idle in the pool
+    client.conf.task_publish_retry_policy = {
+        "max_retries": settings.broker_publish_max_retries,
+        "interval_start": 0,
+        "interval_step": 0.5,
+        "interval_max": 4,
+    }
+    return client
+
+
+def ingest_route(size: int, content_type: str) -> tuple[str, int]:
+    """
+    Choose the queue and priority of the task processing an uploaded file.
+
+    Plain text files up to `settings.ingest_large_file_bytes` go to the queue of small files, anything
+    else to the queue of large files. Within a queue smaller files come first: the priority drops by
+    one level each time the size doubles beyond 4 KiB.
+
+    Parameters
+    ----------
+    size : int
+        The size of the file in bytes.
+    content_type : str
+        The MIME type of the file.
+
+    Returns
+    -------
+    tuple[str, int]
+        The name of the queue and the message priority.
+    """
+    queue = SMALL_FILES_QUEUE
+    if size > settings.ingest_large_file_bytes or content_type != "text/plain":
+        queue = LARGE_FILES_QUEUE
+    return queue, max(MAX_PRIORITY - max((size - 1).bit_length() - 12, 0), 0)
+
+
+@functools.cache
+def get_celery_client() -> Celery:
+    """
+    get_celery_client returns the celery app of this process that connects to the task queue at
+    `settings.broker_host`, creating it on first use
+
+    Publishing blocks until the broker confirms the message, so it is done from worker threads.
+
+    Returns
+    -------
+    Celery
+        celery app used to send tasks to the celery task queue, shared by every request of the process
+    """
+    return create_celery_client(settings.broker_host)
+
+
+def close_celery_client(client: Celery) -> None:
+    """
+    close_celery_client closes the connections pooled by a celery app, and forgets the apps of this process
+
+    Parameters
+    ----------
+    client : Celery
+        celery app returned by `get_celery_client`
+    """
     client.close()
+    get_celery_client.cache_clear()
@@ -0,0 +1,177 @@
+"""This module is concerned with splitting text into overlapping, token-bounded chunks for embedding.
+
+Tokens are approximated by runs of word characters and single punctuation marks, which tracks the
+token counts of subword tokenizers closely enough to keep every chunk within the provider's limits
+without depending on the tokenizer of a specific model.
+"""
+
+import hashlib
+import re
+import zlib
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """
+    A contiguous part of a text.
+
+    Attributes
+    ----------
+    index : int
+        Position of the chunk in the text, starting at 0.
+    text : str
+        The content of the chunk.
+    start_offset : int
+        Offset of the first character of the chunk in the text.
+    end_offset : int
+        Offset just past the last character of the chunk in the text.
+    token_count : int
+        Number of tokens in the chunk.
+
+    """
+
+    index: int
+    text: str
+    start_offset: int
+    end_offset: int
+    token_count: int
+
+    @property
+    def content_hash(self) -> str:
+        """SHA-256 hex digest of the chunk content."""
+        return hashlib.sha256(self.text.encode()).hexdigest()
+
+
+def iter_chunks(
+    pieces: Iterable[str],
+    window: int,
+    overlap: int,
+    *,
+    content_defined: bool = False,
+) -> Iterator[Chunk]:
+    """
+    Split a text given as a stream of pieces into chunks of at most `window` tokens.
+
+    Consecutive chunks share `overlap` tokens. Only the text of the chunk being built is held in
+    memory, so arbitrarily large texts can be chunked as they are read. A text without any token
+    still produces a single chunk.
+
+    With content-defined boundaries, a chunk ends after a token pair whose hash matches a pattern,
+    as long as it has at least `window // 4` tokens, so chunks average a little over half the window.
+    Boundaries then depend on the surrounding text only: an edit changes the chunks around it, and
+    the chunks before and after it are found again in the new version of the text.
+
+    Parameters
+    ----------
+    pieces : Iterable[str]
+        The text, in consecutive pieces of any size.
+    window : int
+        Maximum number of tokens in a chunk.
+    overlap : int
+        Number of tokens shared by consecutive chunks.
+    content_defined : bool, optional
+        Whether to end chunks at boundaries found in the content, by default False.
+
+    Yields
+    ------
+    Chunk
+        The chunks of the text, in order.
+
+    Raises
+    ------
+    ValueError
+        If `overlap` is negative or not smaller than `window`.
+    """
+    if not 0 <= overlap < window:
+        msg = f"Chunk overlap must be between 0 and the window size ({window}), got {overlap}"
+        raise ValueError(msg)
+
+    min_tokens = max(window // 4, overlap + 1)
+    divisor = max(window // 2, 1)
+
+    buffer = ""
+    offset = 0  # Offset of buffer[0] in the text.
+    scanned = 0  # Position in the buffer up to which tokens have been found.
+    spans: list[tuple[int, int, bool]] = []  # Offsets in the text of the tokens not yet emitted, and boundaries.
+    previous_hash = 0
+    index = 0
+
+    def scan(*, final: bool) -> None:
+        nonlocal scanned, previous_hash
+        for match in TOKEN_PATTERN.finditer(buffer, scanned):
+            if match.end() == len(buffer) and not final:
+                # The token may continue in the next piece.
+                scanned = match.start()
+                return
+            token_hash = zlib.crc32(match.group().encode())
+            pair_hash = zlib.crc32(match.group().encode(), previous_hash)
+            spans.append((offset + match.start(), offset + match.end(), pair_hash % divisor == 0))
+            previous_hash = token_hash
+            scanned = match.end()
+
+    def cut_point(*, final: bool) -> int | None:
+        # Number of tokens of the next chunk, None while more tokens are needed to tell.
+        if content_defined:
+            for position in range(min_tokens - 1, min(len(spans), window)):
+                if spans[position][2]:
+                    return position + 1
+        if len(spans) >= window:
+            return window
+        return len(spans) if final else None
+
+    def emit(count: int) -> Chunk:
+        start, end = spans[0][0], spans[count - 1][1]
+        return Chunk(index, buffer[start - offset : end - offset], start, end, count)
+
+    def advance(count: int) -> None:
+        nonlocal buffer, offset, scanned
+        del spans[: count - overlap]
+        cut = spans[0][0] - offset if spans else scanned
+        buffer, offset, scanned = buffer[cut:], offset + cut, scanned - cut
+
+    for piece in pieces:
+        buffer += piece
+        scan(final=False)
+        while (count := cut_point(final=False)) is not None:
+            yield emit(count)
+            index += 1
+            advance(count)
+
+    scan(final=True)
+    if index == 0 and not spans:
+        yield Chunk(0, buffer, 0, len(buffer), 0)
+        return
+    while index == 0 or len(spans) > overlap:
+        count = cut_point(final=True)
+        yield emit(count)
+        index += 1
+        if count == len(spans):
+            return
+        advance(count)
+
+
+def chunk_text(text: str, window: int, overlap: int, *, content_defined: bool = False) -> list[Chunk]:
+    """
+    Split a text into chunks of at most `window` tokens sharing `overlap` tokens.
+
+    Parameters
+    ----------
+    text : str
+        The text to split.
+    window : int
+        Maximum number of tokens in a chunk.
+    overlap : int
+        Number of tokens shared by consecutive chunks.
+    content_defined : bool, optional
+        Whether to end chunks at boundaries found in the content, by default False.
+
+    Returns
+    -------
+    list[Chunk]
+        The chunks of the text, in order.
+    """
+    return list(iter_chunks([text], window, overlap, content_defined=content_defined))
@@ -1,8 +1,33 @@
 """This module is concerned with handling settings with environment variables."""
 
+from typing import Literal
+
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class EmbeddingEndpoint(BaseModel):
+    """
+    An additional OpenAI compatible endpoint serving the same embeddings as the configured one.
+
+    Attributes
+    ----------
+    base_url : str
+        Base URL of the embeddings API.
+
+    model : str | None
+        Name of the model at this endpoint, `embedding_model` when unset.
+
+    api_key : str | None
+        API key of this endpoint, `embedding_api_key` or the OpenRouter API key when unset.
+
+    """
+
+    base_url: str
+    model: str | None = None
+    api_key: str | None = None
+
+
 class Settings(BaseSettings):
     """
     Settings _summary_
@@ -39,15 +64,244 @@ class Settings(BaseSettings):
     minio_root_password str
         The secret key for MinIO.
 
+    minio_host : str
+        The host of MinIO for the API and the workers.
+
+    minio_max_connections : int
+        Maximum number of idle connections to MinIO kept open by each process.
+
+    minio_connect_timeout : float
+        Timeout in seconds for connecting to MinIO.
+
+    minio_read_timeout : float
+        Timeout in seconds for reading from a connection to MinIO.
+
+    minio_public_endpoint : str | None
+        The host and port clients reach MinIO at, which presigned URLs point to. Defaults to the MinIO
+        host of the workers.
+
+    minio_public_secure : bool
+        Whether clients reach MinIO over HTTPS.
+
+    minio_region : str
+        The region of MinIO, which URLs are signed for.
+
+    minio_notify_arn : str | None
+        The ARN of the MinIO notification target announcing the objects written to the bucket to the
+        workers, on the `minio_events` queue. Objects uploaded directly are only processed once
+        finalized through the API when it is not set.
+
+    upload_url_expiry : int
+        Seconds a presigned upload URL is valid for.
+
+    upload_max_bytes : int
+        Largest size of an uploaded file in bytes.
+
+    upload_part_size : int
+        Size in bytes of the parts uploaded files are streamed into MinIO in, at least 5 MiB. Each
+        upload holds one part in memory.
+
+    upload_bulk_max_files : int
+        Largest number of files in a bulk upload, counting the files of its archives.
+
+    upload_concurrency : int
+        Number of files of a bulk upload stored in MinIO at the same time.
+
     default_user : str
         The username for RabbitMQ.
 
     default_pass : str
         The password for RabbitMQ.
 
+    broker_host : str
+        The host of RabbitMQ for the API and the workers.
+
+    broker_pool_limit : int
+        Maximum number of connections to RabbitMQ each API process keeps open to publish tasks.
+
+    broker_publish_max_retries : int
+        Number of times publishing a task is retried while RabbitMQ is unreachable, reconnecting with
+        an exponential backoff.
+
     openrouter_api_key : str
         The API key for OpenRouter.
 
+    embedding_provider : str
+        Which embedding provider to use, either "openai" (any OpenAI compatible API) or "hashing" (local).
+
+    embedding_base_url : str
+        Base URL of the OpenAI compatible embeddings API.
+
+    embedding_model : str
+        Name of the embedding model requested from the API.
+
+    embedding_dimensions : int
+        Number of dimensions of the embeddings.
+
+    embedding_storage : str
+        How embeddings are stored, either "vector" (4 byte floats) or "halfvec" (2 byte floats).
+
+    embedding_storage_dimensions : int | None
+        Number of leading dimensions of each embedding that are stored, all of them when unset.
+
+    embedding_hnsw_index : bool
+        Whether to build HNSW indexes over stored embeddings, when the storage format allows it.
+
+    embedding_api_key : str | None
+        API key of the embeddings API, the OpenRouter API key is used when unset.
+
+    embedding_max_connections : int
+        Maximum number of concurrent connections to the embeddings API.
+
+    embedding_max_keepalive_connections : int
+        Maximum number of idle connections to the embeddings API kept in the pool.
+
+    embedding_keepalive_expiry : float
+        Seconds an idle connection to the embeddings API is kept open.
+
+    embedding_timeout : float
+        Timeout in seconds for requests to the embeddings API.
+
+    embedding_http2 : bool
+        Whether to use HTTP/2 for requests to the embeddings API.
+
+    embedding_encoding_format : Literal["base64", "float"] | None
+        Encoding of the embeddings requested from the embeddings API. Base64 is decoded straight into
+        float32 arrays; None omits the parameter for APIs that do not support it.
+
+    embedding_concurrency_initial : int
+        Number of concurrent embedding requests allowed before any response is observed.
+
+    embedding_concurrency_min : int
+        Lower bound of the adaptive limit of concurrent embedding requests.
+
+    embedding_concurrency_max : int
+        Upper bound of the adaptive limit of concurrent embedding requests.
+
+    embedding_latency_target : float
+        Embedding responses slower than this many seconds reduce the concurrency limit.
+
+    embedding_max_retries : int
+        Maximum number of retries of an embedding request after a transient failure.
+
+    embedding_retry_backoff : float
+        Base delay in seconds of the exponential backoff between retries.
+
+    embedding_retry_max_backoff : float
+        Maximum delay in seconds between retries.
+
+    embedding_retry_budget_ratio : float
+        Fraction of the embedding requests that may be retried.
+
+    embedding_retry_budget_per_second : float
+        Retries allowed per second regardless of the number of requests.
+
+    embedding_circuit_failure_threshold : int
+        Number of consecutive failures after which calls to the provider fail fast.
+
+    embedding_circuit_reset_timeout : float
+        Seconds calls fail fast before the provider is probed again.
+
+    embedding_fallback_endpoints : list[EmbeddingEndpoint]
+        Further endpoints producing the same embeddings, as a JSON list, in order of preference.
+
+    embedding_routing_alpha : float
+        Weight of each new observation in the moving averages of endpoint latency and error rate.
+
+    embedding_hedge_percentile : float
+        Quantile of an endpoint's recent latencies after which an interactive request is hedged.
+
+    embedding_hedge_min_delay : float
+        Minimum seconds before an interactive request is hedged.
+
+    embedding_hedge_initial_delay : float
+        Seconds before an interactive request is hedged while an endpoint has few latency samples.
+
+    embedding_batch_max_size : int
+        Maximum number of texts sent to the embeddings API in one request.
+
+    embedding_batch_window : float
+        Seconds concurrent embedding requests are collected for before being sent as one batch.
+
+    near_duplicate_similarity : float | None
+        Fraction of the 64 SimHash fingerprint bits a file must share with an earlier file of the same
+        user to reuse its embeddings instead of being embedded. Matches are only guaranteed to be found
+        down to 0.95 (3 differing bits). None disables near-duplicate detection.
+
+    ingest_concurrency : int
+        Number of files each worker process ingests at the same time, on as many threads sharing one
+        event loop. Each thread reserves one message from the queue, which bounds the files in flight.
+
+    ingest_batch_max_files : int
+        Maximum number of uploaded files processed together by one batch task.
+
+    ingest_batch_max_bytes : int
+        Maximum total size of the uploaded files processed together by one batch task, unless a single
+        file is larger. A batch is held in memory with the embeddings of its chunks, several times its
+        size, by each of the `ingest_concurrency` threads of a worker.
+
+    ingest_max_in_flight : int
+        Maximum number of uploaded files sent to the workers and not processed yet. The others wait
+        in the virtual queue of their user.
+
+    ingest_user_max_in_flight : int
+        Maximum number of files of one user sent to the workers and not processed yet.
+
+    ingest_user_caps : dict[int, int]
+        Maximum number of files in flight of specific users, by user ID, instead of `ingest_user_max_in_flight`.
+
+    ingest_user_weights : dict[int, float]
+        Share of the workers of specific users, by user ID, relative to the weight 1 of the others.
+
+    ingest_dispatch_timeout : float
+        Seconds after which a file sent to the workers is sent again, unless a worker started on it or
+        reported its progress since. Must exceed the longest a task waits in its queue plus
+        `ingest_time_limit`, or files still waiting or being processed are sent twice.
+
+    ingest_status_retention : float
+        Seconds the ingestion status of a file is kept after it was stored or failed.
+
+    ingest_events_keepalive : float
+        Seconds between comments sent on an idle stream of ingestion events, to keep connections open.
+
+    ingest_large_file_bytes : int
+        Files larger than this many bytes are processed on the queue of large files.
+
+    ingest_time_limit : float | None
+        Seconds a worker spends reading and embedding a task's files before giving up on the task.
+        None waits for as long as it takes.
+
+    reembed_batch_files : int
+        Number of files embedded by each task of a re-embedding job.
+
+    reembed_chunks_per_second : float
+        Maximum average rate at which a re-embedding job embeds chunks.
+
+    chunk_window_tokens : int
+        Maximum number of tokens in a chunk of a file embedded on its own.
+
+    chunk_overlap_tokens : int
+        Number of tokens shared by consecutive chunks of a file.
+
+    chunk_boundaries : str
+        Either "content" to end chunks at boundaries found in the text, so that a re-uploaded file
+        only needs its edited chunks embedded again, or "fixed" for chunks of exactly the window size.
+
+    search_pooling : str
+        How chunk similarities are aggregated into a file similarity by default, either "max" or "mean".
+
+    query_cache_backend : str
+        Where query embeddings are cached, either "memory" (per process) or "database" (shared).
+
+    query_cache_max_entries : int
+        Maximum number of query embeddings kept in the cache.
+
+    query_cache_max_bytes : int
+        Maximum total size in bytes of the query embeddings kept in the in-memory cache.
+
+    query_cache_ttl : float
+        Seconds a query embedding stays in the cache.
+
     Classes
     -------
         Config: Used to load values for this class from the .env file
@@ -65,9 +319,79 @@ class Settings(BaseSettings):
     minio_root_user: str
     minio_root_password: str
     minio_host: str = "minio"
+    minio_max_connections: int = 32
+    minio_connect_timeout: float = 5.0
+    minio_read_timeout: float = 60.0
+    minio_public_endpoint: str | None = None
+    minio_public_secure: bool = False
+    minio_region: str = "us-east-1"
+    minio_notify_arn: str | None = None
+    upload_url_expiry: int = 3600
+    upload_max_bytes: int = 100 * 1024 * 1024
+    upload_part_size: int = 8 * 1024 * 1024
+    upload_bulk_max_files: int = 10000
+    upload_concurrency: int = 8
     default_user: str
     default_pass: str
+    broker_host: str = "rabbitmq"
+    broker_pool_limit: int = 10
+    broker_publish_max_retries: int = 5
     openrouter_api_key: str
+    embedding_provider: Literal["openai", "hashing"] = "openai"
+    embedding_base_url: str = "https://openrouter.ai/api/v1"
+    embedding_model: str = "qwen/qwen3-embedding-8b"
+    embedding_dimensions: int = 4096
+    embedding_storage: Literal["vector", "halfvec"] = "vector"
+    embedding_storage_dimensions: int | None = None
+    embedding_hnsw_index: bool = False
+    embedding_api_key: str | None = None
+    embedding_max_connections: int = 100
+    embedding_max_keepalive_connections: int = 20
+    embedding_keepalive_expiry: float = 30.0
+    embedding_timeout: float = 30.0
+    embedding_http2: bool = True
+    embedding_encoding_format: Literal["base64", "float"] | None = "base64"
+    embedding_concurrency_initial: int = 8
+    embedding_concurrency_min: int = 1
+    embedding_concurrency_max: int = 64
+    embedding_latency_target: float = 10.0
+    embedding_max_retries: int = 3
+    embedding_retry_backoff: float = 0.5
+    embedding_retry_max_backoff: float = 30.0
+    embedding_retry_budget_ratio: float = 0.1
+    embedding_retry_budget_per_second: float = 1.0
+    embedding_circuit_failure_threshold: int = 5
+    embedding_circuit_reset_timeout: float = 30.0
+    embedding_fallback_endpoints: list[EmbeddingEndpoint] = []
+    embedding_routing_alpha: float = 0.2
+    embedding_hedge_percentile: float = 0.95
+    embedding_hedge_min_delay: float = 0.05
+    embedding_hedge_initial_delay: float = 1.0
+    embedding_batch_max_size: int = 32
+    embedding_batch_window: float = 0.005
+    near_duplicate_similarity: float | None = 0.95
+    ingest_concurrency: int = 16
+    ingest_batch_max_files: int = 100
+    ingest_batch_max_bytes: int = 4 * 1024 * 1024
+    ingest_max_in_flight: int = 200
+    ingest_user_max_in_flight: int = 50
+    ingest_user_caps: dict[int, int] = {}
+    ingest_user_weights: dict[int, float] = {}
+    ingest_dispatch_timeout: float = 24 * 60 * 60
+    ingest_status_retention: float = 7 * 24 * 60 * 60
+    ingest_events_keepalive: float = 15.0
+    ingest_large_file_bytes: int = 1024 * 1024
+    ingest_time_limit: float | None = None
+    reembed_batch_files: int = 20
+    reembed_chunks_per_second: float = 50.0
+    chunk_window_tokens: int = 512
+    chunk_overlap_tokens: int = 64
+    chunk_boundaries: Literal["fixed", "content"] = "content"
+    search_pooling: Literal["max", "mean"] = "max"
+    query_cache_backend: Literal["memory", "database"] = "memory"
+    query_cache_max_entries: int = 10_000
+    query_cache_max_bytes: int = 256 * 1024 * 1024
+    query_cache_ttl: float = 24 * 60 * 60
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
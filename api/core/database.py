@@ -5,12 +5,58 @@ from collections.abc import Generator
 from sqlalchemy import text
 from sqlmodel import Session, SQLModel, create_engine, select
 
-from api.core import models
+from api.core import models, vectors
 from api.core.config import settings
 
 DB_URL = f"postgresql://{settings.postgres_user}:{settings.postgres_password}@{settings.postgres_host}:{settings.postgres_port}/{settings.postgres_db}"
 engine = create_engine(DB_URL)
 
+# Tables with an `embedding` column stored in the format set by `vectors.column_type`
+EMBEDDING_TABLES = ("filemetadata", "filechunk")
+
+# Columns added to existing tables since they were first created, `create_all` only creates missing tables
+ADDED_COLUMNS = (
+    "ALTER TABLE filemetadata ADD COLUMN IF NOT EXISTS simhash BIGINT",
+    (
+        "ALTER TABLE filemetadata ADD COLUMN IF NOT EXISTS near_duplicate_of INTEGER "
+        "REFERENCES filemetadata(id) ON DELETE SET NULL"
+    ),
+    "ALTER TABLE filechunk ADD COLUMN IF NOT EXISTS content_hash VARCHAR",
+    (
+        "ALTER TABLE ingestrequest ADD COLUMN IF NOT EXISTS file_id INTEGER "
+        "REFERENCES filemetadata(id) ON DELETE SET NULL"
+    ),
+    "ALTER TABLE ingestrequest ADD COLUMN IF NOT EXISTS error VARCHAR",
+    "ALTER TABLE ingestrequest ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()",
+    "ALTER TABLE ingestrequest ADD COLUMN IF NOT EXISTS etag VARCHAR",
+)
+
+# Indexes added to existing tables, and tables no longer used
+ADDED_INDEXES = ("CREATE INDEX IF NOT EXISTS ix_filechunk_content_hash ON filechunk (content_hash)",)
+DROPPED_TABLES = ("DROP TABLE IF EXISTS contentembedding",)
+
+# Channel on which every change of the ingestion status of an upload is notified
+STATUS_CHANNEL = "ingest_status"
+
+# Notifies the status of an upload whenever it is queued or changes
+STATUS_TRIGGER = (
+    f"""
+    CREATE OR REPLACE FUNCTION ingest_status_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{STATUS_CHANNEL}', json_build_object(
+            'id', NEW.id, 'user_id', NEW.user_id, 'filename', NEW.filename, 'status', NEW.status,
+            'file_id', NEW.file_id, 'error', NEW.error, 'updated_at', NEW.updated_at
+        )::text);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    (
+        "CREATE OR REPLACE TRIGGER ingestrequest_notify AFTER INSERT OR UPDATE OF status ON ingestrequest "
+        "FOR EACH ROW EXECUTE FUNCTION ingest_status_notify()"
+    ),
+)
+
 
 def create_tables() -> None:
     """populates database with all tables defined in models.py"""
@@ -20,6 +66,77 @@ def create_tables() -> None:
         conn.commit()
 
     SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in (*ADDED_COLUMNS, *ADDED_INDEXES, *DROPPED_TABLES, *STATUS_TRIGGER):
+            conn.execute(text(statement))
+    migrate_embedding_storage()
+
+
+def migrate_embedding_storage() -> None:
+    """
+    Convert the embedding columns of existing tables to the configured storage format.
+
+    Rows already stored are converted in place: to half precision with a cast, to fewer
+    dimensions by keeping the leading dimensions and scaling them back to unit length.
+    HNSW indexes are (re)built when enabled and supported by the format.
+
+    Raises
+    ------
+    ValueError
+        If the configured dimensions exceed those of the stored embeddings, which can
+        only be fixed by embedding the files again, or if the files were embedded again
+        with another model than the configured one.
+    """
+    target = vectors.sql_type()
+    dimensions = vectors.storage_dimensions()
+    with engine.begin() as conn:
+        # Only one process migrates, the others wait and find nothing left to do
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('migrate_embedding_storage'))"))
+
+        # Converting embeddings of another model would silently corrupt them
+        switched = conn.execute(
+            text("SELECT model, dimensions FROM reembedjob WHERE status = 'switched' ORDER BY id DESC LIMIT 1"),
+        ).first()
+        if switched and (switched.model, switched.dimensions) != (
+            settings.embedding_model,
+            settings.embedding_dimensions,
+        ):
+            msg = (
+                f"Files are embedded with {switched.model} ({switched.dimensions} dimensions), "
+                "set EMBEDDING_MODEL and EMBEDDING_DIMENSIONS accordingly"
+            )
+            raise ValueError(msg)
+        for table in EMBEDDING_TABLES:
+            current = conn.execute(
+                text(
+                    "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                    "WHERE attrelid = CAST(:table AS regclass) AND attname = 'embedding'",
+                ),
+                {"table": table},
+            ).scalar_one()
+
+            if current != target:
+                current_dimensions = int(current.partition("(")[2].rstrip(")"))
+                if dimensions > current_dimensions:
+                    msg = f"Cannot convert {table}.embedding from {current} to {target}, re-embed the files instead"
+                    raise ValueError(msg)
+
+                expression = "embedding::vector"
+                if dimensions < current_dimensions:
+                    expression = f"l2_normalize(subvector(embedding::vector, 1, {dimensions}))"
+
+                conn.execute(text(f"DROP INDEX IF EXISTS {table}_embedding_hnsw"))
+                conn.execute(
+                    text(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE {target} USING ({expression})::{target}"),
+                )
+
+            if settings.embedding_hnsw_index and vectors.is_indexable():
+                conn.execute(
+                    text(
+                        f"CREATE INDEX IF NOT EXISTS {table}_embedding_hnsw ON {table} "
+                        f"USING hnsw (embedding {settings.embedding_storage}_cosine_ops)",
+                    ),
+                )
 
 
 def get_session() -> Generator[Session, None, None]:
@@ -1,46 +1,207 @@
-"""This module is concerned with generating and managing vector embeddings for file content using OpenRouter API."""
+"""This module is concerned with generating and managing vector embeddings for file content and search queries."""
 
-import os
+import asyncio
+import functools
+import itertools
+from collections.abc import Iterable
 
-import anyio
-import httpx
+import numpy as np
 
+from api.core import batching, cache, chunking, providers, resilience, routing, store, vectors
+from api.core.config import EmbeddingEndpoint, settings
 
-def get_openrouter_api_key() -> str:
+# Number of chunks of a streamed text embedded together
+STREAM_GROUP_CHUNKS = 256
+
+
+def create_endpoint_provider(
+    endpoint: EmbeddingEndpoint,
+    dimensions: int | None = None,
+) -> resilience.ResilientProvider:
+    """
+    Create the provider calling one remote embeddings endpoint.
+
+    Parameters
+    ----------
+    endpoint : EmbeddingEndpoint
+        The endpoint to call.
+    dimensions : int | None, optional
+        Number of dimensions of the embeddings, by default `settings.embedding_dimensions`.
+
+    Returns
+    -------
+    resilience.ResilientProvider
+        The endpoint's provider, with its own concurrency limit, retry budget and circuit breaker.
+    """
+    provider = providers.OpenAICompatibleProvider(
+        endpoint.base_url,
+        endpoint.model or settings.embedding_model,
+        dimensions or settings.embedding_dimensions,
+        endpoint.api_key or settings.embedding_api_key,
+        max_connections=settings.embedding_max_connections,
+        max_keepalive_connections=settings.embedding_max_keepalive_connections,
+        keepalive_expiry=settings.embedding_keepalive_expiry,
+        timeout=settings.embedding_timeout,
+        http2=settings.embedding_http2,
+        encoding_format=settings.embedding_encoding_format,
+    )
+    return resilience.ResilientProvider(
+        provider,
+        resilience.AdaptiveConcurrencyLimiter(
+            settings.embedding_concurrency_initial,
+            settings.embedding_concurrency_min,
+            settings.embedding_concurrency_max,
+            settings.embedding_latency_target,
+        ),
+        resilience.RetryBudget(
+            settings.embedding_retry_budget_ratio,
+            settings.embedding_retry_budget_per_second,
+            max_balance=settings.embedding_concurrency_max,
+        ),
+        resilience.CircuitBreaker(
+            settings.embedding_circuit_failure_threshold,
+            settings.embedding_circuit_reset_timeout,
+        ),
+        max_retries=settings.embedding_max_retries,
+        backoff=settings.embedding_retry_backoff,
+        max_backoff=settings.embedding_retry_max_backoff,
+    )
+
+
+@functools.cache
+def get_provider() -> providers.EmbeddingProvider:
+    """
+    Get the embedding provider of the current process, creating it on first use.
+
+    Returns
+    -------
+    providers.EmbeddingProvider
+        The provider selected by `settings.embedding_provider`. Remote providers are a
+        `routing.HedgedRouter` over the configured endpoint and its fallback endpoints.
+    """
+    if settings.embedding_provider == "hashing":
+        return providers.HashingProvider(settings.embedding_dimensions)
+    primary = EmbeddingEndpoint(
+        base_url=settings.embedding_base_url,
+        model=settings.embedding_model,
+        api_key=settings.embedding_api_key,
+    )
+    return routing.HedgedRouter(
+        [create_endpoint_provider(endpoint) for endpoint in [primary, *settings.embedding_fallback_endpoints]],
+        alpha=settings.embedding_routing_alpha,
+        hedge_percentile=settings.embedding_hedge_percentile,
+        min_hedge_delay=settings.embedding_hedge_min_delay,
+        initial_hedge_delay=settings.embedding_hedge_initial_delay,
+    )
+
+
+async def close_provider() -> None:
+    """Close the embedding provider of the current process if one was created."""
+    if get_provider.cache_info().currsize:
+        await get_provider().aclose()
+        get_provider.cache_clear()
+
+
+def embedding_space() -> str:
     """
-    Get the OpenRouter API key from environment variables.
+    Identify the space stored embeddings live in, used to key cached embeddings.
 
     Returns
     -------
     str
-        The OpenRouter API key.
+        The provider's model, followed by the stored dimensions when embeddings are truncated.
+    """
+    model = get_provider().model
+    return f"{model}:{vectors.storage_dimensions()}" if vectors.is_truncated() else model
+
+
+async def embed_texts(texts: list[str], *, interactive: bool = False) -> list[vectors.Embedding]:
+    """
+    Generate vector embeddings for several texts with the provider of the current process.
+
+    Parameters
+    ----------
+    texts : list[str]
+        The text contents to embed.
+    interactive : bool, optional
+        Whether a user is waiting for the result, by default False. Interactive requests are hedged
+        across endpoints when several are configured.
+
+    Returns
+    -------
+    list[vectors.Embedding]
+        The vector embeddings, in the same order as `texts`.
+    """
+    provider = get_provider()
+    if interactive and isinstance(provider, routing.HedgedRouter):
+        return await provider.embed_hedged(texts)
+    return await provider.embed(texts)
+
+
+@functools.cache
+def get_batcher(*, interactive: bool = False) -> batching.MicroBatcher:
+    """
+    Get the batcher merging concurrent embedding requests of the current process.
+
+    Parameters
+    ----------
+    interactive : bool, optional
+        Whether to get the batcher of interactive requests, by default False.
+
+    Returns
+    -------
+    batching.MicroBatcher
+        The shared batcher, sending batches to the shared embedding provider.
+    """
+    return batching.MicroBatcher(
+        functools.partial(embed_texts, interactive=interactive),
+        max_batch_size=settings.embedding_batch_max_size,
+        max_wait=settings.embedding_batch_window,
+    )
+
+
+async def generate_embedding(text: str, *, interactive: bool = False) -> vectors.Embedding:
+    """
+    Generate vector embedding for text content using the configured provider.
+
+    Parameters
+    ----------
+    text : str
+        The text content to embed.
+    interactive : bool, optional
+        Whether a user is waiting for the result, by default False.
+
+    Returns
+    -------
+    vectors.Embedding
+        The vector embedding as a float32 array, in the stored dimensions.
 
     Raises
     ------
+    resilience.ProviderUnavailableError
+        If the provider is unhealthy and was not called.
+    httpx.HTTPError
+        If the API request fails.
     ValueError
-        If the API key is not found in environment variables.
+        If the API response is invalid.
 
     """
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        msg = "OPENROUTER_API_KEY environment variable is not set"
-        raise ValueError(msg)
-    return api_key
+    return vectors.prepare(await get_batcher(interactive=interactive).submit(text))
 
 
-async def generate_embedding(text: str) -> list[float]:
+async def generate_query_embedding(query: str) -> vectors.Embedding:
     """
-    Generate vector embedding for text content using OpenRouter API.
+    Generate vector embedding for a search query, serving repeated queries from the cache.
 
     Parameters
     ----------
-    text : str
-        The text content to embed.
+    query : str
+        The search query text.
 
     Returns
     -------
-    List[float]
-        The vector embedding as a list of floats.
+    vectors.Embedding
+        The vector embedding as a float32 array.
 
     Raises
     ------
@@ -50,61 +211,127 @@ async def generate_embedding(text: str) -> list[float]:
         If the API response is invalid.
 
     """
-    api_key = get_openrouter_api_key()
+    query_cache = cache.get_query_cache()
+    model = embedding_space()
+    # The cache may be a database table, which is queried off the event loop
+    embedding = await asyncio.to_thread(query_cache.get, query, model)
+    if embedding is None:
+        embedding = await generate_embedding(query, interactive=True)
+        await asyncio.to_thread(query_cache.set, query, model, embedding)
+    return embedding
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/embeddings",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "qwen/qwen3-embedding-8b",
-                "input": text,
-            },
-            timeout=30.0,
-        )
 
-        response.raise_for_status()
-        data = response.json()
+def pool_embeddings(embeddings: list[vectors.Embedding]) -> vectors.Embedding:
+    """
+    Combine the embeddings of the chunks of a text into a single embedding for the whole text.
 
-        # Extract embedding from response
-        # OpenRouter API typically returns: {"data": [{"embedding": [...], ...}], "usage": {...}}
-        if "data" not in data or not data["data"]:
-            msg = "Invalid response from OpenRouter API"
-            raise ValueError(msg)
+    Parameters
+    ----------
+    embeddings : list[vectors.Embedding]
+        The embeddings of the chunks.
 
-        return data["data"][0]["embedding"]
+    Returns
+    -------
+    vectors.Embedding
+        The mean of the embeddings, scaled to unit length.
+    """
+    mean = np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+    norm = np.linalg.norm(mean)
+    return mean / norm if norm else mean
 
 
-async def generate_embedding_from_file(file_path: str) -> list[float]:
+async def generate_chunk_embeddings(
+    chunks: list[chunking.Chunk],
+    content_store: store.ContentEmbeddingStore | None = None,
+    reuse: dict[str, vectors.Embedding] | None = None,
+) -> list[vectors.Embedding]:
     """
-    Generate vector embedding from file content using OpenRouter API.
+    Generate vector embeddings for the chunks of a text.
+
+    The chunks are submitted concurrently, so they are sent to the API in multi-input batches.
+    When a content store is given, chunks whose content is already stored in another chunk reuse
+    its embedding. Embeddings given in `reuse`, such as those of the chunks of a previous version
+    of the file, are used before anything else.
 
     Parameters
     ----------
-    file_path : str
-        Path to the file to read and embed.
+    chunks : list[chunking.Chunk]
+        The chunks to embed.
+    content_store : store.ContentEmbeddingStore | None, optional
+        Store of the embeddings of stored chunks keyed by content hash, by default None.
+    reuse : dict[str, vectors.Embedding] | None, optional
+        Embeddings already known by content hash, by default None.
 
     Returns
     -------
-    List[float]
-        The vector embedding as a list of floats.
+    list[vectors.Embedding]
+        The vector embeddings, in the same order as `chunks`.
 
     Raises
     ------
-    FileNotFoundError
-        If the file does not exist.
-    UnicodeDecodeError
-        If the file cannot be decoded as UTF-8 text.
     httpx.HTTPError
-        If the API request fails.
+        If an API request fails.
+    ValueError
+        If an API response is invalid.
 
     """
+    hashes = [chunk.content_hash for chunk in chunks]
+    known = dict(reuse or {})
+    missing = [content_hash for content_hash in hashes if content_hash not in known]
+    if content_store and missing:
+        known.update(await asyncio.to_thread(content_store.get_many, missing))
+
+    texts = {chunk.content_hash: chunk.text for chunk in chunks if chunk.content_hash not in known}
+    known.update(zip(texts, await asyncio.gather(*map(generate_embedding, texts.values())), strict=True))
+    return [known[content_hash] for content_hash in hashes]
 
-    content = await anyio.Path(file_path).read_text(encoding="utf-8")
 
-    # For text files, we can embed the entire content
-    # For very large files, you might want to chunk them
-    return await generate_embedding(content)
+async def generate_embedding_from_stream(
+    pieces: Iterable[str],
+    content_store: store.ContentEmbeddingStore | None = None,
+    reuse: dict[str, vectors.Embedding] | None = None,
+) -> list[tuple[chunking.Chunk, vectors.Embedding]]:
+    """
+    Generate vector embeddings for the chunks of a text read as a stream of pieces.
+
+    The text is chunked as it is read, and embedded `STREAM_GROUP_CHUNKS` chunks at a time, so that no
+    more than a group of requests is in flight at once. Pieces are read in a worker thread, so `pieces`
+    may block, for instance on network reads.
+
+    Every chunk is kept with its embedding until the whole text is embedded, for the file to be stored
+    in one transaction: memory still grows with the text, which is held in chunks, and by one embedding
+    per chunk. Uploads are bounded by `settings.upload_max_bytes` accordingly.
+
+    Parameters
+    ----------
+    pieces : Iterable[str]
+        The text, in consecutive pieces of any size.
+    content_store : store.ContentEmbeddingStore | None, optional
+        Store of the embeddings of stored chunks keyed by content hash, by default None.
+    reuse : dict[str, vectors.Embedding] | None, optional
+        Embeddings already known by content hash, by default None.
+
+    Returns
+    -------
+    list[tuple[chunking.Chunk, vectors.Embedding]]
+        Each chunk of the text together with its vector embedding.
+
+    Raises
+    ------
+    httpx.HTTPError
+        If an API request fails.
+    ValueError
+        If an API response is invalid.
+
+    """
+    # Large texts are embedded chunk by chunk, so that no input exceeds the provider's limits
+    chunks = chunking.iter_chunks(
+        pieces,
+        settings.chunk_window_tokens,
+        settings.chunk_overlap_tokens,
+        content_defined=settings.chunk_boundaries == "content",
+    )
+    embedded_chunks: list[tuple[chunking.Chunk, vectors.Embedding]] = []
+    while group := await asyncio.to_thread(list, itertools.islice(chunks, STREAM_GROUP_CHUNKS)):
+        embedded_chunks.extend(zip(group, await generate_chunk_embeddings(group, content_store, reuse), strict=True))
+    return embedded_chunks
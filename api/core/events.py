@@ -0,0 +1,142 @@
+"""This module is concerned with pushing the ingestion status of uploaded files to the clients waiting for it.
+
+Every change of status is notified by the database on `database.STATUS_CHANNEL`, whichever process made
+it. Each API process holds a single connection listening on that channel, and hands the notifications
+over to the event streams of the users they concern.
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+
+import psycopg2
+import psycopg2.extensions
+
+from api.core import database, metrics
+
+logger = logging.getLogger(__name__)
+
+status_events = metrics.counter("ingest_status_events_total", "Ingestion status changes received from the database.")
+dropped_events = metrics.counter(
+    "ingest_status_events_dropped_total",
+    "Ingestion status changes dropped for slow clients.",
+)
+
+# Seconds between checks that the listening connection is still wanted, and before reconnecting after a failure
+POLL_INTERVAL = 5.0
+
+# Number of notifications kept for a client that does not read its stream fast enough
+MAX_PENDING_EVENTS = 1000
+
+
+def deliver(queue: asyncio.Queue, event: dict) -> None:
+    """Hand an event over to a stream, dropping it if the client is too far behind."""
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        dropped_events.inc()
+
+
+class StatusListener:
+    """
+    Listens to the notifications of ingestion status changes, and fans them out to per-user subscribers.
+
+    The connection is opened in a background thread on the first subscription, and reopened after failures.
+
+    Parameters
+    ----------
+    dsn : str
+        The URL of the database.
+
+    """
+
+    def __init__(self, dsn: str) -> None:
+        self.dsn = dsn
+        self._subscribers: dict[int, set[tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """
+        Start receiving the status changes of the uploads of a user.
+
+        Parameters
+        ----------
+        user_id : int
+            The ID of the user.
+
+        Returns
+        -------
+        asyncio.Queue
+            The queue the status changes are put on, as dictionaries with the fields of `models.IngestStatus`.
+        """
+        queue: asyncio.Queue = asyncio.Queue(MAX_PENDING_EVENTS)
+        with self._lock:
+            self._subscribers[user_id].add((asyncio.get_running_loop(), queue))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._listen, name="status-listener", daemon=True)
+                self._thread.start()
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        """Stop putting the status changes of the uploads of a user on `queue`."""
+        with self._lock:
+            self._subscribers[user_id] = {item for item in self._subscribers[user_id] if item[1] is not queue}
+            if not self._subscribers[user_id]:
+                del self._subscribers[user_id]
+
+    def publish(self, payload: str) -> None:
+        """Hand a notification of `database.STATUS_CHANNEL` over to the subscribers of its user."""
+        event = json.loads(payload)
+        status_events.inc()
+        with self._lock:
+            subscribers = list(self._subscribers.get(event.pop("user_id"), ()))
+        for loop, queue in subscribers:
+            with contextlib.suppress(RuntimeError):  # The loop of a finished stream may be closed
+                loop.call_soon_threadsafe(deliver, queue, event)
+
+    def _listen(self) -> None:
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                connection = psycopg2.connect(self.dsn)
+            except psycopg2.Error:
+                logger.exception("Cannot listen to ingestion status changes")
+                threading.Event().wait(POLL_INTERVAL)
+                continue
+            try:
+                connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {database.STATUS_CHANNEL}")
+                while self._subscribers:
+                    if select.select([connection], [], [], POLL_INTERVAL) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.publish(connection.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError):
+                logger.exception("Lost the connection listening to ingestion status changes")
+                threading.Event().wait(POLL_INTERVAL)
+            finally:
+                connection.close()
+
+
+@functools.cache
+def get_status_listener() -> StatusListener:
+    """
+    Get the listener of ingestion status changes of this process, creating it on first use.
+
+    Returns
+    -------
+    StatusListener
+        The listener shared by every event stream.
+    """
+    return StatusListener(database.DB_URL)
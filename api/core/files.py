@@ -1,16 +1,41 @@
 """This module is concerned with functions and objects related to file handling."""
 
-from fastapi import UploadFile
+import codecs
+import functools
+import io
+import mimetypes
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import BinaryIO
+
+import urllib3
 from minio import Minio
+from minio.helpers import ObjectWriteResult
+from minio.notificationconfig import NotificationConfig, QueueConfig
 
 from api.core.config import settings
 
 BUCKET = "images"
 
+# MIME types and extensions of the archives accepted by bulk uploads, by format
+ARCHIVE_TYPES = {
+    "zip": ({"application/zip", "application/x-zip-compressed"}, (".zip",)),
+    "tar": (
+        {"application/x-tar", "application/gzip", "application/x-gzip", "application/x-gtar", "application/x-bzip2"},
+        (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz"),
+    ),
+}
+
 
-def get_minio_client(host: str = "minio") -> Minio:
+def create_minio_client(host: str = "minio") -> Minio:
     """
-    get_minio_client creates and returns a client that can connect with the minIO
+    create_minio_client creates a client that can connect with the minIO, over a pool of connections
 
     Parameters
     ----------
@@ -22,41 +47,372 @@ def get_minio_client(host: str = "minio") -> Minio:
     Minio
         client to interact with minIO service
     """
-    client = Minio(
+    http_client = urllib3.PoolManager(
+        # Connections beyond the pool size are still opened when needed, but closed after use
+        maxsize=settings.minio_max_connections,
+        timeout=urllib3.Timeout(connect=settings.minio_connect_timeout, read=settings.minio_read_timeout),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+    return Minio(
         f"{host}:9000",
         access_key=settings.minio_root_user,
         secret_key=settings.minio_root_password,
         secure=False,  # Set to True if you use HTTPS.
+        http_client=http_client,
     )
 
+
+def provision_bucket(client: Minio) -> None:
+    """
+    provision_bucket makes the bucket if it doesn't already exist, and has the minIO announce the objects written to it
+
+    Parameters
+    ----------
+    client : Minio
+        client to interact with minIO service
+    """
     # Make a bucket if it doesn't already exist.
     found = client.bucket_exists(BUCKET)
     if not found:
         client.make_bucket(BUCKET)
 
+    # Have MinIO announce the objects written to the bucket, for the workers to process those uploaded directly.
+    if settings.minio_notify_arn is not None:
+        client.set_bucket_notification(
+            BUCKET,
+            NotificationConfig(queue_config_list=[QueueConfig(settings.minio_notify_arn, ["s3:ObjectCreated:*"])]),
+        )
+
+
+@functools.cache
+def get_minio_client() -> Minio:
+    """
+    get_minio_client returns the client of this process that connects with the minIO at `settings.minio_host`,
+    creating it on first use
+
+    The bucket is provisioned when the client is created, so that requests using the client never have
+    to check for it.
+
+    Returns
+    -------
+    Minio
+        client to interact with minIO service, shared by every request of the process
+    """
+    client = create_minio_client(settings.minio_host)
+    provision_bucket(client)
     return client
 
 
-def get_file_size(file: UploadFile) -> int:
+@functools.cache
+def get_presign_client() -> Minio:
+    """
+    get_presign_client returns the client of this process that signs URLs for clients to reach the minIO with
+
+    The client signs for `settings.minio_public_endpoint`, where clients reach the minIO, and never connects
+    to it: signing needs no request as the region is given.
+
+    Returns
+    -------
+    Minio
+        client signing URLs for the minIO service
+    """
+    return Minio(
+        settings.minio_public_endpoint or f"{settings.minio_host}:9000",
+        access_key=settings.minio_root_user,
+        secret_key=settings.minio_root_password,
+        secure=settings.minio_public_secure,
+        region=settings.minio_region,
+    )
+
+
+def presign_upload(user_id: int, filename: str) -> tuple[str, datetime]:
+    """
+    Sign a URL a client can upload a file of a user to directly, with a `PUT` request.
+
+    Parameters
+    ----------
+    user_id : int
+        The ID of the user.
+    filename : str
+        The name of the file.
+
+    Returns
+    -------
+    tuple[str, datetime]
+        The URL, and the UTC datetime at which it expires.
+    """
+    expires = timedelta(seconds=settings.upload_url_expiry)
+    url = get_presign_client().presigned_put_object(BUCKET, f"{user_id}/{filename}", expires)
+    return url, datetime.utcnow() + expires  # noqa: DTZ003
+
+
+class FileTooLargeError(Exception):
+    """Raised when an uploaded file exceeds `settings.upload_max_bytes`."""
+
+
+class InvalidTextError(Exception):
+    """Raised when an uploaded file is not UTF-8 text."""
+
+
+class ValidatingReader(io.RawIOBase):
+    """
+    Reads an uploaded file while checking that it is UTF-8 text within the size limit.
+
+    The file is checked as it is read, so that the upload fails as soon as the limit is exceeded or
+    an invalid byte sequence is met, and counted, so that its size is known once it is read.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        The uploaded file.
+    max_size : int
+        The largest size allowed in bytes.
+    """
+
+    def __init__(self, file: BinaryIO, max_size: int) -> None:
+        self.file = file
+        self.max_size = max_size
+        self.size = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def readable(self) -> bool:  # noqa: PLR6301
+        """Whether the reader can be read, which it always can."""
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read and check the next bytes of the file.
+
+        Parameters
+        ----------
+        size : int, optional
+            The number of bytes to read, by default -1 for the rest of the file.
+
+        Returns
+        -------
+        bytes
+            The bytes read, empty at the end of the file.
+
+        Raises
+        ------
+        FileTooLargeError
+            If the file exceeds the size limit.
+        InvalidTextError
+            If the file is not valid UTF-8.
+        """
+        data = self.file.read(size)
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise FileTooLargeError(self.size)
+        try:
+            self._decoder.decode(data, final=not data)
+        except UnicodeDecodeError as e:
+            raise InvalidTextError(str(e)) from e
+        return data
+
+
+def upload_text(client: Minio, object_name: str, file: BinaryIO, content_type: str) -> tuple[ObjectWriteResult, int]:
+    """
+    Stream an uploaded text file into MinIO, in parts of `settings.upload_part_size` bytes.
+
+    The file is read one part at a time, so that neither the file nor its size has to be known up
+    front, and checked as it is read. An upload failing the checks is aborted, leaving any earlier
+    object under the same name as it was. The transfer blocks, so it is run off the event loop.
+
+    Parameters
+    ----------
+    client : Minio
+        The MinIO client.
+    object_name : str
+        The name of the object in the bucket.
+    file : BinaryIO
+        The uploaded file.
+    content_type : str
+        The MIME type of the file.
+
+    Returns
+    -------
+    tuple[ObjectWriteResult, int]
+        The result of the upload, and the size of the file in bytes.
+
+    Raises
+    ------
+    FileTooLargeError
+        If the file exceeds `settings.upload_max_bytes`.
+    InvalidTextError
+        If the file is not valid UTF-8.
+    """
+    reader = ValidatingReader(file, settings.upload_max_bytes)
+    result = client.put_object(
+        BUCKET,
+        object_name,
+        reader,
+        length=-1,
+        part_size=settings.upload_part_size,
+        content_type=content_type,
+    )
+    return result, reader.size
+
+
+@dataclass
+class UploadEntry:
+    """
+    A file of a bulk upload, either uploaded as such or extracted from an archive.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file, its path within the archive for an extracted file.
+    content_type : str
+        The MIME type of the file.
+    content : BinaryIO | None
+        The content of the file, None if the file is rejected.
+    error : str | None
+        Why the file is rejected, if it is.
+
     """
-    get_file_size calculates the size of an uploaded file.
 
-    This is required as the minIO client put_object method requires the length
-    of the object being uploaded as one of the parameters.
+    filename: str
+    content_type: str
+    content: BinaryIO | None = None
+    error: str | None = None
+
+
+def archive_format(filename: str, content_type: str) -> str | None:
+    """
+    Tell whether an uploaded file is an archive, from its MIME type or its extension.
 
     Parameters
     ----------
-    file : UploadFile
-        file of supported file type that user uploads
+    filename : str
+        The name of the file.
+    content_type : str
+        The MIME type of the file.
 
     Returns
     -------
-    int
-        size of the uploaded file
+    str | None
+        Either "zip" or "tar", or None if the file is not an archive.
     """
+    for archive, (content_types, extensions) in ARCHIVE_TYPES.items():
+        if content_type in content_types or filename.lower().endswith(extensions):
+            return archive
+    return None
+
+
+def entry_name(path: str) -> str | None:
+    """Normalize the path of a file of a bulk upload into a file name, None if it escapes the upload."""
+    name = posixpath.normpath(path.replace("\\", "/")).lstrip("/")
+    if name in {"", "."} or name.startswith("../") or name == "..":
+        return None
+    return name
+
 
-    # Seek to the end of the file to get the file size
-    file.file.seek(0, 2)  # Move the cursor to the end of the file
-    file_size = file.file.tell()
-    file.file.seek(0, 0)  # Move the cursor to the start of the file
-    return file_size
+def extracted_entry(path: str, size: int, member: BinaryIO | None) -> UploadEntry:
+    """Check a file of an archive, and copy its content into a spooled file if it is accepted."""
+    name = entry_name(path)
+    if name is None:
+        return UploadEntry(path, "application/octet-stream", error="Invalid path")
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if content_type != "text/plain":
+        return UploadEntry(name, content_type, error=f"File type of {content_type} is not supported")
+    if size > settings.upload_max_bytes or member is None:
+        return UploadEntry(name, content_type, error=f"File is larger than {settings.upload_max_bytes} bytes")
+    content = tempfile.SpooledTemporaryFile(max_size=settings.upload_part_size)  # noqa: SIM115
+    with member:
+        shutil.copyfileobj(member, content)
+    content.seek(0)
+    return UploadEntry(name, content_type, content)
+
+
+def extract_entries(file: BinaryIO, archive: str, max_files: int) -> Iterator[UploadEntry]:
+    """
+    Extract the files of an archive one at a time, as they are read.
+
+    Each accepted file is copied into a spooled temporary file, kept in memory up to
+    `settings.upload_part_size` bytes, so that it can be stored while the next one is extracted.
+    Tar archives, compressed or not, are read as a stream. Extraction stops after `max_files` files:
+    the next file is rejected, and the rest of the archive is not read.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        The archive.
+    archive : str
+        The format of the archive, either "zip" or "tar".
+    max_files : int
+        The number of files that can still be extracted.
+
+    Yields
+    ------
+    UploadEntry
+        The files of the archive, directories and links excepted.
+
+    Raises
+    ------
+    zipfile.BadZipFile, tarfile.TarError
+        If the archive is invalid.
+    """
+    error = f"More than {settings.upload_bulk_max_files} files in the upload, the rest of the archive was not extracted"
+    if archive == "zip":
+        with zipfile.ZipFile(file) as zip_file:
+            members = [info for info in zip_file.infolist() if not info.is_dir()]
+            for info in members[:max_files]:
+                yield extracted_entry(
+                    info.filename,
+                    info.file_size,
+                    zip_file.open(info) if info.file_size <= settings.upload_max_bytes else None,
+                )
+            if len(members) > max_files:
+                yield UploadEntry(members[max_files].filename, "application/octet-stream", error=error)
+        return
+    with tarfile.open(fileobj=file, mode="r|*") as tar_file:
+        for member in tar_file:
+            if not member.isfile():
+                continue
+            if max_files == 0:
+                yield UploadEntry(member.name, "application/octet-stream", error=error)
+                return
+            max_files -= 1
+            yield extracted_entry(
+                member.name,
+                member.size,
+                tar_file.extractfile(member) if member.size <= settings.upload_max_bytes else None,
+            )
+
+
+def upload_entries(file: BinaryIO, filename: str, content_type: str, max_files: int) -> Iterator[UploadEntry]:
+    """
+    List the files of an uploaded file of a bulk upload: the files of an archive, or the file itself.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        The uploaded file.
+    filename : str
+        The name of the uploaded file.
+    content_type : str
+        The MIME type of the uploaded file.
+    max_files : int
+        The number of files that can still be extracted from an archive, see `extract_entries`.
+
+    Yields
+    ------
+    UploadEntry
+        The files to store, and those rejected. An invalid archive is rejected as a whole.
+    """
+    archive = archive_format(filename, content_type)
+    if archive is None:
+        # Stored under the same names as the files of archives
+        name = entry_name(filename)
+        if name is None:
+            yield UploadEntry(filename, content_type, error="Invalid path")
+        elif content_type != "text/plain":
+            yield UploadEntry(name, content_type, error=f"File type of {content_type} is not supported")
+        else:
+            yield UploadEntry(name, content_type, file)
+        return
+    try:
+        yield from extract_entries(file, archive, max_files)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        yield UploadEntry(filename, content_type, error=f"Invalid {archive} archive: {e}")
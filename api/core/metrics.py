@@ -0,0 +1,117 @@
+"""This module is concerned with in-process counters and gauges exposed in the Prometheus text format."""
+
+import threading
+
+
+class Metric:
+    """
+    A single named value that can be exported.
+
+    Parameters
+    ----------
+    name : str
+        The name the metric is exported under.
+    documentation : str
+        A short description of what the metric measures.
+    kind : str
+        The Prometheus metric type, either "counter" or "gauge".
+
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        """The current value of the metric."""
+        return self._value
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increase the metric by `amount`."""
+        with self._lock:
+            self._value += amount
+
+    def set(self, value: float) -> None:
+        """Set the metric to `value`."""
+        with self._lock:
+            self._value = value
+
+
+_registry: dict[str, Metric] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(name: str, documentation: str, kind: str) -> Metric:
+    with _registry_lock:
+        if name not in _registry:
+            _registry[name] = Metric(name, documentation, kind)
+        return _registry[name]
+
+
+def counter(name: str, documentation: str) -> Metric:
+    """
+    Get the counter registered under `name`, creating it on first use.
+
+    Parameters
+    ----------
+    name : str
+        The name the counter is exported under.
+    documentation : str
+        A short description of what the counter measures.
+
+    Returns
+    -------
+    Metric
+        The registered counter.
+    """
+    return _get_or_create(name, documentation, "counter")
+
+
+def gauge(name: str, documentation: str) -> Metric:
+    """
+    Get the gauge registered under `name`, creating it on first use.
+
+    Parameters
+    ----------
+    name : str
+        The name the gauge is exported under.
+    documentation : str
+        A short description of what the gauge measures.
+
+    Returns
+    -------
+    Metric
+        The registered gauge.
+    """
+    return _get_or_create(name, documentation, "gauge")
+
+
+def collect() -> list[Metric]:
+    """
+    Get every registered metric.
+
+    Returns
+    -------
+    list[Metric]
+        The metrics of the current process, sorted by name.
+    """
+    with _registry_lock:
+        return sorted(_registry.values(), key=lambda m: m.name)
+
+
+def render() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+
+    Returns
+    -------
+    str
+        The metrics of the current process.
+    """
+    return "".join(
+        f"# HELP {m.name} {m.documentation}\n# TYPE {m.name} {m.kind}\n{m.name} {m.value}\n" for m in collect()
+    )
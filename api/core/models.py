@@ -11,10 +11,12 @@ then an error will occur.
 
 from datetime import datetime
 
-from pgvector.sqlalchemy import Vector
 from pydantic import BaseModel, EmailStr
+from sqlalchemy import BigInteger, Column, ForeignKey, Integer, LargeBinary, SmallInteger
 from sqlmodel import AutoString, Field, SQLModel
 
+from api.core import vectors
+
 
 class UserBase(SQLModel):
     """
@@ -133,6 +135,8 @@ class UploadedFile(BaseModel):
 
     Attributes
     ----------
+    id : int
+        The ID of the upload, to follow its ingestion with.
     filename : str
         The name of the uploaded file.
     size : int
@@ -140,16 +144,123 @@ class UploadedFile(BaseModel):
     content_type : str
         The content type of the uploaded file.
     status : str
-        The status of the uploaded file.
+        The ingestion status of the uploaded file, see `IngestRequest`.
 
     """
 
+    id: int
     filename: str
     size: int
     content_type: str
     status: str
 
 
+class DirectUploadCreate(BaseModel):
+    """
+    Request model to upload a file straight to MinIO.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file to upload.
+    content_type : str
+        The content type of the file to upload, by default "text/plain".
+
+    """
+
+    filename: str
+    content_type: str = "text/plain"
+
+
+class DirectUpload(BaseModel):
+    """
+    Response model with the presigned URL to upload a file straight to MinIO with.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file to upload.
+    url : str
+        The URL to upload the file to, with a `PUT` request whose body is the content of the file.
+    expires_at : datetime
+        The UTC datetime after which the URL is no longer valid.
+
+    """
+
+    filename: str
+    url: str
+    expires_at: datetime
+
+
+class DirectUploadComplete(BaseModel):
+    """
+    Request model to finalize an upload straight to MinIO.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the uploaded file.
+
+    """
+
+    filename: str
+
+
+class BulkUploadedFile(BaseModel):
+    """
+    Response model for each file of a bulk upload.
+
+    Attributes
+    ----------
+    filename : str
+        The name of the file, its path within the archive for a file extracted from an archive.
+    id : Optional[int]
+        The ID of the upload, to follow its ingestion with, unless the file was rejected.
+    size : Optional[int]
+        The size of the file, unless the file was rejected.
+    status : str
+        The ingestion status of the file (see `IngestRequest`), or "rejected".
+    error : Optional[str]
+        Why the file was rejected, if it was.
+
+    """
+
+    filename: str
+    id: int | None = None
+    size: int | None = None
+    status: str
+    error: str | None = None
+
+
+class IngestStatus(BaseModel):
+    """
+    Response model for the ingestion status of an uploaded file.
+
+    Attributes
+    ----------
+    id : int
+        The ID of the upload.
+    filename : str
+        The name of the uploaded file.
+    status : str
+        The ingestion status of the file, see `IngestRequest`.
+    file_id : Optional[int]
+        The ID of the stored file metadata, once the file is stored.
+    error : Optional[str]
+        Why the file could not be ingested, if it failed.
+    updated_at : Optional[datetime]
+        The datetime of the last status change.
+
+    """
+
+    id: int
+    filename: str
+    status: str
+    file_id: int | None = None
+    error: str | None = None
+    updated_at: datetime | None = None
+
+
 class FileMetadata(SQLModel, table=True):  # type: ignore[misc]
     """
     Represents metadata for uploaded files including vector embeddings.
@@ -169,7 +280,13 @@ class FileMetadata(SQLModel, table=True):  # type: ignore[misc]
     minio_path : str
         The path to the file in MinIO storage.
     embedding : list[float]
-        The vector embedding of the file content (4096 dimensions).
+        The vector embedding of the file content, pooled from the embeddings of its chunks.
+        Stored in the format set by `settings.embedding_storage`.
+    simhash : Optional[int]
+        The SimHash fingerprint of the file content, see `simhash.fingerprint`.
+    near_duplicate_of : Optional[int]
+        The ID of an earlier file of the same user with nearly the same content. The file has
+        no chunks of its own and is searched with the chunks of that file.
     created_at : Optional[datetime]
         The datetime when the file was uploaded. Defaults to the current UTC time.
 
@@ -181,10 +298,199 @@ class FileMetadata(SQLModel, table=True):  # type: ignore[misc]
     content_type: str
     size: int
     minio_path: str
-    embedding: list[float] = Field(sa_type=Vector(4096))
+    embedding: list[float] = Field(sa_type=vectors.column_type())
+    simhash: int | None = Field(default=None, sa_type=BigInteger)
+    near_duplicate_of: int | None = Field(
+        default=None,
+        sa_column=Column(Integer, ForeignKey("filemetadata.id", ondelete="SET NULL"), nullable=True),
+    )
     created_at: datetime | None = Field(default_factory=datetime.utcnow, nullable=False)
 
 
+class FileChunk(SQLModel, table=True):  # type: ignore[misc]
+    """
+    Represents one chunk of an uploaded file together with its vector embedding.
+
+    Attributes
+    ----------
+    id : Optional[int]
+        The unique identifier of the chunk. It is a primary key.
+    file_id : int
+        The ID of the file metadata the chunk belongs to. Chunks are deleted with their file.
+    chunk_index : int
+        The position of the chunk in the file, starting at 0.
+    start_offset : int
+        The offset of the first character of the chunk in the file content.
+    end_offset : int
+        The offset just past the last character of the chunk in the file content.
+    token_count : int
+        The number of tokens in the chunk.
+    content_hash : Optional[str]
+        SHA-256 hex digest of the chunk content, used to find unchanged chunks when the file is uploaded again,
+        and chunks of identical content to reuse their embedding. Indexed.
+    embedding : list[float]
+        The vector embedding of the chunk content, in the format set by `settings.embedding_storage`.
+
+    """
+
+    id: int | None = Field(default=None, primary_key=True)
+    file_id: int = Field(
+        sa_column=Column(Integer, ForeignKey("filemetadata.id", ondelete="CASCADE"), index=True, nullable=False),
+    )
+    chunk_index: int
+    start_offset: int
+    end_offset: int
+    token_count: int
+    content_hash: str | None = Field(default=None, index=True)
+    embedding: list[float] = Field(sa_type=vectors.column_type())
+
+
+class FileSimhashBand(SQLModel, table=True):  # type: ignore[misc]
+    """
+    Represents one band of the SimHash fingerprint of a file, used to look up near-duplicates.
+
+    Attributes
+    ----------
+    band : int
+        The position of the band in the fingerprint. Part of the primary key.
+    value : int
+        The bits of the fingerprint in the band. Part of the primary key.
+    file_id : int
+        The ID of the file metadata. Part of the primary key. Bands are deleted with their file.
+
+    """
+
+    band: int = Field(sa_column=Column(SmallInteger, primary_key=True))
+    value: int = Field(primary_key=True)
+    file_id: int = Field(
+        sa_column=Column(Integer, ForeignKey("filemetadata.id", ondelete="CASCADE"), primary_key=True),
+    )
+
+
+class ReembedJob(SQLModel, table=True):  # type: ignore[misc]
+    """
+    Represents a job embedding every file again with another model, see `backend.reembed`.
+
+    Attributes
+    ----------
+    id : Optional[int]
+        The unique identifier of the job. It is a primary key.
+    model : str
+        The name of the model the files are embedded with.
+    base_url : str
+        Base URL of the embeddings API serving the model.
+    dimensions : int
+        Number of dimensions of the embeddings of the model.
+    status : str
+        One of "running", "ready" (every file embedded, waiting for the switch), "switched" or "cancelled".
+    checkpoint : int
+        ID of the last file embedded by the current pass over the files.
+    files_done : int
+        Number of files embedded so far.
+    auto_switch : bool
+        Whether to switch to the new embeddings as soon as every file is embedded.
+    created_at : Optional[datetime]
+        The datetime when the job was started. Defaults to the current UTC time.
+    updated_at : Optional[datetime]
+        The datetime of the last progress of the job.
+
+    """
+
+    id: int | None = Field(default=None, primary_key=True)
+    model: str
+    base_url: str
+    dimensions: int
+    status: str = Field(default="running", index=True)
+    checkpoint: int = 0
+    files_done: int = 0
+    auto_switch: bool = False
+    created_at: datetime | None = Field(default_factory=datetime.utcnow, nullable=False)
+    updated_at: datetime | None = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class IngestRequest(SQLModel, table=True):  # type: ignore[misc]
+    """
+    Represents the ingestion of an uploaded file, from the virtual queue of its user (see `scheduling`)
+    to its storage.
+
+    Attributes
+    ----------
+    id : Optional[int]
+        The unique identifier of the request. It is a primary key.
+    user_id : int
+        The ID of the user who uploaded the file.
+    filename : str
+        The name of the uploaded file.
+    content_type : str
+        The MIME type of the file.
+    size : int
+        The size of the file in bytes.
+    etag : Optional[str]
+        The ETag of the uploaded object in MinIO, identifying its content.
+    queue : str
+        The task queue the file is processed on.
+    priority : int
+        The message priority of the task processing the file.
+    finish_tag : float
+        Virtual time at which the file is due under fair queuing; files are dispatched in tag order.
+    status : str
+        The ingestion status of the file: "queued" (waiting in the virtual queue), "dispatched" (sent to the
+        workers), "downloading", "embedding", then "stored" or "failed". A file still queued when it is
+        uploaded again ends as "superseded".
+    file_id : Optional[int]
+        The ID of the file metadata, once the file is stored.
+    error : Optional[str]
+        Why the file could not be ingested, if it failed.
+    created_at : Optional[datetime]
+        The datetime when the file was queued. Defaults to the current UTC time.
+    dispatched_at : Optional[datetime]
+        The datetime when the file was last sent to the workers.
+    updated_at : Optional[datetime]
+        The datetime of the last status change, or of the last time a worker started on the file. Defaults
+        to the current UTC time.
+
+    """
+
+    id: int | None = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    filename: str
+    content_type: str
+    size: int
+    etag: str | None = None
+    queue: str
+    priority: int
+    finish_tag: float = Field(index=True)
+    status: str = Field(default="queued", index=True)
+    file_id: int | None = Field(
+        default=None,
+        sa_column=Column(Integer, ForeignKey("filemetadata.id", ondelete="SET NULL"), nullable=True),
+    )
+    error: str | None = None
+    created_at: datetime | None = Field(default_factory=datetime.utcnow, nullable=False)
+    dispatched_at: datetime | None = None
+    updated_at: datetime | None = Field(default_factory=datetime.utcnow, nullable=False)
+
+
+class QueryEmbeddingCacheEntry(SQLModel, table=True):  # type: ignore[misc]
+    """
+    Represents a cached embedding of a search query, shared by every API process.
+
+    Attributes
+    ----------
+    key : str
+        Hash of the normalized query and the embedding model. It is a primary key.
+    value : bytes
+        The embedding serialized as float32 bytes.
+    expires_at : datetime
+        The datetime after which the entry is no longer used.
+
+    """
+
+    key: str = Field(primary_key=True)
+    value: bytes = Field(sa_type=LargeBinary)
+    expires_at: datetime = Field(index=True)
+
+
 class FileSearchResult(BaseModel):
     """
     Response model for file search results.
@@ -204,7 +510,9 @@ class FileSearchResult(BaseModel):
     created_at : datetime
         When the file was uploaded.
     similarity : float
-        The similarity score between the search query and the file embedding.
+        The similarity score between the search query and the file, pooled over the file's chunks.
+    near_duplicate_of : Optional[int]
+        The ID of the earlier file whose embeddings the file reuses, if it is a near-duplicate.
 
     """
 
@@ -215,3 +523,4 @@ class FileSearchResult(BaseModel):
     user_id: int
     created_at: datetime
     similarity: float
+    near_duplicate_of: int | None = None
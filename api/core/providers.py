@@ -0,0 +1,271 @@
+"""This module is concerned with the services that turn text into vector embeddings.
+
+Every provider exposes the same interface, so the rest of the application does not depend on where
+embeddings come from. The provider used is selected with `settings.embedding_provider`:
+
+- "openai": any HTTP API compatible with the OpenAI embeddings endpoint, such as OpenRouter.
+- "hashing": a deterministic local provider based on feature hashing, for tests and load tests
+  that must not depend on the network.
+"""
+
+import asyncio
+import base64
+import hashlib
+import itertools
+import os
+from typing import Protocol
+
+import httpx
+import numpy as np
+
+from api.core import chunking, vectors
+
+
+def get_openrouter_api_key() -> str:
+    """
+    Get the OpenRouter API key from environment variables.
+
+    Returns
+    -------
+    str
+        The OpenRouter API key.
+
+    Raises
+    ------
+    ValueError
+        If the API key is not found in environment variables.
+
+    """
+    api_key = os.getenv("OPENROUTER_API_KEY")
+    if not api_key:
+        msg = "OPENROUTER_API_KEY environment variable is not set"
+        raise ValueError(msg)
+    return api_key
+
+
+def decode_embedding(value: str | list[float]) -> vectors.Embedding:
+    """
+    Decode an embedding from an API response into a float32 array.
+
+    Parameters
+    ----------
+    value : str | list[float]
+        Either base64 encoded little-endian float32 values, or a list of numbers.
+
+    Returns
+    -------
+    vectors.Embedding
+        The embedding as a float32 array.
+    """
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype="<f4").astype(np.float32, copy=False)
+    return np.asarray(value, dtype=np.float32)
+
+
+class EmbeddingProvider(Protocol):
+    """
+    A service generating vector embeddings.
+
+    Attributes
+    ----------
+    model : str
+        Identifier of the model the embeddings come from.
+    dimensions : int
+        Number of dimensions of the embeddings.
+
+    """
+
+    model: str
+    dimensions: int
+
+    async def embed(self, texts: list[str]) -> list[vectors.Embedding]:
+        """Generate vector embeddings for `texts`, in the same order."""
+
+    async def aclose(self) -> None:
+        """Release the resources held by the provider."""
+
+
+class OpenAICompatibleProvider:
+    """
+    Provider calling an HTTP API compatible with the OpenAI embeddings endpoint.
+
+    A single instance is shared by every call made in a process, so connections to the
+    provider are kept alive and reused instead of paying a new TCP/TLS handshake per call.
+
+    Parameters
+    ----------
+    base_url : str
+        Base URL of the API, the embeddings endpoint is `{base_url}/embeddings`.
+    model : str
+        Name of the model to request.
+    dimensions : int
+        Number of dimensions of the embeddings returned by the model.
+    api_key : str | None
+        The API key. If None, the OpenRouter API key is read from the environment on every request.
+    max_connections : int
+        Maximum number of concurrent connections to the provider.
+    max_keepalive_connections : int
+        Maximum number of idle connections kept open in the pool.
+    keepalive_expiry : float
+        Seconds an idle connection is kept open before it is closed.
+    timeout : float
+        Timeout in seconds for each request.
+    http2 : bool
+        Whether to negotiate HTTP/2 with the provider.
+    encoding_format : str | None, optional
+        Encoding requested for the embeddings, "base64" or "float", by default "base64". Set to
+        None for APIs rejecting the parameter.
+    transport : httpx.AsyncBaseTransport | None, optional
+        Transport used instead of the network, by default None.
+
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        base_url: str,
+        model: str,
+        dimensions: int,
+        api_key: str | None,
+        *,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        timeout: float,
+        http2: bool,
+        encoding_format: str | None = "base64",
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.model = model
+        self.encoding_format = encoding_format
+        self.dimensions = dimensions
+        self._url = f"{base_url.rstrip('/')}/embeddings"
+        self._api_key = api_key
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=timeout,
+            http2=http2,
+            transport=transport,
+        )
+
+    async def embed(self, texts: list[str]) -> list[vectors.Embedding]:
+        """
+        Generate vector embeddings for several texts in a single request.
+
+        Base64 encoded embeddings are decoded straight into float32 arrays, which is much cheaper
+        than parsing thousands of JSON numbers per embedding.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The text contents to embed.
+
+        Returns
+        -------
+        list[vectors.Embedding]
+            The vector embeddings, in the same order as `texts`.
+
+        Raises
+        ------
+        httpx.HTTPError
+            If the API request fails.
+        ValueError
+            If the API response is invalid.
+
+        """
+        body: dict[str, object] = {"model": self.model, "input": texts}
+        if self.encoding_format:
+            body["encoding_format"] = self.encoding_format
+        response = await self._client.post(
+            self._url,
+            headers={
+                "Authorization": f"Bearer {self._api_key or get_openrouter_api_key()}",
+                "Content-Type": "application/json",
+            },
+            json=body,
+        )
+
+        response.raise_for_status()
+        data = response.json()
+
+        # Extract embeddings from response
+        # OpenAI compatible APIs return: {"data": [{"embedding": [...], "index": 0, ...}], "usage": {...}}
+        if "data" not in data or len(data["data"]) != len(texts):
+            msg = f"Invalid response from embeddings API at {self._url}"
+            raise ValueError(msg)
+
+        items = sorted(data["data"], key=lambda item: item.get("index", 0))
+        return [decode_embedding(item["embedding"]) for item in items]
+
+    async def aclose(self) -> None:
+        """Close all pooled connections."""
+        await self._client.aclose()
+
+
+class HashingProvider:
+    """
+    Deterministic local provider embedding texts with the hashing trick.
+
+    Each token and each pair of adjacent tokens is hashed to a dimension and a sign, and the
+    resulting bag of features is scaled to unit length. Texts sharing words get similar
+    embeddings, which is enough to exercise ingestion and search end to end without a network.
+
+    Parameters
+    ----------
+    dimensions : int
+        Number of dimensions of the embeddings.
+
+    """
+
+    model = "local/feature-hashing"
+
+    def __init__(self, dimensions: int) -> None:
+        self.dimensions = dimensions
+
+    def embed_one(self, text: str) -> vectors.Embedding:
+        """
+        Generate the vector embedding of one text.
+
+        Parameters
+        ----------
+        text : str
+            The text content to embed.
+
+        Returns
+        -------
+        vectors.Embedding
+            The vector embedding, of unit length unless the text has no token.
+        """
+        tokens = [match.group().casefold() for match in chunking.TOKEN_PATTERN.finditer(text)]
+        features = tokens + [f"{first} {second}" for first, second in itertools.pairwise(tokens)]
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest()) for feature in features],
+            dtype=np.uint64,
+        )
+        vector = np.zeros(self.dimensions, dtype=np.float64)
+        signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+        np.add.at(vector, (hashes % np.uint64(self.dimensions)).astype(np.intp), signs)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+    async def embed(self, texts: list[str]) -> list[vectors.Embedding]:
+        """
+        Generate vector embeddings for several texts.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The text contents to embed.
+
+        Returns
+        -------
+        list[vectors.Embedding]
+            The vector embeddings, in the same order as `texts`.
+        """
+        return await asyncio.to_thread(lambda: [self.embed_one(text) for text in texts])
+
+    async def aclose(self) -> None:
+        """Nothing to release."""
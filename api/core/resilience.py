@@ -0,0 +1,460 @@
+"""This module is concerned with keeping calls to the embedding provider within its real capacity.
+
+`ResilientProvider` wraps a provider with three mechanisms:
+
+- `AdaptiveConcurrencyLimiter` caps the number of requests in flight, growing the cap additively while
+  responses are fast and halving it on rate limiting, timeouts or slow responses (AIMD).
+- `RetryBudget` lets transient failures be retried with jittered exponential backoff, but only while
+  retries stay a small fraction of the requests, so a struggling provider is not hit by a retry storm.
+- `CircuitBreaker` fails fast while the provider keeps failing, and lets a single probe through
+  once a cool-down has elapsed.
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from api.core import metrics, providers, vectors
+
+concurrency_limit_gauge = metrics.gauge(
+    "embedding_concurrency_limit",
+    "Limit of concurrent embedding requests.",
+)
+retries_counter = metrics.counter("embedding_retries_total", "Embedding requests retried after a transient failure.")
+circuit_open_counter = metrics.counter("embedding_circuit_opened_total", "Times the embedding circuit breaker opened.")
+
+
+class ProviderUnavailableError(Exception):
+    """
+    Raised when the embedding provider is considered unhealthy and is not called.
+
+    Parameters
+    ----------
+    message : str
+        Description of why the provider is unavailable.
+    retry_after : float
+        Seconds after which the provider may be tried again.
+
+    """
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    Whether an error from the provider is worth retrying.
+
+    Parameters
+    ----------
+    exc : BaseException
+        The error raised by the provider.
+
+    Returns
+    -------
+    bool
+        True for timeouts, connection errors, rate limiting and server errors.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500  # noqa: PLR2004
+    return isinstance(exc, httpx.TransportError)
+
+
+def is_overload(exc: BaseException) -> bool:
+    """
+    Whether an error from the provider signals that it is receiving more than it can handle.
+
+    Parameters
+    ----------
+    exc : BaseException
+        The error raised by the provider.
+
+    Returns
+    -------
+    bool
+        True for timeouts, 429 Too Many Requests and 503 Service Unavailable.
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in {429, 503}
+    return isinstance(exc, httpx.TimeoutException)
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """
+    Read the delay requested by the provider in the `Retry-After` header of an error response.
+
+    Parameters
+    ----------
+    exc : BaseException
+        The error raised by the provider.
+
+    Returns
+    -------
+    float | None
+        The delay in seconds, or None if the provider did not request one.
+    """
+    if not isinstance(exc, httpx.HTTPStatusError) or "Retry-After" not in exc.response.headers:
+        return None
+    value = exc.response.headers["Retry-After"]
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits concurrent requests with a limit adjusted by additive increase and multiplicative decrease.
+
+    Parameters
+    ----------
+    initial_limit : int
+        The limit before any response has been observed.
+    min_limit : int
+        The limit never goes below this value.
+    max_limit : int
+        The limit never goes above this value.
+    latency_target : float
+        Responses slower than this many seconds are treated as a sign of overload.
+    backoff_ratio : float, optional
+        Factor applied to the limit on overload, by default 0.5.
+    clock : Callable[[], float], optional
+        Source of the current time in seconds, by default `time.monotonic`.
+
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+        *,
+        backoff_ratio: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self._clock = clock
+        self._decreased_at: float | None = None
+        self.limit = float(initial_limit)
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        concurrency_limit_gauge.set(self.limit)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Wait until a request may be sent, and hold a slot while it is in flight."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Waiters and slots of another (closed) loop will never be released.
+            self._loop = loop
+            self._waiters.clear()
+            self.in_flight = 0
+        while self.in_flight >= int(self.limit):
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    def on_success(self, latency: float) -> None:
+        """Record a successful response that took `latency` seconds."""
+        if latency > self.latency_target:
+            self.on_overload()
+            return
+        self.limit = min(self.limit + 1 / self.limit, float(self.max_limit))
+        concurrency_limit_gauge.set(self.limit)
+        self._wake()
+
+    def on_overload(self) -> None:
+        """Record a response showing the provider is overloaded."""
+        # Requests already in flight when the limit was cut report the same overload; count it once.
+        now = self._clock()
+        if self._decreased_at is not None and now - self._decreased_at < self.latency_target:
+            return
+        self._decreased_at = now
+        self.limit = max(self.limit * self.backoff_ratio, float(self.min_limit))
+        concurrency_limit_gauge.set(self.limit)
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        for waiter in list(self._waiters)[: max(free, 0)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of the requests made.
+
+    Every request deposits `ratio` of a token and every retry withdraws a whole one. A small reserve
+    refilled at `min_per_second` keeps retries possible when there is little traffic.
+
+    Parameters
+    ----------
+    ratio : float
+        Fraction of the requests that may be retried.
+    min_per_second : float
+        Retries allowed per second regardless of the traffic.
+    max_balance : float
+        Maximum number of tokens that can be saved up.
+    clock : Callable[[], float], optional
+        Source of the current time in seconds, by default `time.monotonic`.
+
+    """
+
+    def __init__(
+        self,
+        ratio: float,
+        min_per_second: float,
+        max_balance: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self._clock = clock
+        self._balance = 0.0
+        self._refilled_at = clock()
+
+    def record_request(self) -> None:
+        """Deposit the share of a new request."""
+        self._balance = min(self._balance + self.ratio, self.max_balance)
+
+    def try_withdraw(self) -> bool:
+        """Take a token for a retry, returning False if the budget is exhausted."""
+        now = self._clock()
+        self._balance = min(self._balance + (now - self._refilled_at) * self.min_per_second, self.max_balance)
+        self._refilled_at = now
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing provider until it has had time to recover.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail immediately. Once
+    `reset_timeout` seconds have passed, a single probe call is let through: its success closes the
+    circuit and its failure opens it again.
+
+    Parameters
+    ----------
+    failure_threshold : int
+        Number of consecutive failures that open the circuit.
+    reset_timeout : float
+        Seconds the circuit stays open before a probe is allowed.
+    clock : Callable[[], float], optional
+        Source of the current time in seconds, by default `time.monotonic`.
+
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """Either "closed", "open" or "half-open"."""
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or self._clock() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """
+        Check whether a call may be made.
+
+        Returns
+        -------
+        bool
+            Whether the call is the probe of a half-open circuit.
+
+        Raises
+        ------
+        ProviderUnavailableError
+            If the circuit is open, or half-open with a probe already in flight.
+        """
+        if self._opened_at is None:
+            return False
+        remaining = self._opened_at + self.reset_timeout - self._clock()
+        if remaining > 0 or self._probing:
+            msg = "Embedding provider is unavailable"
+            raise ProviderUnavailableError(msg, retry_after=max(remaining, 1.0))
+        self._probing = True
+        return True
+
+    def release_probe(self) -> None:
+        """Give up the probe in flight without an outcome, such as when it is cancelled, letting another call probe."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        """Record a successful call, closing the circuit."""
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        """Record a failed call, opening the circuit if there were too many."""
+        self._failures += 1
+        if self._probing or self._failures >= self.failure_threshold:
+            if self._opened_at is None or self._probing:
+                circuit_open_counter.inc()
+            self._opened_at = self._clock()
+            self._probing = False
+
+
+class ResilientProvider:
+    """
+    Provider calling another provider under an adaptive concurrency limit, a retry budget and a circuit breaker.
+
+    Parameters
+    ----------
+    provider : providers.EmbeddingProvider
+        The provider being protected.
+    limiter : AdaptiveConcurrencyLimiter
+        Limits the requests in flight.
+    retry_budget : RetryBudget
+        Limits how many failed requests are retried.
+    circuit_breaker : CircuitBreaker
+        Stops calls while the provider is unhealthy.
+    max_retries : int
+        Maximum number of retries of one request.
+    backoff : float
+        Base delay in seconds of the exponential backoff between retries.
+    max_backoff : float
+        Maximum delay in seconds between retries.
+
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        provider: providers.EmbeddingProvider,
+        limiter: AdaptiveConcurrencyLimiter,
+        retry_budget: RetryBudget,
+        circuit_breaker: CircuitBreaker,
+        *,
+        max_retries: int,
+        backoff: float,
+        max_backoff: float,
+    ) -> None:
+        self.provider = provider
+        self.limiter = limiter
+        self.retry_budget = retry_budget
+        self.circuit_breaker = circuit_breaker
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @property
+    def model(self) -> str:
+        """Identifier of the model the embeddings come from."""
+        return self.provider.model
+
+    @property
+    def dimensions(self) -> int:
+        """Number of dimensions of the embeddings."""
+        return self.provider.dimensions
+
+    async def embed(self, texts: list[str]) -> list[vectors.Embedding]:
+        """
+        Generate vector embeddings for `texts`, retrying transient failures within the budget.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The text contents to embed.
+
+        Returns
+        -------
+        list[vectors.Embedding]
+            The vector embeddings, in the same order as `texts`.
+
+        Raises
+        ------
+        ProviderUnavailableError
+            If the circuit breaker is open.
+        httpx.HTTPError
+            If the request fails and cannot be retried.
+        ValueError
+            If the API response is invalid.
+        """
+        self.retry_budget.record_request()
+        for attempt in range(self.max_retries + 1):
+            probe = self.circuit_breaker.before_call()
+            try:
+                return await self._attempt(texts)
+            except asyncio.CancelledError:
+                # A cancelled probe, such as the losing request of a hedged call, must not hold the circuit
+                if probe:
+                    self.circuit_breaker.release_probe()
+                raise
+            except Exception as exc:
+                if not is_transient(exc) or attempt == self.max_retries or not self.retry_budget.try_withdraw():
+                    raise
+                # Full jitter, unless the provider asked for a specific delay.
+                delay = retry_after(exc)
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff * 2**attempt, self.max_backoff))  # noqa: S311
+                retries_counter.inc()
+                await asyncio.sleep(delay)
+        msg = "Unreachable"
+        raise AssertionError(msg)
+
+    async def _attempt(self, texts: list[str]) -> list[vectors.Embedding]:
+        async with self.limiter.slot():
+            started = time.monotonic()
+            try:
+                embeddings = await self.provider.embed(texts)
+            except Exception as exc:
+                if is_transient(exc):
+                    self.circuit_breaker.record_failure()
+                else:
+                    # The provider answered, the request itself was at fault.
+                    self.circuit_breaker.record_success()
+                if is_overload(exc):
+                    self.limiter.on_overload()
+                raise
+            self.limiter.on_success(time.monotonic() - started)
+            self.circuit_breaker.record_success()
+            return embeddings
+
+    async def aclose(self) -> None:
+        """Release the resources held by the protected provider."""
+        await self.provider.aclose()
@@ -0,0 +1,260 @@
+"""This module is concerned with spreading embedding requests over several endpoints serving the same model.
+
+`HedgedRouter` ranks its endpoints by an exponentially weighted moving average (EWMA) of their latency
+and error rate. Background work is sent to the best endpoint and fails over down the ranking. Interactive
+work is hedged: when the endpoint called first has not answered within a high percentile of its recent
+latencies, the same request is also sent to the next endpoint, and the first good answer wins.
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from collections.abc import Callable
+
+import numpy as np
+
+from api.core import metrics, providers, resilience, vectors
+
+hedged_requests = metrics.counter("embedding_hedged_requests_total", "Embedding requests hedged to another endpoint.")
+failovers = metrics.counter("embedding_failovers_total", "Embedding requests failed over to another endpoint.")
+
+# Number of latency samples needed before the hedging deadline is taken from their percentile
+MIN_LATENCY_SAMPLES = 20
+
+
+def is_failover(exc: BaseException) -> bool:
+    """
+    Whether an error from one endpoint may not happen on another one.
+
+    Parameters
+    ----------
+    exc : BaseException
+        The error raised by the endpoint.
+
+    Returns
+    -------
+    bool
+        True if the endpoint is unavailable or failed transiently. Invalid requests fail everywhere.
+    """
+    return isinstance(exc, resilience.ProviderUnavailableError) or resilience.is_transient(exc)
+
+
+class EndpointStats:
+    """
+    Latency and error statistics of one endpoint.
+
+    Parameters
+    ----------
+    alpha : float
+        Weight of each new observation in the moving averages.
+    window : int
+        Number of recent latencies kept to compute percentiles.
+
+    """
+
+    def __init__(self, alpha: float, window: int) -> None:
+        self.alpha = alpha
+        self.latency: float | None = None
+        self.error_rate = 0.0
+        self.latencies: deque[float] = deque(maxlen=window)
+
+    def record_success(self, latency: float) -> None:
+        """Record an answer received after `latency` seconds."""
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        self.error_rate *= 1 - self.alpha
+        self.latencies.append(latency)
+
+    def record_failure(self) -> None:
+        """Record a failed request."""
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+
+    @property
+    def score(self) -> float:
+        """Expected cost of a request, lower is better; endpoints never heard from rank last."""
+        if self.latency is None:
+            return math.inf
+        return self.latency / max(1 - self.error_rate, 0.01)
+
+    def percentile(self, q: float) -> float | None:
+        """The `q` quantile of the recent latencies, or None while there are too few of them."""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return float(np.quantile(self.latencies, q))
+
+
+class HedgedRouter:
+    """
+    Provider routing requests over several endpoints that produce embeddings in the same space.
+
+    Parameters
+    ----------
+    endpoints : list[providers.EmbeddingProvider]
+        The endpoints, in order of preference while they have no statistics.
+    alpha : float
+        Weight of each new observation in the moving averages of latency and error rate.
+    hedge_percentile : float
+        Quantile of an endpoint's recent latencies after which a request to it is hedged.
+    min_hedge_delay : float
+        Minimum seconds before a request is hedged.
+    initial_hedge_delay : float
+        Seconds before a request is hedged while the endpoint has too few latency samples.
+    window : int, optional
+        Number of recent latencies kept per endpoint, by default 200.
+    clock : Callable[[], float], optional
+        Monotonic time source, by default `time.monotonic`.
+
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        endpoints: list[providers.EmbeddingProvider],
+        *,
+        alpha: float,
+        hedge_percentile: float,
+        min_hedge_delay: float,
+        initial_hedge_delay: float,
+        window: int = 200,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if not endpoints:
+            msg = "At least one endpoint is required"
+            raise ValueError(msg)
+        self.endpoints = endpoints
+        self.stats = [EndpointStats(alpha, window) for _ in endpoints]
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.initial_hedge_delay = initial_hedge_delay
+        self.clock = clock
+
+    @property
+    def model(self) -> str:
+        """Identifier of the model the embeddings come from, the one of the preferred endpoint."""
+        return self.endpoints[0].model
+
+    @property
+    def dimensions(self) -> int:
+        """Number of dimensions of the embeddings."""
+        return self.endpoints[0].dimensions
+
+    def ranked(self) -> list[int]:
+        """Indices of the endpoints from best to worst score, ties keeping the configured order."""
+        return sorted(range(len(self.endpoints)), key=lambda i: self.stats[i].score)
+
+    def hedge_delay(self, index: int) -> float:
+        """Seconds to wait for endpoint `index` before hedging a request sent to it."""
+        delay = self.stats[index].percentile(self.hedge_percentile)
+        return max(self.initial_hedge_delay if delay is None else delay, self.min_hedge_delay)
+
+    async def _call(self, index: int, texts: list[str]) -> list[vectors.Embedding]:
+        started = self.clock()
+        try:
+            embeddings = await self.endpoints[index].embed(texts)
+        except Exception as exc:
+            if is_failover(exc):
+                self.stats[index].record_failure()
+            raise
+        self.stats[index].record_success(self.clock() - started)
+        return embeddings
+
+    async def embed(self, texts: list[str]) -> list[vectors.Embedding]:
+        """
+        Generate vector embeddings with the best endpoint, failing over to the next ones.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The text contents to embed.
+
+        Returns
+        -------
+        list[vectors.Embedding]
+            The vector embeddings, in the same order as `texts`.
+
+        Raises
+        ------
+        resilience.ProviderUnavailableError
+            If every endpoint is unavailable.
+        httpx.HTTPError
+            If the request is invalid, or fails on every endpoint.
+        ValueError
+            If an API response is invalid.
+        """
+        ranked = self.ranked()
+        for position, index in enumerate(ranked):
+            try:
+                return await self._call(index, texts)
+            except Exception as exc:
+                if not is_failover(exc) or position == len(ranked) - 1:
+                    raise
+                failovers.inc()
+        msg = "Unreachable"
+        raise AssertionError(msg)
+
+    async def embed_hedged(self, texts: list[str]) -> list[vectors.Embedding]:
+        """
+        Generate vector embeddings, hedging slow requests to the next best endpoint.
+
+        A request is sent to the next endpoint when the last one called has not answered within its
+        hedging deadline, or as soon as every request in flight has failed. The first good answer
+        wins and the other requests are cancelled.
+
+        Parameters
+        ----------
+        texts : list[str]
+            The text contents to embed.
+
+        Returns
+        -------
+        list[vectors.Embedding]
+            The vector embeddings, in the same order as `texts`.
+
+        Raises
+        ------
+        resilience.ProviderUnavailableError
+            If every endpoint is unavailable.
+        httpx.HTTPError
+            If the request is invalid, or fails on every endpoint.
+        ValueError
+            If an API response is invalid.
+        """
+        ranked = self.ranked()
+        launched = 0
+        in_flight: set[asyncio.Task] = set()
+        error: BaseException | None = None
+
+        def launch() -> None:
+            nonlocal launched
+            in_flight.add(asyncio.ensure_future(self._call(ranked[launched], texts)))
+            launched += 1
+
+        launch()
+        try:
+            while in_flight:
+                can_hedge = launched < len(ranked)
+                done, in_flight = await asyncio.wait(
+                    in_flight,
+                    timeout=self.hedge_delay(ranked[launched - 1]) if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    exc = task.exception()
+                    if exc is None:
+                        return task.result()
+                    if not is_failover(exc):
+                        raise exc
+                    error = exc
+                if can_hedge and not done:
+                    hedged_requests.inc()
+                    launch()
+                elif can_hedge and not in_flight:
+                    failovers.inc()
+                    launch()
+        finally:
+            for task in in_flight:
+                task.cancel()
+        raise error  # type: ignore[misc]
+
+    async def aclose(self) -> None:
+        """Release the resources held by every endpoint."""
+        await asyncio.gather(*(endpoint.aclose() for endpoint in self.endpoints))
@@ -0,0 +1,533 @@
+"""This module is concerned with sharing the workers fairly between the users uploading files.
+
+Uploaded files wait in a virtual queue per user, stored in the `ingestrequest` table, and only a bounded
+number of them is sent to the broker at a time. Files are dispatched by weighted fair queuing: each file
+gets a finish tag, the virtual time at which it is due, which advances by the cost of the file divided by
+the weight of its user from the later of the user's previous tag and the current virtual time. Files are
+sent in tag order, so a user queuing thousands of files only gets ahead of the others by the cost of
+their files in flight, and a user queuing a single file is served next. Each user may have at most
+`settings.ingest_user_max_in_flight` files in flight, so that the workers are never all busy with
+one user's files.
+
+Uploading the same content again while it is queued or processed does not queue it twice, so that
+clients retrying uploads do not cost the workers and the embedding provider anything.
+
+Dispatching happens when files are uploaded, when workers finish a batch of files, and periodically to
+send again the files whose task was lost. The rows of the queues also record the ingestion status of each
+file until `settings.ingest_status_retention` after it was stored or failed.
+"""
+
+import itertools
+import json
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+
+from celery import Celery
+from sqlalchemy import Connection, text
+from sqlmodel import Session, col, select
+
+from api.core import celery, metrics, models
+from api.core.config import settings
+
+# Longest error message kept for a failed file
+MAX_ERROR_LENGTH = 1000
+
+# Cost of a file on top of its size, so that many small files are not nearly free
+FILE_OVERHEAD_BYTES = 64 * 1024
+
+# Statuses of the files waiting in the virtual queues or being processed
+ACTIVE_STATUSES = ("queued", "dispatched", "downloading", "embedding")
+
+dispatched_files = metrics.counter("ingest_dispatched_files_total", "Uploaded files sent to the workers.")
+coalesced_files = metrics.counter(
+    "ingest_coalesced_files_total",
+    "Uploads attached to an identical one in progress.",
+)
+
+
+def cost(size: int, user_id: int) -> float:
+    """
+    Virtual time taken by a file of a user.
+
+    Parameters
+    ----------
+    size : int
+        The size of the file in bytes.
+    user_id : int
+        The ID of the user who uploaded the file.
+
+    Returns
+    -------
+    float
+        The size of the file and the overhead of a file, divided by the weight of the user.
+    """
+    return (size + FILE_OVERHEAD_BYTES) / settings.ingest_user_weights.get(user_id, 1.0)
+
+
+def enqueue(  # noqa: PLR0913, PLR0917
+    session: Session,
+    user_id: int,
+    filename: str,
+    content_type: str,
+    size: int,
+    etag: str | None = None,
+) -> models.IngestRequest:
+    """
+    Add an uploaded file to the virtual queue of its user, unless the same content is already on its way.
+
+    Uploads of the same file with the same ETag are coalesced: while one of them is queued or in flight,
+    the others attach to it. An upload with a different content supersedes the one still waiting, as only
+    the last upload is left in MinIO, and waits for the one in flight to finish (see `dispatch`).
+
+    Parameters
+    ----------
+    session : Session
+        The session to interact with the database, committed by the caller.
+    user_id : int
+        The ID of the user who uploaded the file.
+    filename : str
+        The name of the uploaded file.
+    content_type : str
+        The MIME type of the file.
+    size : int
+        The size of the file in bytes.
+    etag : str | None, optional
+        The ETag of the uploaded object, by default None for a content that is never coalesced.
+
+    Returns
+    -------
+    models.IngestRequest
+        The queued request, or the request the upload was attached to.
+    """
+    # Uploads of a file are queued one at a time, so that concurrent ones see each other
+    session.execute(
+        text("SELECT pg_advisory_xact_lock(:user_id, hashtext(:filename))"),
+        {"user_id": user_id, "filename": filename},
+    )
+    if etag is not None:
+        active = session.exec(
+            select(models.IngestRequest)
+            .where(
+                models.IngestRequest.user_id == user_id,
+                models.IngestRequest.filename == filename,
+                models.IngestRequest.etag == etag,
+                col(models.IngestRequest.status).in_(ACTIVE_STATUSES),
+            )
+            .order_by(col(models.IngestRequest.id).desc()),
+        ).first()
+        if active is not None:
+            coalesced_files.inc()
+            return active
+
+    session.execute(
+        text(
+            "UPDATE ingestrequest SET status = 'superseded', updated_at = :now "
+            "WHERE user_id = :user_id AND filename = :filename AND status = 'queued'",
+        ),
+        {"user_id": user_id, "filename": filename, "now": datetime.utcnow()},  # noqa: DTZ003
+    )
+    user_tag, virtual_time = session.execute(
+        text(
+            "SELECT (SELECT max(finish_tag) FROM ingestrequest WHERE user_id = :user_id "
+            "AND status IN ('queued', 'dispatched', 'downloading', 'embedding')), "
+            "COALESCE("
+            "(SELECT max(finish_tag) FROM ingestrequest WHERE status IN ('dispatched', 'downloading', 'embedding')), "
+            "(SELECT min(finish_tag) FROM ingestrequest WHERE status = 'queued'), 0)",
+        ),
+        {"user_id": user_id},
+    ).one()
+    queue, priority = celery.ingest_route(size, content_type)
+    request = models.IngestRequest(
+        user_id=user_id,
+        filename=filename,
+        content_type=content_type,
+        size=size,
+        etag=etag,
+        queue=queue,
+        priority=priority,
+        finish_tag=max(user_tag or 0.0, virtual_time) + cost(size, user_id),
+    )
+    session.add(request)
+    return request
+
+
+def batches(rows: list, queue: str) -> Iterator[list]:
+    """
+    Split the files dispatched to a queue into the batches processed by one task each.
+
+    Each of the `settings.ingest_concurrency` threads of a worker holds a whole batch in memory, together
+    with the embeddings of its chunks, so batches are bounded in bytes as well as in files.
+    """
+    # Large files gain little from sharing a task, and would hold up each other in it
+    if queue == celery.LARGE_FILES_QUEUE:
+        yield from itertools.batched(rows, 1)
+        return
+    batch, batch_bytes = [], 0
+    for row in rows:
+        if batch and (
+            len(batch) == settings.ingest_batch_max_files or batch_bytes + row.size > settings.ingest_batch_max_bytes
+        ):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(row)
+        batch_bytes += row.size
+    if batch:
+        yield batch
+
+
+def dispatch(connection: Connection, client: Celery) -> list[int]:
+    """
+    Send the files that are next in fair queuing order to the workers, as far as capacity allows.
+
+    Dispatching is serialized between processes. A new upload of a file waits until the previous one in
+    flight is done, so that its last content is stored last. Files in flight that no worker reported on
+    for `settings.ingest_dispatch_timeout` seconds since they were sent are considered lost and sent again,
+    unless a newer upload of the file is queued: the lost one is superseded by it instead.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database, whose transaction is committed by the caller.
+    client : Celery
+        The Celery app the `process_files` tasks are sent with.
+
+    Returns
+    -------
+    list[int]
+        The IDs of the requests dispatched.
+    """
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('ingest_dispatch'))"))
+    now = datetime.utcnow()  # noqa: DTZ003
+    params = {
+        "now": now,
+        "lost_before": now - timedelta(seconds=settings.ingest_dispatch_timeout),
+        "user_cap": settings.ingest_user_max_in_flight,
+        "user_caps": json.dumps({str(user_id): cap for user_id, cap in settings.ingest_user_caps.items()}),
+    }
+    # Sending a lost upload again next to a newer one would let its older content be stored last
+    connection.execute(
+        text(
+            "UPDATE ingestrequest p SET status = 'superseded', updated_at = :now "
+            "WHERE p.status IN ('dispatched', 'downloading', 'embedding') AND p.updated_at <= :lost_before "
+            "AND EXISTS ("
+            "    SELECT 1 FROM ingestrequest q WHERE q.user_id = p.user_id AND q.filename = p.filename "
+            "    AND q.status = 'queued'"
+            ")",
+        ),
+        params,
+    )
+    in_flight = connection.execute(
+        text(
+            "SELECT count(*) FROM ingestrequest "
+            "WHERE status IN ('dispatched', 'downloading', 'embedding') AND updated_at > :lost_before",
+        ),
+        params,
+    ).scalar_one()
+    capacity = settings.ingest_max_in_flight - in_flight
+    if capacity <= 0:
+        return []
+
+    rows = connection.execute(
+        text(
+            "WITH in_flight AS ("
+            "    SELECT user_id, count(*) AS files FROM ingestrequest "
+            "    WHERE status IN ('dispatched', 'downloading', 'embedding') AND updated_at > :lost_before "
+            "    GROUP BY user_id"
+            "), waiting AS ("
+            "    SELECT id, user_id, filename, content_type, size, queue, priority, finish_tag, "
+            "    row_number() OVER (PARTITION BY user_id ORDER BY finish_tag, id) AS position "
+            "    FROM ingestrequest r WHERE (status = 'queued' AND NOT EXISTS ("
+            "        SELECT 1 FROM ingestrequest p WHERE p.user_id = r.user_id AND p.filename = r.filename "
+            "        AND p.status IN ('dispatched', 'downloading', 'embedding')"
+            "    )) "
+            "    OR (status IN ('dispatched', 'downloading', 'embedding') AND updated_at <= :lost_before)"
+            ") "
+            "SELECT w.id, w.user_id, w.filename, w.content_type, w.size, w.queue, w.priority FROM waiting w "
+            "LEFT JOIN in_flight f ON f.user_id = w.user_id "
+            "WHERE w.position <= COALESCE(CAST(CAST(:user_caps AS jsonb) ->> CAST(w.user_id AS text) AS integer), "
+            ":user_cap) - COALESCE(f.files, 0) "
+            "ORDER BY w.finish_tag, w.id LIMIT :capacity",
+        ),
+        {**params, "capacity": capacity},
+    ).all()
+    if not rows:
+        return []
+
+    connection.execute(
+        text(
+            "UPDATE ingestrequest SET status = 'dispatched', dispatched_at = :now, updated_at = :now "
+            "WHERE id = ANY(:ids)",
+        ),
+        {**params, "ids": [row.id for row in rows]},
+    )
+    routes = sorted({(row.queue, row.priority) for row in rows}, key=lambda route: -route[1])
+    for queue, priority in routes:
+        routed = [row for row in rows if (row.queue, row.priority) == (queue, priority)]
+        for batch in batches(routed, queue):
+            client.send_task(
+                name="process_files",
+                args=[[[row.user_id, row.filename, row.content_type] for row in batch]],
+                queue=queue,
+                priority=priority,
+            )
+    dispatched_files.inc(len(rows))
+    return [row.id for row in rows]
+
+
+def start(connection: Connection, started: list[tuple[int, str]]) -> None:
+    """
+    Record that a worker started processing files in flight, so that they are not taken for lost meanwhile.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database, whose transaction is committed by the caller.
+    started : list[tuple[int, str]]
+        The ID of the user who uploaded each file and the name of the file.
+    """
+    connection.execute(
+        text(
+            "UPDATE ingestrequest r SET updated_at = :now "
+            "FROM unnest(CAST(:user_ids AS integer[]), CAST(:filenames AS text[])) AS s(user_id, filename) "
+            "WHERE r.user_id = s.user_id AND r.filename = s.filename "
+            "AND r.status IN ('dispatched', 'downloading', 'embedding')",
+        ),
+        {
+            "now": datetime.utcnow(),  # noqa: DTZ003
+            "user_ids": [user_id for user_id, _ in started],
+            "filenames": [filename for _, filename in started],
+        },
+    )
+
+
+def mark(connection: Connection, user_id: int, filename: str, status: str) -> None:
+    """
+    Record the stage a file in flight has reached.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database, whose transaction is committed by the caller.
+    user_id : int
+        The ID of the user who uploaded the file.
+    filename : str
+        The name of the file.
+    status : str
+        Either "downloading" or "embedding".
+    """
+    connection.execute(
+        text(
+            "UPDATE ingestrequest SET status = :status, updated_at = :now "
+            "WHERE user_id = :user_id AND filename = :filename "
+            "AND status IN ('dispatched', 'downloading', 'embedding')",
+        ),
+        {"user_id": user_id, "filename": filename, "status": status, "now": datetime.utcnow()},  # noqa: DTZ003
+    )
+
+
+def complete(connection: Connection, stored: list[tuple[int, str]], failed: list[tuple[int, str, str]]) -> None:
+    """
+    Record the outcome of processed files, freeing capacity in the virtual queues for the next ones.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database, whose transaction is committed by the caller.
+    stored : list[tuple[int, str]]
+        The ID of the user who uploaded each stored file and the name of the file.
+    failed : list[tuple[int, str, str]]
+        The ID of the user who uploaded each failed file, the name of the file and the error.
+    """
+    now = datetime.utcnow()  # noqa: DTZ003
+    if stored:
+        connection.execute(
+            text(
+                "UPDATE ingestrequest r SET status = 'stored', updated_at = :now, file_id = ("
+                "    SELECT max(f.id) FROM filemetadata f WHERE f.user_id = r.user_id AND f.filename = r.filename"
+                ") "
+                "WHERE status IN ('dispatched', 'downloading', 'embedding') AND (user_id, filename) IN "
+                "(SELECT * FROM unnest(CAST(:user_ids AS integer[]), CAST(:filenames AS text[])))",
+            ),
+            {
+                "now": now,
+                "user_ids": [user_id for user_id, _ in stored],
+                "filenames": [filename for _, filename in stored],
+            },
+        )
+    if failed:
+        connection.execute(
+            text(
+                "UPDATE ingestrequest r SET status = 'failed', updated_at = :now, error = e.error "
+                "FROM unnest(CAST(:user_ids AS integer[]), CAST(:filenames AS text[]), CAST(:errors AS text[])) "
+                "AS e(user_id, filename, error) "
+                "WHERE r.user_id = e.user_id AND r.filename = e.filename "
+                "AND r.status IN ('dispatched', 'downloading', 'embedding')",
+            ),
+            {
+                "now": now,
+                "user_ids": [user_id for user_id, _, _ in failed],
+                "filenames": [filename for _, filename, _ in failed],
+                # Notifications carrying the error are limited in size
+                "errors": [error[:MAX_ERROR_LENGTH] for _, _, error in failed],
+            },
+        )
+
+
+def purge(connection: Connection) -> int:
+    """
+    Delete the status of the files ingested more than `settings.ingest_status_retention` seconds ago.
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to the database, whose transaction is committed by the caller.
+
+    Returns
+    -------
+    int
+        The number of statuses deleted.
+    """
+    before = datetime.utcnow() - timedelta(seconds=settings.ingest_status_retention)  # noqa: DTZ003
+    return connection.execute(
+        text(
+            "DELETE FROM ingestrequest WHERE status IN ('stored', 'failed', 'superseded') AND updated_at < :before",
+        ),
+        {"before": before},
+    ).rowcount
+
+
+def submit(  # noqa: PLR0913, PLR0917
+    session: Session,
+    client: Celery,
+    user_id: int,
+    filename: str,
+    content_type: str,
+    size: int,
+    etag: str | None = None,
+) -> tuple[int, str]:
+    """
+    Queue an uploaded file and dispatch what is next in fair queuing order, the file itself if its turn has come.
+
+    Parameters
+    ----------
+    session : Session
+        The session to interact with the database.
+    client : Celery
+        The Celery app the `process_files` tasks are sent with.
+    user_id : int
+        The ID of the user who uploaded the file.
+    filename : str
+        The name of the uploaded file.
+    content_type : str
+        The MIME type of the file.
+    size : int
+        The size of the file in bytes.
+    etag : str | None, optional
+        The ETag of the uploaded object, by default None.
+
+    Returns
+    -------
+    tuple[int, str]
+        The ID of the upload, and its status. An upload coalesced with another one gets the ID and status of
+        that one.
+    """
+    return submit_many(session, client, user_id, [(filename, content_type, size, etag)])[0]
+
+
+def submit_many(
+    session: Session,
+    client: Celery,
+    user_id: int,
+    uploads: list[tuple[str, str, int, str | None]],
+) -> list[tuple[int, str]]:
+    """
+    Queue uploaded files of a user and dispatch what is next in fair queuing order, in a single transaction.
+
+    The files dispatched are sent in as few `process_files` tasks as `batches` allows.
+
+    Parameters
+    ----------
+    session : Session
+        The session to interact with the database.
+    client : Celery
+        The Celery app the `process_files` tasks are sent with.
+    user_id : int
+        The ID of the user who uploaded the files.
+    uploads : list[tuple[str, str, int, str | None]]
+        The name, MIME type, size in bytes and ETag of each uploaded file.
+
+    Returns
+    -------
+    list[tuple[int, str]]
+        The ID and status of each upload. An upload coalesced with another one gets the ID and status of
+        that one.
+    """
+    request_ids = []
+    for filename, content_type, size, etag in uploads:
+        request = enqueue(session, user_id, filename, content_type, size, etag)
+        # Flushed one at a time, so that later uploads of the same file see the earlier ones
+        session.flush()
+        request_ids.append(request.id)
+    dispatch(session.connection(), client)
+    # Read back, as uploads may have been dispatched, or superseded by a later upload of the same file
+    statuses = dict(
+        session.execute(
+            text("SELECT id, status FROM ingestrequest WHERE id = ANY(:ids)"),
+            {"ids": request_ids},
+        ).all(),
+    )
+    session.commit()
+    return [(request_id, statuses[request_id]) for request_id in request_ids]
+
+
+def submit_object(  # noqa: PLR0913, PLR0917
+    session: Session,
+    client: Celery,
+    user_id: int,
+    filename: str,
+    size: int,
+    etag: str,
+) -> tuple[int, str]:
+    """
+    Queue a text file uploaded straight to MinIO, unless this content of the file is already queued or ingested.
+
+    Files uploaded straight to MinIO are announced both by the client finalizing the upload and by the
+    bucket notification of the object, in any order; files uploaded through the API are announced by the
+    notification too. Only the first announcement of a content is queued.
+
+    Parameters
+    ----------
+    session : Session
+        The session to interact with the database.
+    client : Celery
+        The Celery app the `process_files` tasks are sent with.
+    user_id : int
+        The ID of the user who uploaded the file.
+    filename : str
+        The name of the uploaded file.
+    size : int
+        The size of the file in bytes.
+    etag : str
+        The ETag of the uploaded object.
+
+    Returns
+    -------
+    tuple[int, str]
+        The ID of the upload, and its status.
+    """
+    session.execute(
+        text("SELECT pg_advisory_xact_lock(:user_id, hashtext(:filename))"),
+        {"user_id": user_id, "filename": filename},
+    )
+    latest = session.execute(
+        text(
+            "SELECT id, status, etag FROM ingestrequest WHERE user_id = :user_id AND filename = :filename "
+            "AND status NOT IN ('superseded', 'failed') ORDER BY id DESC LIMIT 1",
+        ),
+        {"user_id": user_id, "filename": filename},
+    ).first()
+    if latest is not None and latest.etag == etag:
+        session.commit()
+        coalesced_files.inc()
+        return latest.id, latest.status
+    return submit(session, client, user_id, filename, "text/plain", size, etag)
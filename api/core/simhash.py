@@ -0,0 +1,230 @@
+"""This module is concerned with fingerprinting file contents to find near-duplicates.
+
+A SimHash fingerprint is 64 bits long, and texts that share most of their word shingles get fingerprints
+that differ in few bits. Fingerprints are split into `BANDS` bands of 16 bits: two fingerprints that
+differ in fewer than `BANDS` bits agree on at least one whole band, so candidates are found with
+exact lookups of band values. Files are fingerprinted at ingest, and a file nearly identical to an
+earlier file of the same user reuses its embeddings instead of being embedded again.
+"""
+
+import hashlib
+from collections import Counter, deque
+
+import numpy as np
+import numpy.typing as npt
+from sqlalchemy import and_, or_
+from sqlmodel import Session, select
+
+from api.core import chunking, models
+
+FINGERPRINT_BITS = 64
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+
+# Number of consecutive words making up one feature of a text
+SHINGLE_SIZE = 3
+
+# Number of features hashed together, bounding memory on large files
+BLOCK_SIZE = 65536
+
+
+def _hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class SimHash:
+    """
+    Incremental SimHash fingerprint of a text given as a stream of pieces.
+
+    Only the last tokens read and a block of features are held in memory, so arbitrarily large
+    texts can be fingerprinted as they are read, with the same result as reading them at once.
+
+    """
+
+    def __init__(self) -> None:
+        self.weights = np.zeros(FINGERPRINT_BITS, dtype=np.int64)
+        self.features: Counter[str] = Counter()
+        self.recent: deque[str] = deque(maxlen=SHINGLE_SIZE)
+        self.token_count = 0
+        self.buffer = ""
+
+    def _add_token(self, token: str) -> None:
+        self.recent.append(token.casefold())
+        self.token_count += 1
+        if len(self.recent) == SHINGLE_SIZE:
+            self.features[" ".join(self.recent)] += 1
+            if len(self.features) >= BLOCK_SIZE:
+                self._flush()
+
+    def _flush(self) -> None:
+        self.weights += _weights(self.features)
+        self.features.clear()
+
+    def update(self, piece: str) -> None:
+        """Add the next piece of the text."""
+        self.buffer += piece
+        scanned = 0
+        for match in chunking.TOKEN_PATTERN.finditer(self.buffer):
+            if match.end() == len(self.buffer):
+                # The token may continue in the next piece.
+                scanned = match.start()
+                break
+            self._add_token(match.group())
+            scanned = match.end()
+        else:
+            scanned = len(self.buffer)
+        self.buffer = self.buffer[scanned:]
+
+    def digest(self) -> int:
+        """
+        The fingerprint of the text read so far.
+
+        Returns
+        -------
+        int
+            The fingerprint, as a signed 64 bit integer so that it fits a BIGINT column.
+        """
+        features = self.features.copy()
+        recent = self.recent.copy()
+        token_count = self.token_count
+        for match in chunking.TOKEN_PATTERN.finditer(self.buffer):
+            recent.append(match.group().casefold())
+            token_count += 1
+            if len(recent) == SHINGLE_SIZE:
+                features[" ".join(recent)] += 1
+        if 0 < token_count < SHINGLE_SIZE:
+            # A text shorter than a shingle is a single feature
+            features[" ".join(recent)] += 1
+
+        weights = self.weights + _weights(features)
+        value = sum(1 << bit for bit in np.flatnonzero(weights > 0).tolist())
+        return value - (1 << FINGERPRINT_BITS) if value >= 1 << (FINGERPRINT_BITS - 1) else value
+
+
+def _weights(features: Counter[str]) -> npt.NDArray[np.int64]:
+    # Sum over the features of +count for each bit set in their hash, and -count for each bit clear
+    shifts = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+    hashes = np.fromiter((_hash(feature) for feature in features), dtype=np.uint64, count=len(features))
+    counts = np.fromiter(features.values(), dtype=np.int64, count=len(features))
+    bits = ((hashes[:, None] >> shifts) & np.uint64(1)).astype(np.int64)
+    return ((2 * bits - 1) * counts[:, None]).sum(axis=0)
+
+
+def fingerprint(text: str) -> int:
+    """
+    Compute the SimHash fingerprint of a text.
+
+    Parameters
+    ----------
+    text : str
+        The text content to fingerprint.
+
+    Returns
+    -------
+    int
+        The fingerprint, as a signed 64 bit integer so that it fits a BIGINT column.
+    """
+    hasher = SimHash()
+    hasher.update(text)
+    return hasher.digest()
+
+
+def bands(value: int) -> list[int]:
+    """
+    Split a fingerprint into bands.
+
+    Parameters
+    ----------
+    value : int
+        The fingerprint.
+
+    Returns
+    -------
+    list[int]
+        The value of each band, from the least significant bits.
+    """
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+
+def similarity(first: int, second: int) -> float:
+    """
+    Fraction of the bits two fingerprints agree on.
+
+    Parameters
+    ----------
+    first : int
+        The first fingerprint.
+    second : int
+        The second fingerprint.
+
+    Returns
+    -------
+    float
+        1.0 for identical fingerprints, around 0.5 for unrelated texts.
+    """
+    distance = ((first ^ second) & ((1 << FINGERPRINT_BITS) - 1)).bit_count()
+    return 1 - distance / FINGERPRINT_BITS
+
+
+def find_near_duplicate(
+    session: Session,
+    user_id: int,
+    value: int,
+    min_similarity: float,
+) -> models.FileMetadata | None:
+    """
+    Find an earlier file of a user with nearly the same content.
+
+    Parameters
+    ----------
+    session : Session
+        The session to interact with the database.
+    user_id : int
+        The ID of the user who owns the files.
+    value : int
+        The fingerprint of the new file content.
+    min_similarity : float
+        Minimum fraction of fingerprint bits the files must agree on.
+
+    Returns
+    -------
+    models.FileMetadata | None
+        The most similar file, or None if no file is similar enough.
+    """
+    candidate_ids = select(models.FileSimhashBand.file_id).where(
+        or_(
+            *(
+                and_(models.FileSimhashBand.band == band, models.FileSimhashBand.value == band_value)
+                for band, band_value in enumerate(bands(value))
+            ),
+        ),
+    )
+    candidates = session.exec(
+        select(models.FileMetadata).where(
+            models.FileMetadata.user_id == user_id,
+            models.FileMetadata.id.in_(candidate_ids),
+        ),
+    ).all()
+    # The most similar file wins, the earliest one among equally similar files
+    best = max(candidates, default=None, key=lambda candidate: (similarity(value, candidate.simhash), -candidate.id))
+    return best if best and similarity(value, best.simhash) >= min_similarity else None
+
+
+def add_fingerprint(session: Session, file_id: int, value: int) -> None:
+    """
+    Index the fingerprint of a file so that later uploads can find it.
+
+    Parameters
+    ----------
+    session : Session
+        The session to interact with the database.
+    file_id : int
+        The ID of the file metadata.
+    value : int
+        The fingerprint of the file content.
+    """
+    session.add_all(
+        models.FileSimhashBand(band=band, value=band_value, file_id=file_id)
+        for band, band_value in enumerate(bands(value))
+    )
@@ -0,0 +1,71 @@
+"""This module is concerned with reusing the embeddings of stored chunks keyed by the content they were generated from.
+
+The same text is often uploaded several times, under other names or by other users. Looking up the hash of
+each chunk among the chunks already stored before calling the provider lets identical content reuse the
+embedding computed the first time, without storing it twice.
+"""
+
+from sqlalchemy import Engine
+from sqlmodel import Session, col, select
+
+from api.core import metrics, models, vectors
+
+content_store_hits = metrics.counter(
+    "content_embedding_store_hits_total",
+    "Chunk embeddings reused from stored chunks of identical content.",
+)
+content_store_misses = metrics.counter(
+    "content_embedding_store_misses_total",
+    "Chunk embeddings not found among the stored chunks.",
+)
+
+
+class ContentEmbeddingStore:
+    """
+    Embeddings of the stored chunks, looked up by the hash of their content.
+
+    The chunks are those of the files being served, embedded with the configured model, and their embeddings
+    go away with the files.
+
+    Parameters
+    ----------
+    engine : Engine
+        The engine used to connect to the database.
+
+    """
+
+    def __init__(self, engine: Engine) -> None:
+        self.engine = engine
+
+    def get_many(self, content_hashes: list[str]) -> dict[str, vectors.Embedding]:
+        """
+        Look up the embeddings of several contents.
+
+        Parameters
+        ----------
+        content_hashes : list[str]
+            SHA-256 hex digests of the contents.
+
+        Returns
+        -------
+        dict[str, vectors.Embedding]
+            The stored embeddings by content hash; hashes without an embedding are left out.
+        """
+        unique_hashes = set(content_hashes)
+        with Session(self.engine) as session:
+            # One chunk per content, found through the index on the hashes
+            rows = session.exec(
+                select(models.FileChunk.content_hash, models.FileChunk.embedding)
+                .where(col(models.FileChunk.content_hash).in_(unique_hashes))
+                .distinct(models.FileChunk.content_hash),
+            ).all()
+        found = {content_hash: vectors.to_array(embedding) for content_hash, embedding in rows}
+        content_store_hits.inc(len(found))
+        content_store_misses.inc(len(unique_hashes) - len(found))
+        return found
+
+    @staticmethod
+    def hit_rate() -> float:
+        """Fraction of the lookups made by this process that found an embedding."""
+        lookups = content_store_hits.value + content_store_misses.value
+        return content_store_hits.value / lookups if lookups else 0.0
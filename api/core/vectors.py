@@ -0,0 +1,121 @@
+"""This module is concerned with the format embeddings are stored in.
+
+Full precision 4096 dimension vectors take 16 KB per row and are too large for pgvector's indexes. The
+storage format is chosen with two settings:
+
+- `embedding_storage`: "vector" stores 4 byte floats, "halfvec" stores 2 byte floats.
+- `embedding_storage_dimensions`: keeps only the leading dimensions of each embedding, scaled back to
+  unit length, for models trained so that prefixes of their embeddings remain meaningful (Matryoshka).
+"""
+
+import io
+
+import numpy as np
+import numpy.typing as npt
+from pgvector.sqlalchemy import HALFVEC, Vector
+from sqlalchemy.types import UserDefinedType
+
+from api.core.config import settings
+
+# Embeddings are carried as float32 arrays from the provider response to the database driver
+Embedding = npt.NDArray[np.float32]
+
+# Largest number of dimensions pgvector can index for each storage type
+MAX_INDEXED_DIMENSIONS = {"vector": 2000, "halfvec": 4000}
+
+
+def storage_dimensions() -> int:
+    """Number of dimensions of the stored embeddings."""
+    return settings.embedding_storage_dimensions or settings.embedding_dimensions
+
+
+def is_truncated() -> bool:
+    """Whether embeddings are stored with fewer dimensions than the provider generates."""
+    return storage_dimensions() < settings.embedding_dimensions
+
+
+def column_type() -> UserDefinedType:
+    """
+    Get the SQL type of the columns holding embeddings.
+
+    Returns
+    -------
+    UserDefinedType
+        Either `Vector` or `HALFVEC` with the storage dimensions.
+    """
+    if settings.embedding_storage == "halfvec":
+        return HALFVEC(storage_dimensions())
+    return Vector(storage_dimensions())
+
+
+def sql_type() -> str:
+    """The SQL type of the columns holding embeddings, as reported by `format_type`."""
+    return f"{settings.embedding_storage}({storage_dimensions()})"
+
+
+def is_indexable() -> bool:
+    """Whether pgvector can build an index over embeddings in the storage format."""
+    return storage_dimensions() <= MAX_INDEXED_DIMENSIONS[settings.embedding_storage]
+
+
+def prepare(embedding: npt.ArrayLike) -> Embedding:
+    """
+    Convert an embedding generated by the provider into the stored dimensions.
+
+    Parameters
+    ----------
+    embedding : npt.ArrayLike
+        The embedding as generated by the provider.
+
+    Returns
+    -------
+    Embedding
+        The embedding itself, or its leading dimensions scaled to unit length when truncated.
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if not is_truncated():
+        return embedding
+    prefix = embedding[: storage_dimensions()]
+    norm = np.linalg.norm(prefix)
+    return prefix / norm if norm else prefix
+
+
+def to_text(embedding: Embedding) -> str:
+    """
+    Format an embedding as a pgvector literal, for statements binding it as a plain parameter.
+
+    psycopg2 only sends parameters as text. Formatting the whole array with NumPy is about twice as
+    fast as formatting its elements one by one, and "%.9g" keeps every float32 exact.
+
+    Parameters
+    ----------
+    embedding : Embedding
+        The embedding to format.
+
+    Returns
+    -------
+    str
+        The embedding as "[x1,x2,...]".
+    """
+    buffer = io.StringIO()
+    np.savetxt(buffer, np.asarray(embedding, dtype=np.float32).reshape(1, -1), fmt="%.9g", delimiter=",")
+    return f"[{buffer.getvalue().rstrip()}]"
+
+
+def to_array(value: object) -> Embedding:
+    """
+    Convert an embedding read from the database into a float32 array.
+
+    Parameters
+    ----------
+    value : object
+        A NumPy array for `vector` columns, a `HalfVector` for `halfvec` columns.
+
+    Returns
+    -------
+    Embedding
+        The embedding as a float32 array.
+    """
+    if hasattr(value, "to_numpy"):
+        value = value.to_numpy()
+    return np.asarray(value, dtype=np.float32)
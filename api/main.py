@@ -1,9 +1,9 @@
 """Main entry point for the FastAPI application."""
 
 from fastapi import FastAPI, status
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 
-from api.core import database, models
+from api.core import celery, database, embeddings, files, metrics, models
 from api.routers import auth, file, search, user
 
 app = FastAPI()
@@ -19,9 +19,22 @@ app.include_router(user.router)
 def on_startup():
     """
     Event handler for application startup.
-    Creates tables in the database.
+    Creates tables in the database, the shared embedding provider, and the shared MinIO client
+    along with its bucket.
     """
     database.create_tables()
+    embeddings.get_provider()
+    files.get_minio_client()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """
+    Event handler for application shutdown.
+    Closes the connections pooled by the embedding provider and the Celery client.
+    """
+    await embeddings.close_provider()
+    celery.close_celery_client(celery.get_celery_client())
 
 
 @app.get(
@@ -42,6 +55,19 @@ def health_check():
     return models.HealthCheck(status="OK")
 
 
+@app.get("/metrics", tags=["healthcheck"], response_class=PlainTextResponse, status_code=status.HTTP_200_OK)
+def get_metrics():
+    """
+    Endpoint exposing the metrics of this process in the Prometheus text format.
+
+    Returns
+    -------
+    str
+        The rendered metrics.
+    """
+    return metrics.render()
+
+
 @app.get("/", response_class=HTMLResponse, status_code=status.HTTP_200_OK)
 def root():
     html = """
@@ -1,19 +1,30 @@
 """This module defines a router for the api that is dedicated to file related responsibilities."""
 
+import asyncio
+import json
 import logging
 from typing import Annotated
 
 import celery.exceptions
+import urllib3
 from celery.exceptions import TaskError
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, status
-from minio.error import S3Error
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from kombu.exceptions import OperationalError
+from minio.error import MinioException, S3Error
+from sqlmodel import Session, col, select
 
-from api.core import celery, files, models, oauth2
+from api.core import celery, database, events, files, models, oauth2, scheduling
+from api.core.config import settings
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/files", tags=["Files"])
 
+# Largest number of statuses returned at once
+MAX_STATUSES = 1000
+
 
 @router.post("/", response_model=models.UploadedFile, status_code=status.HTTP_201_CREATED)
 async def upload_file(
@@ -21,6 +32,7 @@ async def upload_file(
     current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
     minio_client: Annotated[files.Minio, Depends(files.get_minio_client)],
     celery_client: Annotated[celery.Celery, Depends(celery.get_celery_client)],
+    session: Annotated[Session, Depends(database.get_session)],
 ):
     """
     Endpoint for uploading files.
@@ -35,6 +47,8 @@ async def upload_file(
         The MinIO client for interacting with the object storage.
     celery_client : celery.Celery
         The Celery client for queuing tasks.
+    session : Session
+        The session to interact with the database.
 
     Returns
     -------
@@ -44,7 +58,8 @@ async def upload_file(
     Raises
     ------
     HTTPException
-        If the file type is not supported or if there are errors during file upload or queuing.
+        If the file type is not supported, the file is too large or not UTF-8 text, or if there are errors
+        during file upload or queuing.
     """
     if file.content_type != "text/plain":
         raise HTTPException(
@@ -52,11 +67,33 @@ async def upload_file(
             detail=f"File type of {file.content_type} is not a supported media type of text/plain",
         )
 
-    file_size = files.get_file_size(file)
+    if file.size is not None and file.size > settings.upload_max_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File is larger than the limit of {settings.upload_max_bytes} bytes",
+        )
 
     try:
-        minio_client.put_object(files.BUCKET, f"{current_user.id}/{file.filename}", file.file, file_size)
-    except S3Error as e:
+        # stream the file into MinIO off the event loop, checking it as it goes
+        result, file_size = await run_in_threadpool(
+            files.upload_text,
+            minio_client,
+            f"{current_user.id}/{file.filename}",
+            file.file,
+            file.content_type,
+        )
+    except files.FileTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File is larger than the limit of {settings.upload_max_bytes} bytes",
+        ) from e
+    except files.InvalidTextError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"File is not valid UTF-8 text: {e}",
+        ) from e
+    except (MinioException, urllib3.exceptions.HTTPError, OSError) as e:
+        # MinIO errors, and connections given up on after their retries
         logger.exception("Error uploading file %s", file.filename)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -64,12 +101,19 @@ async def upload_file(
         ) from e
 
     try:
-        # send file meta-data and user id to task queue
-        task = celery_client.send_task(
-            name="process_file",
-            args=[current_user.id, file.filename, file.content_type],
+        # queue the file behind the other files of the user, unless the same content is already queued or
+        # being processed, and send whatever is due to the task queue
+        upload_id, ingest_status = await run_in_threadpool(
+            scheduling.submit,
+            session,
+            celery_client,
+            current_user.id,
+            file.filename,
+            file.content_type,
+            file_size,
+            result.etag,
         )
-    except TaskError as e:
+    except (TaskError, OperationalError) as e:
         logger.exception("Error queueing file process for %s", file.filename)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -77,8 +121,366 @@ async def upload_file(
         ) from e
 
     return {
+        "id": upload_id,
         "filename": file.filename,
         "content_type": file.content_type,
         "size": file_size,
-        "status": task.status,
+        "status": ingest_status,
+    }
+
+
+@router.post("/bulk", response_model=list[models.BulkUploadedFile])
+async def upload_files(
+    files_: Annotated[list[UploadFile], File(alias="files")],
+    current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
+    minio_client: Annotated[files.Minio, Depends(files.get_minio_client)],
+    celery_client: Annotated[celery.Celery, Depends(celery.get_celery_client)],
+    session: Annotated[Session, Depends(database.get_session)],
+):
+    """
+    Endpoint for uploading many files at once, as files or as zip or tar archives of files.
+
+    Archives are extracted as they are read, and the files are stored in MinIO concurrently. The files
+    stored are then queued together, and sent to the workers in as few tasks as possible. A file that
+    cannot be stored is rejected without failing the others.
+
+    Parameters
+    ----------
+    files_ : list[UploadFile]
+        The files to be uploaded, and the archives of files to be uploaded.
+    current_user : models.User
+        The current authenticated user.
+    minio_client : files.Minio
+        The MinIO client for interacting with the object storage.
+    celery_client : celery.Celery
+        The Celery client for queuing tasks.
+    session : Session
+        The session to interact with the database.
+
+    Returns
+    -------
+    list[models.BulkUploadedFile]
+        The outcome of each file, in the order of the files and of the files in each archive.
+
+    Raises
+    ------
+    HTTPException
+        If there are errors during queuing.
+    """
+    results: list[models.BulkUploadedFile] = []
+    stored: list[tuple[models.BulkUploadedFile, str]] = []
+    slots = asyncio.Semaphore(settings.upload_concurrency)
+
+    async def store(entry: files.UploadEntry, result: models.BulkUploadedFile) -> None:
+        try:
+            etag_and_size = await run_in_threadpool(
+                files.upload_text,
+                minio_client,
+                f"{current_user.id}/{entry.filename}",
+                entry.content,
+                entry.content_type,
+            )
+        except files.FileTooLargeError:
+            result.error = f"File is larger than the limit of {settings.upload_max_bytes} bytes"
+        except files.InvalidTextError as e:
+            result.error = f"File is not valid UTF-8 text: {e}"
+        except (MinioException, urllib3.exceptions.HTTPError, OSError):
+            # MinIO errors, and connections given up on after their retries
+            logger.exception("Error uploading file %s", entry.filename)
+            result.error = "Error uploading file."
+        else:
+            written, result.size = etag_and_size
+            stored.append((result, written.etag))
+        finally:
+            entry.content.close()
+            slots.release()
+
+    async with asyncio.TaskGroup() as task_group:
+        for upload in files_:
+            # Files beyond the limit are rejected without being read
+            remaining = settings.upload_bulk_max_files - len(results)
+            if remaining <= 0:
+                error = f"More than {settings.upload_bulk_max_files} files in the upload"
+                results.append(models.BulkUploadedFile(filename=upload.filename, status="rejected", error=error))
+                continue
+            entries = files.upload_entries(upload.file, upload.filename, upload.content_type, remaining)
+            while True:
+                # Extract no further ahead than the files being stored
+                await slots.acquire()
+                entry = await run_in_threadpool(next, entries, None)
+                if entry is None:
+                    slots.release()
+                    break
+                result = models.BulkUploadedFile(filename=entry.filename, status="rejected", error=entry.error)
+                results.append(result)
+                if result.error is not None:
+                    if entry.content is not None:
+                        entry.content.close()
+                    slots.release()
+                    continue
+                task_group.create_task(store(entry, result))
+
+    if stored:
+        try:
+            # queue the files behind the other files of the user, and send whatever is due to the task queue
+            submitted = await run_in_threadpool(
+                scheduling.submit_many,
+                session,
+                celery_client,
+                current_user.id,
+                [(result.filename, "text/plain", result.size, etag) for result, etag in stored],
+            )
+        except (TaskError, OperationalError) as e:
+            logger.exception("Error queueing file process for %d files", len(stored))
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Error queueing file process",
+            ) from e
+        for (result, _), (upload_id, ingest_status) in zip(stored, submitted, strict=True):
+            result.id, result.status, result.error = upload_id, ingest_status, None
+    return results
+
+
+@router.post("/uploads", response_model=models.DirectUpload, status_code=status.HTTP_201_CREATED)
+def create_direct_upload(
+    upload: models.DirectUploadCreate,
+    current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
+):
+    """
+    Endpoint for uploading a file straight to MinIO, without the content going through the API.
+
+    The client uploads the file to the returned URL with a `PUT` request, then finalizes the upload with
+    `POST /files/uploads/complete`. When MinIO notifies the workers of the objects written, the file is
+    also processed without being finalized.
+
+    Parameters
+    ----------
+    upload : models.DirectUploadCreate
+        The name and content type of the file to upload.
+    current_user : models.User
+        The current authenticated user.
+
+    Returns
+    -------
+    models.DirectUpload
+        The presigned URL to upload the file to, and its expiry.
+
+    Raises
+    ------
+    HTTPException
+        If the file type is not supported, or the name of the file is not valid.
+    """
+    if upload.content_type != "text/plain":
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"File type of {upload.content_type} is not a supported media type of text/plain",
+        )
+    if files.entry_name(upload.filename) != upload.filename:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid file name")
+
+    url, expires_at = files.presign_upload(current_user.id, upload.filename)
+    return {"filename": upload.filename, "url": url, "expires_at": expires_at}
+
+
+@router.post("/uploads/complete", response_model=models.UploadedFile)
+async def complete_direct_upload(
+    upload: models.DirectUploadComplete,
+    current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
+    minio_client: Annotated[files.Minio, Depends(files.get_minio_client)],
+    celery_client: Annotated[celery.Celery, Depends(celery.get_celery_client)],
+    session: Annotated[Session, Depends(database.get_session)],
+):
+    """
+    Endpoint for finalizing an upload straight to MinIO, queuing the uploaded file for processing.
+
+    Finalizing an upload already announced by MinIO, or twice, returns the upload already queued.
+
+    Parameters
+    ----------
+    upload : models.DirectUploadComplete
+        The name of the uploaded file.
+    current_user : models.User
+        The current authenticated user.
+    minio_client : files.Minio
+        The MinIO client for interacting with the object storage.
+    celery_client : celery.Celery
+        The Celery client for queuing tasks.
+    session : Session
+        The session to interact with the database.
+
+    Returns
+    -------
+    dict
+        A dictionary containing file metadata and status.
+
+    Raises
+    ------
+    HTTPException
+        If the file was not uploaded, is too large, or if there are errors during queuing.
+    """
+    object_name = f"{current_user.id}/{upload.filename}"
+    try:
+        stat = await run_in_threadpool(minio_client.stat_object, files.BUCKET, object_name)
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not uploaded") from e
+        logger.exception("Error reading uploaded file %s", upload.filename)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error reading uploaded file.",
+        ) from e
+
+    if stat.size > settings.upload_max_bytes:
+        await run_in_threadpool(minio_client.remove_object, files.BUCKET, object_name)
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File is larger than the limit of {settings.upload_max_bytes} bytes",
+        )
+
+    try:
+        upload_id, ingest_status = await run_in_threadpool(
+            scheduling.submit_object,
+            session,
+            celery_client,
+            current_user.id,
+            upload.filename,
+            stat.size,
+            stat.etag,
+        )
+    except (TaskError, OperationalError) as e:
+        logger.exception("Error queueing file process for %s", upload.filename)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error queueing file process",
+        ) from e
+
+    return {
+        "id": upload_id,
+        "filename": upload.filename,
+        "content_type": "text/plain",
+        "size": stat.size,
+        "status": ingest_status,
     }
+
+
+def status_query(user_id: int):
+    """Select the ingestion statuses of the uploads of a user."""
+    return select(
+        models.IngestRequest.id,
+        models.IngestRequest.filename,
+        models.IngestRequest.status,
+        models.IngestRequest.file_id,
+        models.IngestRequest.error,
+        models.IngestRequest.updated_at,
+    ).where(models.IngestRequest.user_id == user_id)
+
+
+@router.get("/status", response_model=list[models.IngestStatus])
+def get_upload_statuses(
+    current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
+    session: Annotated[Session, Depends(database.get_session)],
+    ids: Annotated[list[int] | None, Query()] = None,
+):
+    """
+    Endpoint for the ingestion status of several uploads at once.
+
+    Parameters
+    ----------
+    current_user : models.User
+        The current authenticated user.
+    session : Session
+        The session to interact with the database.
+    ids : list[int] | None, optional
+        The IDs of the uploads, by default None for the latest uploads of the user.
+
+    Returns
+    -------
+    list[models.IngestStatus]
+        The status of each upload of the user found, most recent first.
+    """
+    statement = status_query(current_user.id).order_by(col(models.IngestRequest.id).desc())
+    if ids is None:
+        statement = statement.limit(MAX_STATUSES)
+    else:
+        statement = statement.where(col(models.IngestRequest.id).in_(ids[:MAX_STATUSES]))
+    return session.exec(statement).all()
+
+
+@router.get("/events")
+async def stream_upload_events(
+    current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
+    listener: Annotated[events.StatusListener, Depends(events.get_status_listener)],
+):
+    """
+    Endpoint streaming the ingestion status changes of the uploads of the user, as Server-Sent Events.
+
+    Each change is sent as a `status` event whose data is an `IngestStatus` in JSON. Changes made before
+    the stream was opened are not replayed: clients catch up with `GET /files/status` once connected.
+
+    Parameters
+    ----------
+    current_user : models.User
+        The current authenticated user.
+    listener : events.StatusListener
+        The listener of ingestion status changes of this process.
+
+    Returns
+    -------
+    StreamingResponse
+        The `text/event-stream` response, open until the client disconnects.
+    """
+    queue = listener.subscribe(current_user.id)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.ingest_events_keepalive)
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: status\nid: {event['id']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            listener.unsubscribe(current_user.id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{upload_id}/status", response_model=models.IngestStatus)
+def get_upload_status(
+    upload_id: int,
+    current_user: Annotated[models.User, Depends(oauth2.get_current_user)],
+    session: Annotated[Session, Depends(database.get_session)],
+):
+    """
+    Endpoint for the ingestion status of an upload.
+
+    Parameters
+    ----------
+    upload_id : int
+        The ID returned when the file was uploaded.
+    current_user : models.User
+        The current authenticated user.
+    session : Session
+        The session to interact with the database.
+
+    Returns
+    -------
+    models.IngestStatus
+        The status of the upload.
+
+    Raises
+    ------
+    HTTPException
+        If the user has no upload with this ID, or its status is no longer kept.
+    """
+    upload_status = session.exec(
+        status_query(current_user.id).where(models.IngestRequest.id == upload_id),
+    ).first()
+    if upload_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return upload_status
@@ -1,13 +1,89 @@
 """This module defines a router for vector search functionality."""
 
+from typing import Literal
+
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy import text
 from sqlmodel import Session, select
 
-from api.core import database, embeddings, models, oauth2
+from api.core import database, embeddings, models, oauth2, resilience, vectors
+from api.core.config import settings
 
 router = APIRouter(prefix="/search", tags=["Search"])
 
+# SQL aggregate used to pool the similarities of a file's chunks into the similarity of the file
+POOLING_AGGREGATES = {"max": "MAX", "mean": "AVG"}
+
+# Near-duplicate files have no chunks of their own and are searched with the chunks of the file they link to.
+# Files embedded before chunking was introduced have no chunks; their file embedding stands in for one.
+SEARCH_FILES_SQL = """
+    WITH files AS (
+        SELECT id, COALESCE(near_duplicate_of, id) AS chunk_owner, embedding
+        FROM filemetadata
+        WHERE user_id = :user_id
+    ),
+    scored AS (
+        SELECT files.id AS file_id, 1 - (c.embedding <=> :query_embedding) AS similarity
+        FROM files
+        JOIN filechunk c ON c.file_id = files.chunk_owner
+        UNION ALL
+        SELECT files.id, 1 - (files.embedding <=> :query_embedding)
+        FROM files
+        WHERE NOT EXISTS (SELECT 1 FROM filechunk c WHERE c.file_id = files.chunk_owner)
+    )
+    SELECT f.id, f.filename, f.content_type, f.size, f.user_id, f.created_at,
+           {pooling}(s.similarity) AS similarity, f.near_duplicate_of
+    FROM scored s
+    JOIN filemetadata f ON f.id = s.file_id
+    GROUP BY f.id
+    ORDER BY similarity DESC
+    LIMIT :limit
+"""
+
+# Each candidate chunk is scored by its best match among the target file's chunks before pooling
+FIND_SIMILAR_FILES_SQL = """
+    WITH files AS (
+        SELECT id, COALESCE(near_duplicate_of, id) AS chunk_owner, embedding
+        FROM filemetadata
+        WHERE user_id = :user_id
+    ),
+    target AS (
+        SELECT c.embedding
+        FROM files
+        JOIN filechunk c ON c.file_id = files.chunk_owner
+        WHERE files.id = :file_id
+        UNION ALL
+        SELECT files.embedding
+        FROM files
+        WHERE files.id = :file_id
+          AND NOT EXISTS (SELECT 1 FROM filechunk c WHERE c.file_id = files.chunk_owner)
+    ),
+    candidates AS (
+        SELECT files.id AS file_id, c.id AS chunk_id, c.embedding
+        FROM files
+        JOIN filechunk c ON c.file_id = files.chunk_owner
+        WHERE files.id != :file_id
+        UNION ALL
+        SELECT files.id, NULL, files.embedding
+        FROM files
+        WHERE files.id != :file_id
+          AND NOT EXISTS (SELECT 1 FROM filechunk c WHERE c.file_id = files.chunk_owner)
+    ),
+    scored AS (
+        SELECT candidates.file_id, MAX(1 - (candidates.embedding <=> target.embedding)) AS similarity
+        FROM candidates
+        CROSS JOIN target
+        GROUP BY candidates.file_id, candidates.chunk_id
+    )
+    SELECT f.id, f.filename, f.content_type, f.size, f.user_id, f.created_at,
+           {pooling}(s.similarity) AS similarity, f.near_duplicate_of
+    FROM scored s
+    JOIN filemetadata f ON f.id = s.file_id
+    GROUP BY f.id
+    ORDER BY similarity DESC
+    LIMIT :limit
+"""
+
 
 @router.get(
     "/files",
@@ -17,6 +93,7 @@ router = APIRouter(prefix="/search", tags=["Search"])
 async def search_files(
     query: str = Query(..., description="Search query text"),
     limit: int = Query(10, description="Maximum number of results to return", ge=1, le=100),
+    pooling: Literal["max", "mean"] | None = Query(None, description="How chunk similarities are pooled per file"),
     current_user: models.User = Depends(oauth2.get_current_user),
     session: Session = Depends(database.get_session),
 ):
@@ -25,6 +102,8 @@ async def search_files(
 
     This endpoint generates an embedding for the search query and finds
     the most similar files in the user's collection using cosine similarity.
+    Each chunk of a file is compared with the query and the chunk similarities
+    are pooled into the similarity of the file.
 
     Parameters
     ----------
@@ -32,6 +111,8 @@ async def search_files(
         The search query text to find similar files.
     limit : int, optional
         Maximum number of results to return (default: 10, max: 100).
+    pooling : str, optional
+        Either "max" or "mean" (default: `settings.search_pooling`).
     current_user : models.User
         The authenticated user performing the search.
     session : Session
@@ -45,28 +126,22 @@ async def search_files(
     Raises
     ------
     HTTPException
-        If there are issues with embedding generation or database queries.
+        If there are issues with embedding generation or database queries, or with status
+        code 503 (SERVICE UNAVAILABLE) while the embedding provider is unhealthy.
 
     """
     try:
-        # Generate embedding for the search query using OpenRouter API
-        query_embedding = await embeddings.generate_embedding(query)
+        # Generate embedding for the search query, reusing it if the query was seen recently
+        query_embedding = await embeddings.generate_query_embedding(query)
 
-        # Perform vector similarity search using pgvector
+        # Perform vector similarity search over file chunks using pgvector
         # Using cosine similarity (<=> operator in pgvector)
-        stmt = text("""
-            SELECT id, filename, content_type, size, user_id, created_at,
-                   1 - (embedding <=> :query_embedding) as similarity
-            FROM filemetadata
-            WHERE user_id = :user_id
-            ORDER BY embedding <=> :query_embedding
-            LIMIT :limit
-        """)
+        stmt = text(SEARCH_FILES_SQL.format(pooling=POOLING_AGGREGATES[pooling or settings.search_pooling]))
 
         results = session.execute(
             stmt,
             {
-                "query_embedding": str(query_embedding),
+                "query_embedding": vectors.to_text(query_embedding),
                 "user_id": current_user.id,
                 "limit": limit,
             },
@@ -82,12 +157,19 @@ async def search_files(
                 user_id=row[4],
                 created_at=row[5],
                 similarity=float(row[6]),
+                near_duplicate_of=row[7],
             )
             for row in results
         ]
 
     except HTTPException:
         raise
+    except resilience.ProviderUnavailableError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Embedding provider is temporarily unavailable",
+            headers={"Retry-After": str(round(e.retry_after))},
+        ) from e
     except ValueError as e:
         msg = f"Error performing vector search: {e!s}"
         raise HTTPException(
@@ -104,18 +186,24 @@ async def search_files(
 async def find_similar_files(
     file_id: int,
     limit: int = Query(10, description="Maximum number of results to return", ge=1, le=100),
+    pooling: Literal["max", "mean"] | None = Query(None, description="How chunk similarities are pooled per file"),
     current_user: models.User = Depends(oauth2.get_current_user),
     session: Session = Depends(database.get_session),
 ):
     """
     Find files similar to an existing file in the user's collection.
 
+    Each chunk of another file is scored by its best match among the chunks of
+    the target file, and these scores are pooled into the similarity of the file.
+
     Parameters
     ----------
     file_id : int
         The ID of the file to find similar files for.
     limit : int, optional
         Maximum number of results to return (default: 10, max: 100).
+    pooling : str, optional
+        Either "max" or "mean" (default: `settings.search_pooling`).
     current_user : models.User
         The authenticated user.
     session : Session
@@ -132,7 +220,7 @@ async def find_similar_files(
         If the file doesn't exist or belongs to another user.
 
     """
-    # First, get the target file's embedding
+    # First, check the target file exists and belongs to the user
     target_file = session.exec(
         select(models.FileMetadata).where(
             models.FileMetadata.id == file_id,
@@ -147,24 +235,12 @@ async def find_similar_files(
         )
 
     try:
-        # Find similar files using the target file's embedding
-        stmt = text("""
-            SELECT id, filename, content_type, size, user_id, created_at,
-                   1 - (embedding <=> :target_embedding) as similarity
-            FROM filemetadata
-            WHERE user_id = :user_id AND id != :file_id
-            ORDER BY embedding <=> :target_embedding
-            LIMIT :limit
-        """)
+        # Find similar files by comparing their chunks with the target file's chunks
+        stmt = text(FIND_SIMILAR_FILES_SQL.format(pooling=POOLING_AGGREGATES[pooling or settings.search_pooling]))
 
         results = session.execute(
             stmt,
             {
-                "target_embedding": str(
-                    target_file.embedding.tolist()
-                    if hasattr(target_file.embedding, "tolist")
-                    else target_file.embedding,
-                ),
                 "user_id": current_user.id,
                 "file_id": file_id,
                 "limit": limit,
@@ -181,6 +257,7 @@ async def find_similar_files(
                 user_id=row[4],
                 created_at=row[5],
                 similarity=float(row[6]),
+                near_duplicate_of=row[7],
             )
             for row in results
         ]
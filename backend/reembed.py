@@ -0,0 +1,507 @@
+"""This module defines the Celery tasks embedding every file again when the embedding model changes.
+
+A re-embedding job writes the new embeddings next to the ones being served: the file embeddings to an
+`embedding_next` column of `filemetadata`, the chunks to a `filechunk_next` table. Search keeps using
+the current embeddings until the job switches to the new ones in a single transaction.
+
+The job walks the files in batches ordered by ID. Each batch is written together with the ID of its
+last file, so a job interrupted by a crash resumes after the last batch it stored. Files added or
+updated while the job runs are caught by a trigger resetting their new embeddings, and embedded again
+by a further pass before the switch.
+
+Usage:
+
+- `celery -A backend.main call start_reembedding --args='["<model>", <dimensions>]'`
+- `celery -A backend.main call resume_reembedding` after the workers were down
+- `celery -A backend.main call switch_embeddings --args='[<job id>]'` once the job is ready
+- `celery -A backend.main call cancel_reembedding`
+
+The switch only runs on a worker configured with the `EMBEDDING_MODEL` and `EMBEDDING_DIMENSIONS` of the
+job, as the API and the workers must run with them as soon as the embeddings are switched: switch from a
+worker deployed with the new configuration, then deploy it to the API and the other workers. Jobs started
+with `auto_switch=True` switch by themselves when the worker finishing them is configured so.
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import Connection, text
+from sqlmodel import Session, select
+
+from api.core import chunking, embeddings, models, resilience, simhash, vectors
+from api.core.config import EmbeddingEndpoint, settings
+from backend.main import app, engine, fingerprinted, read_object, run
+
+logger = logging.getLogger(__name__)
+
+# Keeps the new embeddings of a file in line with its content while a job runs
+INVALIDATE_FUNCTION = """
+    CREATE OR REPLACE FUNCTION reembed_invalidate() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.embedding IS DISTINCT FROM OLD.embedding THEN
+            NEW.embedding_next := NULL;
+            DELETE FROM filechunk_next WHERE file_id = NEW.id;
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+def shadow_type(job: models.ReembedJob) -> str:
+    """The SQL type of the new embeddings of a job."""
+    return f"{settings.embedding_storage}({job.dimensions})"
+
+
+def is_indexed(job: models.ReembedJob) -> bool:
+    """Whether the new embeddings of a job get HNSW indexes, see `database.migrate_embedding_storage`."""
+    return (
+        settings.embedding_hnsw_index and job.dimensions <= vectors.MAX_INDEXED_DIMENSIONS[settings.embedding_storage]
+    )
+
+
+def hnsw_index(name: str, table: str, column: str) -> str:
+    """The statement creating an HNSW index over embeddings."""
+    return f"CREATE INDEX {name} ON {table} USING hnsw ({column} {settings.embedding_storage}_cosine_ops)"
+
+
+def runs_job_model(job: models.ReembedJob) -> bool:
+    """Whether this process is configured with the model and dimensions of a job."""
+    return (settings.embedding_model, vectors.storage_dimensions()) == (job.model, job.dimensions)
+
+
+def create_shadow(conn: Connection, job: models.ReembedJob) -> None:
+    """Create the column, table and trigger receiving the new embeddings of a job."""
+    conn.execute(text(f"ALTER TABLE filemetadata ADD COLUMN embedding_next {shadow_type(job)}"))
+    conn.execute(text("CREATE TABLE filechunk_next (LIKE filechunk INCLUDING DEFAULTS)"))
+    conn.execute(text(f"ALTER TABLE filechunk_next ALTER COLUMN embedding TYPE {shadow_type(job)}"))
+    conn.execute(text("ALTER TABLE filechunk_next ADD CONSTRAINT filechunk_next_pkey PRIMARY KEY (id)"))
+    conn.execute(
+        text(
+            "ALTER TABLE filechunk_next ADD CONSTRAINT filechunk_next_file_id_fkey "
+            "FOREIGN KEY (file_id) REFERENCES filemetadata(id) ON DELETE CASCADE",
+        ),
+    )
+    conn.execute(text("CREATE INDEX ix_filechunk_next_file_id ON filechunk_next (file_id)"))
+    conn.execute(text("CREATE INDEX ix_filechunk_next_content_hash ON filechunk_next (content_hash)"))
+    if is_indexed(job):
+        # Built as the new embeddings are written, so that the switch has nothing left to index
+        conn.execute(text(hnsw_index("filechunk_next_embedding_hnsw", "filechunk_next", "embedding")))
+        conn.execute(text(hnsw_index("filemetadata_embedding_next_hnsw", "filemetadata", "embedding_next")))
+    conn.execute(text(INVALIDATE_FUNCTION))
+    conn.execute(
+        text(
+            "CREATE TRIGGER filemetadata_reembed BEFORE UPDATE ON filemetadata "
+            "FOR EACH ROW EXECUTE FUNCTION reembed_invalidate()",
+        ),
+    )
+
+
+def drop_shadow(conn: Connection) -> None:
+    """Drop whatever is left of the column, table and trigger of a job."""
+    conn.execute(text("DROP TRIGGER IF EXISTS filemetadata_reembed ON filemetadata"))
+    conn.execute(text("DROP FUNCTION IF EXISTS reembed_invalidate()"))
+    conn.execute(text("DROP TABLE IF EXISTS filechunk_next"))
+    conn.execute(text("ALTER TABLE filemetadata DROP COLUMN IF EXISTS embedding_next"))
+
+
+def active_job(session: Session) -> models.ReembedJob | None:
+    """The job currently running or waiting for its switch, if any."""
+    return session.exec(
+        select(models.ReembedJob).where(models.ReembedJob.status.in_(("running", "ready"))),
+    ).first()
+
+
+@functools.cache
+def get_job_provider(base_url: str, model: str, dimensions: int) -> resilience.ResilientProvider:
+    """
+    Get the provider of the model of a job, creating it on first use.
+
+    Parameters
+    ----------
+    base_url : str
+        Base URL of the embeddings API serving the model.
+    model : str
+        The name of the model.
+    dimensions : int
+        Number of dimensions of the embeddings of the model.
+
+    Returns
+    -------
+    resilience.ResilientProvider
+        The provider, under the same protections as the provider of the current model.
+    """
+    return embeddings.create_endpoint_provider(EmbeddingEndpoint(base_url=base_url, model=model), dimensions)
+
+
+async def embed_texts(provider: resilience.ResilientProvider, texts: list[str]) -> list[vectors.Embedding]:
+    """
+    Embed texts in batches sent concurrently, within the concurrency limit of the provider.
+
+    Parameters
+    ----------
+    provider : resilience.ResilientProvider
+        The provider of the model of the job.
+    texts : list[str]
+        The texts to embed.
+
+    Returns
+    -------
+    list[vectors.Embedding]
+        The vector embeddings, in the same order as `texts`.
+    """
+    size = settings.embedding_batch_max_size
+    batches = await asyncio.gather(*(provider.embed(texts[i : i + size]) for i in range(0, len(texts), size)))
+    return [embedding for batch in batches for embedding in batch]
+
+
+@app.task(name="start_reembedding")
+def start_reembedding(model: str, dimensions: int, base_url: str | None = None, *, auto_switch: bool = False) -> int:
+    """
+    Start embedding every file again with another model.
+
+    Parameters
+    ----------
+    model : str
+        The name of the new model.
+    dimensions : int
+        Number of dimensions of the embeddings of the new model.
+    base_url : str | None, optional
+        Base URL of the embeddings API serving the new model, by default `settings.embedding_base_url`.
+    auto_switch : bool, optional
+        Whether to switch to the new embeddings as soon as every file is embedded, by default False. The
+        switch only happens if the worker finishing the job is configured with the new model.
+
+    Returns
+    -------
+    int
+        The ID of the job.
+
+    Raises
+    ------
+    ValueError
+        If another job is running or waiting for its switch.
+    """
+    with Session(engine) as session:
+        session.execute(text("SELECT pg_advisory_xact_lock(hashtext('reembed'))"))
+        if active_job(session):
+            msg = "Another re-embedding job is in progress, cancel it first"
+            raise ValueError(msg)
+        job = models.ReembedJob(
+            model=model,
+            base_url=base_url or settings.embedding_base_url,
+            dimensions=dimensions,
+            auto_switch=auto_switch,
+        )
+        session.add(job)
+        session.flush()
+        drop_shadow(session.connection())
+        create_shadow(session.connection(), job)
+        session.commit()
+        job_id = job.id
+
+    logger.info("Started re-embedding job %s with model %s", job_id, model)
+    reembed_batch.delay(job_id)
+    return job_id
+
+
+@app.task(name="resume_reembedding")
+def resume_reembedding() -> int | None:
+    """
+    Resume the running job, after its chain of tasks was lost with the workers.
+
+    Returns
+    -------
+    int | None
+        The ID of the job, or None if no job is running.
+    """
+    with Session(engine) as session:
+        job = active_job(session)
+    if job is None or job.status != "running":
+        return None
+    reembed_batch.delay(job.id)
+    return job.id
+
+
+@app.task(name="cancel_reembedding")
+def cancel_reembedding() -> int | None:
+    """
+    Cancel the active job and drop the embeddings it stored.
+
+    Returns
+    -------
+    int | None
+        The ID of the job, or None if no job was active.
+    """
+    with Session(engine) as session:
+        session.execute(text("SELECT pg_advisory_xact_lock(hashtext('reembed'))"))
+        job = active_job(session)
+        if job is None:
+            return None
+        job.status = "cancelled"
+        job.updated_at = datetime.utcnow()  # noqa: DTZ003
+        session.add(job)
+        drop_shadow(session.connection())
+        session.commit()
+        return job.id
+
+
+@app.task(name="reembed_batch", bind=True, acks_late=True, max_retries=None)
+def reembed_batch(self, job_id: int) -> str:
+    """
+    Embed the next batch of files of a job, then queue the next batch at the configured rate.
+
+    Parameters
+    ----------
+    job_id : int
+        The ID of the job.
+
+    Returns
+    -------
+    str
+        A message describing the progress of the job.
+    """
+    started = time.monotonic()
+    with engine.connect() as lock_conn:
+        # Resuming a job that is still running must not start a second chain of batches
+        if not lock_conn.execute(
+            text("SELECT pg_try_advisory_lock(hashtext('reembed_batch'), :id)"),
+            {"id": job_id},
+        ).scalar():
+            return f"Re-embedding job {job_id} is already being processed"
+        try:
+            done, chunk_count = embed_next_batch(job_id)
+        except resilience.ProviderUnavailableError as exc:
+            raise self.retry(exc=exc, countdown=exc.retry_after) from exc
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext('reembed_batch'), :id)"), {"id": job_id})
+            lock_conn.commit()
+
+    if done is None:
+        return f"Re-embedding job {job_id} is not running"
+    if done == 0:
+        return finish_pass(job_id)
+
+    # Spread the calls to the provider so that the job stays under its rate
+    countdown = max(chunk_count / settings.reembed_chunks_per_second - (time.monotonic() - started), 0)
+    reembed_batch.apply_async((job_id,), countdown=countdown)
+    return f"Re-embedded {done} files for job {job_id}"
+
+
+def embed_next_batch(job_id: int) -> tuple[int | None, int]:
+    """
+    Embed the files following the checkpoint of a job and store their new embeddings.
+
+    Parameters
+    ----------
+    job_id : int
+        The ID of the job.
+
+    Returns
+    -------
+    tuple[int | None, int]
+        The number of files of the batch, None if the job is not running, and the number of chunks embedded.
+    """
+    with Session(engine) as session:
+        job = session.get(models.ReembedJob, job_id)
+        if job is None or job.status != "running":
+            return None, 0
+        files = session.execute(
+            text(
+                "SELECT id, minio_path, simhash, near_duplicate_of FROM filemetadata "
+                "WHERE id > :checkpoint AND embedding_next IS NULL ORDER BY id LIMIT :limit",
+            ),
+            {"checkpoint": job.checkpoint, "limit": settings.reembed_batch_files},
+        ).all()
+        if not files:
+            return 0, 0
+
+        # Near-duplicates share the new embeddings of the file they link to, when it has them already
+        linked = session.execute(
+            text(
+                "UPDATE filemetadata f SET embedding_next = o.embedding_next FROM filemetadata o "
+                "WHERE f.id = ANY(:ids) AND o.id = f.near_duplicate_of AND o.embedding_next IS NOT NULL "
+                "RETURNING f.id",
+            ),
+            {"ids": [file.id for file in files]},
+        ).scalars()
+        linked_ids = set(linked)
+
+        chunked_files = []
+        for file in files:
+            if file.id in linked_ids:
+                continue
+            hasher = simhash.SimHash()
+            with contextlib.closing(read_object(file.minio_path)) as pieces:
+                chunks = list(
+                    chunking.iter_chunks(
+                        fingerprinted(pieces, hasher),
+                        settings.chunk_window_tokens,
+                        settings.chunk_overlap_tokens,
+                        content_defined=settings.chunk_boundaries == "content",
+                    ),
+                )
+            chunked_files.append((file, hasher.digest(), chunks))
+
+        # Chunks with the same content across the batch are only embedded once
+        texts = {chunk.content_hash: chunk.text for _, _, chunks in chunked_files for chunk in chunks}
+        provider = get_job_provider(job.base_url, job.model, job.dimensions)
+        generated = run(embed_texts(provider, list(texts.values())))
+        by_hash = dict(zip(texts, generated, strict=True))
+
+        for file, fingerprint, chunks in chunked_files:
+            chunk_embeddings = [by_hash[chunk.content_hash] for chunk in chunks]
+            # A file updated since it was read keeps no new embeddings, the next pass embeds it again
+            updated = session.execute(
+                text(
+                    "UPDATE filemetadata SET embedding_next = :embedding "
+                    "WHERE id = :id AND simhash IS NOT DISTINCT FROM :simhash",
+                ),
+                {
+                    "id": file.id,
+                    "simhash": fingerprint if file.simhash is not None else None,
+                    "embedding": vectors.to_text(embeddings.pool_embeddings(chunk_embeddings)),
+                },
+            ).rowcount
+            if not updated or file.near_duplicate_of is not None:
+                continue
+            session.execute(text("DELETE FROM filechunk_next WHERE file_id = :id"), {"id": file.id})
+            session.execute(
+                text(
+                    "INSERT INTO filechunk_next "
+                    "(file_id, chunk_index, start_offset, end_offset, token_count, content_hash, embedding) "
+                    "VALUES (:file_id, :chunk_index, :start_offset, :end_offset, :token_count, :content_hash, "
+                    ":embedding)",
+                ),
+                [
+                    {
+                        "file_id": file.id,
+                        "chunk_index": chunk.index,
+                        "start_offset": chunk.start_offset,
+                        "end_offset": chunk.end_offset,
+                        "token_count": chunk.token_count,
+                        "content_hash": chunk.content_hash,
+                        "embedding": vectors.to_text(embedding),
+                    }
+                    for chunk, embedding in zip(chunks, chunk_embeddings, strict=True)
+                ],
+            )
+
+        # The checkpoint is stored with the embeddings, so a crash never skips nor repeats a batch
+        job.checkpoint = files[-1].id
+        job.files_done += len(files)
+        job.updated_at = datetime.utcnow()  # noqa: DTZ003
+        session.add(job)
+        session.commit()
+        return len(files), len(texts)
+
+
+def finish_pass(job_id: int) -> str:
+    """
+    End a pass over the files of a job: start another pass if files were left, or get ready to switch.
+
+    Parameters
+    ----------
+    job_id : int
+        The ID of the job.
+
+    Returns
+    -------
+    str
+        A message describing the progress of the job.
+    """
+    with Session(engine) as session:
+        job = session.get(models.ReembedJob, job_id)
+        if job is None or job.status != "running":
+            return f"Re-embedding job {job_id} is not running"
+        remaining = session.execute(text("SELECT count(*) FROM filemetadata WHERE embedding_next IS NULL")).scalar()
+        job.checkpoint = 0
+        job.updated_at = datetime.utcnow()  # noqa: DTZ003
+        if not remaining:
+            job.status = "ready"
+        auto_switch, can_switch = job.auto_switch, runs_job_model(job)
+        session.add(job)
+        session.commit()
+
+    if remaining:
+        reembed_batch.delay(job_id)
+        return f"{remaining} files of re-embedding job {job_id} were added or updated, starting another pass"
+    if auto_switch and can_switch:
+        switch_embeddings.delay(job_id)
+    elif auto_switch:
+        logger.warning("Re-embedding job %s is ready, switch it from a worker configured with its model", job_id)
+    return f"Re-embedding job {job_id} is ready to switch"
+
+
+@app.task(name="switch_embeddings")
+def switch_embeddings(job_id: int, *, force: bool = False) -> str:
+    """
+    Replace the embeddings being served with those of a job, in a single transaction.
+
+    Files uploaded after the job finished its last pass are embedded first: the job goes back to
+    running and switches once they are done.
+
+    Parameters
+    ----------
+    job_id : int
+        The ID of the job.
+    force : bool, optional
+        Whether to switch even though this worker is not configured with the model of the job, by default
+        False. The API and the workers fail to search and store embeddings until they are.
+
+    Returns
+    -------
+    str
+        A message describing the outcome.
+    """
+    with Session(engine) as session:
+        session.execute(text("SELECT pg_advisory_xact_lock(hashtext('reembed'))"))
+        job = session.get(models.ReembedJob, job_id)
+        if job is None or job.status != "ready":
+            return f"Re-embedding job {job_id} is not ready to switch"
+        if not force and not runs_job_model(job):
+            return (
+                f"Not switching to the embeddings of re-embedding job {job_id}: set EMBEDDING_MODEL to {job.model} "
+                f"and the stored dimensions to {job.dimensions} first"
+            )
+
+        # Stops uploads and searches for the duration of the switch, which only changes the catalog
+        session.execute(text("LOCK TABLE filemetadata, filechunk IN ACCESS EXCLUSIVE MODE"))
+        remaining = session.execute(text("SELECT count(*) FROM filemetadata WHERE embedding_next IS NULL")).scalar()
+        if remaining:
+            job.status = "running"
+            job.auto_switch = True
+            session.add(job)
+            session.commit()
+            reembed_batch.delay(job_id)
+            return f"{remaining} files of re-embedding job {job_id} are not embedded yet, switching afterwards"
+
+        for statement in (
+            "DROP TRIGGER filemetadata_reembed ON filemetadata",
+            "DROP FUNCTION reembed_invalidate()",
+            "ALTER SEQUENCE filechunk_id_seq OWNED BY filechunk_next.id",
+            "DROP TABLE filechunk",
+            "ALTER TABLE filechunk_next RENAME TO filechunk",
+            "ALTER TABLE filechunk RENAME CONSTRAINT filechunk_next_pkey TO filechunk_pkey",
+            "ALTER TABLE filechunk RENAME CONSTRAINT filechunk_next_file_id_fkey TO filechunk_file_id_fkey",
+            "ALTER INDEX ix_filechunk_next_file_id RENAME TO ix_filechunk_file_id",
+            "ALTER INDEX IF EXISTS ix_filechunk_next_content_hash RENAME TO ix_filechunk_content_hash",
+            "ALTER INDEX IF EXISTS filechunk_next_embedding_hnsw RENAME TO filechunk_embedding_hnsw",
+            "ALTER TABLE filemetadata DROP COLUMN embedding",
+            "ALTER TABLE filemetadata RENAME COLUMN embedding_next TO embedding",
+            "ALTER TABLE filemetadata ALTER COLUMN embedding SET NOT NULL",
+            "ALTER INDEX IF EXISTS filemetadata_embedding_next_hnsw RENAME TO filemetadata_embedding_hnsw",
+        ):
+            session.execute(text(statement))
+
+        job.status = "switched"
+        job.updated_at = datetime.utcnow()  # noqa: DTZ003
+        session.add(job)
+        session.commit()
+
+    logger.info("Switched to the embeddings of re-embedding job %s with model %s", job_id, job.model)
+    return f"Switched to the embeddings of model {job.model}"
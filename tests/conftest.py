@@ -1,14 +1,16 @@
-from functools import partial
+from functools import cache
 
 import pytest
+from celery import Celery
 from fastapi.testclient import TestClient
+from minio import Minio
 from sqlmodel import Session, SQLModel, create_engine, select
 
 from api.core import models
-from api.core.celery import get_celery_client
+from api.core.celery import create_celery_client, get_celery_client
 from api.core.config import settings
 from api.core.database import get_session
-from api.core.files import get_minio_client
+from api.core.files import create_minio_client, get_minio_client, provision_bucket
 from api.main import app
 
 
@@ -23,14 +25,26 @@ def session():
         yield session
 
 
+@cache
+def get_local_celery_client() -> Celery:
+    return create_celery_client("localhost")
+
+
+@cache
+def get_local_minio_client() -> Minio:
+    client = create_minio_client("localhost")
+    provision_bucket(client)
+    return client
+
+
 @pytest.fixture
 def client(session: Session):
     def get_session_override():
         return session
 
     app.dependency_overrides[get_session] = get_session_override
-    app.dependency_overrides[get_celery_client] = partial(get_celery_client, "localhost")
-    app.dependency_overrides[get_minio_client] = partial(get_minio_client, "localhost")
+    app.dependency_overrides[get_celery_client] = get_local_celery_client
+    app.dependency_overrides[get_minio_client] = get_local_minio_client
 
     client = TestClient(app)
     yield client
@@ -1,9 +1,14 @@
+import io
 import tempfile
+import zipfile
 
+import urllib3
 from fastapi import status
 from fastapi.testclient import TestClient
 
 from api.core import models
+from api.core.files import get_minio_client
+from api.main import app
 
 
 def test_upload_file(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
@@ -37,3 +42,107 @@ def test_upload_file_auth_fail(client: TestClient):
         response = client.post("/files", files=files)
 
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_upload_status(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    with tempfile.TemporaryFile() as fp:
+        files = [("file", ("my_file.txt", fp, "text/plain"))]
+        upload = client.post("/files", headers=headers, files=files).json()
+
+    response = client.get(f"/files/{upload['id']}/status", headers=headers)
+    data = response.json()
+    assert response.status_code == status.HTTP_200_OK
+    assert data["filename"] == "my_file.txt"
+    assert data["status"] == upload["status"]
+
+    response = client.get("/files/status", headers=headers, params={"ids": [upload["id"]]})
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["id"] for item in response.json()] == [upload["id"]]
+
+
+def test_upload_status_not_found(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    response = client.get("/files/0/status", headers=headers)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_upload_same_content_is_coalesced(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    uploads = [
+        client.post("/files", headers=headers, files=[("file", ("same.txt", b"same content", "text/plain"))]).json()
+        for _ in range(2)
+    ]
+    changed = client.post("/files", headers=headers, files=[("file", ("same.txt", b"new content", "text/plain"))])
+
+    assert uploads[0]["id"] == uploads[1]["id"]
+    assert changed.json()["id"] != uploads[0]["id"]
+
+
+def test_upload_invalid_text_fail(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    files = [("file", ("my_file.txt", b"not \xff text", "text/plain"))]
+    response = client.post("/files", headers=headers, files=files)
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_upload_unreachable_storage_fail(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    class UnreachableMinio:
+        @staticmethod
+        def put_object(*_args, **_kwargs):
+            raise urllib3.exceptions.MaxRetryError(None, "/my_file.txt")
+
+    app.dependency_overrides[get_minio_client] = UnreachableMinio
+    files = [("file", ("my_file.txt", b"text", "text/plain"))]
+    response = client.post("/files", headers=headers, files=files)
+
+    assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+    assert response.json()["detail"] == "Error uploading file."
+
+
+def test_bulk_upload(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("docs/a.txt", "first")
+        zip_file.writestr("docs/b.bin", b"\x00")
+    files = [
+        ("files", ("plain.txt", b"plain", "text/plain")),
+        ("files", ("batch.zip", archive.getvalue(), "application/zip")),
+    ]
+    response = client.post("/files/bulk", headers=headers, files=files)
+
+    data = response.json()
+    assert response.status_code == status.HTTP_200_OK
+    assert [item["filename"] for item in data] == ["plain.txt", "docs/a.txt", "docs/b.bin"]
+    assert [item["status"] == "rejected" for item in data] == [False, False, True]
+
+
+def test_direct_upload(client: TestClient, logged_in_user: tuple[dict, list[models.UserCreate]]):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    response = client.post("/files/uploads", headers=headers, json={"filename": "direct.txt"})
+    assert response.status_code == status.HTTP_201_CREATED
+    assert "direct.txt" in response.json()["url"]
+
+    response = client.post("/files/uploads/complete", headers=headers, json={"filename": "direct.txt"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    response = client.post("/files/uploads", headers=headers, json={"filename": "../direct.txt"})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
@@ -5,13 +5,14 @@ from fastapi import status
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
-from api.core import models
+from api.core import cache, models
 
 
 @pytest.fixture
 def mock_embeddings():
     with patch("api.core.embeddings.generate_embedding", new_callable=AsyncMock) as mock:
         mock.return_value = [0.1] * 4096  # Mock embedding vector with 4096 dimensions
+        cache.get_query_cache().clear()
         yield mock
 
 
@@ -62,6 +63,147 @@ def test_search_files_success(
     session.commit()
 
 
+def test_search_files_pools_chunk_similarities(
+    client: TestClient,
+    logged_in_user: tuple[dict, list[models.UserCreate]],
+    session: Session,
+    mock_embeddings,
+):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    user_email = logged_in_user[1][0].email
+    user = session.query(models.User).filter(models.User.email == user_email).first()
+
+    matching, other = [1.0] + [0.0] * 4095, [0.0, 1.0] + [0.0] * 4094
+    mock_embeddings.return_value = matching
+
+    chunked_file = models.FileMetadata(
+        user_id=user.id,
+        filename="chunked_document.txt",
+        content_type="text/plain",
+        size=100,
+        minio_path=f"{user.id}/chunked_document.txt",
+        embedding=[0.5, 0.5] + [0.0] * 4094,
+    )
+    session.add(chunked_file)
+    session.commit()
+    session.refresh(chunked_file)
+    session.add_all(
+        [
+            models.FileChunk(
+                file_id=chunked_file.id,
+                chunk_index=0,
+                start_offset=0,
+                end_offset=50,
+                token_count=10,
+                embedding=matching,
+            ),
+            models.FileChunk(
+                file_id=chunked_file.id,
+                chunk_index=1,
+                start_offset=50,
+                end_offset=100,
+                token_count=10,
+                embedding=other,
+            ),
+        ],
+    )
+    session.commit()
+
+    max_response = client.get("/search/files?query=chunks&pooling=max", headers=headers)
+    mean_response = client.get("/search/files?query=chunks&pooling=mean", headers=headers)
+
+    assert max_response.status_code == status.HTTP_200_OK
+    assert mean_response.status_code == status.HTTP_200_OK
+    max_result = next(item for item in max_response.json() if item["id"] == chunked_file.id)
+    mean_result = next(item for item in mean_response.json() if item["id"] == chunked_file.id)
+    assert max_result["similarity"] == pytest.approx(1.0)
+    assert mean_result["similarity"] == pytest.approx(0.5)
+
+    # Cleanup test data, chunks are deleted with their file
+    session.delete(chunked_file)
+    session.commit()
+
+
+def test_search_files_near_duplicate_uses_linked_chunks(
+    client: TestClient,
+    logged_in_user: tuple[dict, list[models.UserCreate]],
+    session: Session,
+    mock_embeddings,
+):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    user_email = logged_in_user[1][0].email
+    user = session.query(models.User).filter(models.User.email == user_email).first()
+
+    matching, other = [1.0] + [0.0] * 4095, [0.0, 1.0] + [0.0] * 4094
+    mock_embeddings.return_value = matching
+
+    original = models.FileMetadata(
+        user_id=user.id,
+        filename="original.log",
+        content_type="text/plain",
+        size=100,
+        minio_path=f"{user.id}/original.log",
+        embedding=other,
+    )
+    session.add(original)
+    session.commit()
+    session.refresh(original)
+    session.add(
+        models.FileChunk(
+            file_id=original.id,
+            chunk_index=0,
+            start_offset=0,
+            end_offset=100,
+            token_count=20,
+            embedding=matching,
+        ),
+    )
+    revision = models.FileMetadata(
+        user_id=user.id,
+        filename="revision.log",
+        content_type="text/plain",
+        size=101,
+        minio_path=f"{user.id}/revision.log",
+        embedding=other,
+        near_duplicate_of=original.id,
+    )
+    session.add(revision)
+    session.commit()
+    session.refresh(revision)
+
+    response = client.get("/search/files?query=near duplicate", headers=headers)
+
+    assert response.status_code == status.HTTP_200_OK
+    result = next(item for item in response.json() if item["id"] == revision.id)
+    assert result["similarity"] == pytest.approx(1.0)
+    assert result["near_duplicate_of"] == original.id
+
+    # Cleanup test data, the link is cleared when the original is deleted
+    session.delete(revision)
+    session.delete(original)
+    session.commit()
+
+
+def test_search_files_repeated_query_uses_cache(
+    client: TestClient,
+    logged_in_user: tuple[dict, list[models.UserCreate]],
+    mock_embeddings,
+):
+    jwt = logged_in_user[0]["access_token"]
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    first = client.get("/search/files?query=cached query", headers=headers)
+    second = client.get("/search/files?query=Cached  Query", headers=headers)
+
+    assert first.status_code == status.HTTP_200_OK
+    assert second.status_code == status.HTTP_200_OK
+    mock_embeddings.assert_called_once()
+
+
 def test_search_files_unauthorized(client: TestClient):
     response = client.get("/search/files?query=test")
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -0,0 +1,296 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import time
+from types import SimpleNamespace
+
+import pytest
+from celery.exceptions import Retry
+
+from api.core import models
+from backend import main
+
+
+class Recorder:
+    def __init__(self):
+        self.stored = []
+        self.started = []
+        self.completed = []
+        self.dispatched = 0
+
+    def store(self, ingested_files):
+        self.stored.extend(ingested_files)
+
+    def start(self, _connection, started):
+        self.started.append(started)
+
+    def complete(self, _connection, stored, failed):
+        self.completed.append((stored, failed))
+
+    def dispatch(self, _connection, _client):
+        self.dispatched += 1
+        return []
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(main, "store_ingested_files", recorder.store)
+    monkeypatch.setattr(main.scheduling, "start", recorder.start)
+    monkeypatch.setattr(main.scheduling, "complete", recorder.complete)
+    monkeypatch.setattr(main.scheduling, "dispatch", recorder.dispatch)
+    monkeypatch.setattr(main.engine, "begin", contextlib.nullcontext)
+    return recorder
+
+
+def ingested(user_id: int, filename: str) -> main.IngestedFile:
+    metadata = models.FileMetadata(user_id=user_id, filename=filename, content_type="text/plain", size=1, minio_path="")
+    return main.IngestedFile(metadata, None, [])
+
+
+def test_files_are_ingested_on_the_worker_loop(monkeypatch, recorder):
+    async def ingest_file(user_id, filename, _content_type):
+        await asyncio.sleep(0)
+        if filename == "bad.txt":
+            raise ValueError(filename)
+        return ingested(user_id, filename)
+
+    monkeypatch.setattr(main, "ingest_file", ingest_file)
+
+    message = main.process_files([(1, "a.txt", "text/plain"), (1, "bad.txt", "text/plain"), (2, "b.txt", "text/plain")])
+
+    assert message == "Processed 2 files, 1 failed"
+    assert [file.metadata.filename for file in recorder.stored] == ["a.txt", "b.txt"]
+    assert recorder.started == [[(1, "a.txt"), (1, "bad.txt"), (2, "b.txt")]]
+    assert recorder.completed == [([(1, "a.txt"), (2, "b.txt")], [(1, "bad.txt", "bad.txt")])]
+    assert recorder.dispatched == 1
+
+
+def test_files_that_cannot_be_stored_fail(monkeypatch, recorder):
+    async def ingest_file(user_id, filename, _content_type):
+        await asyncio.sleep(0)
+        return ingested(user_id, filename)
+
+    def store(_ingested_files):
+        msg = "COPY failed"
+        raise OSError(msg)
+
+    monkeypatch.setattr(main, "ingest_file", ingest_file)
+    monkeypatch.setattr(main, "store_ingested_files", store)
+
+    assert main.process_files([(1, "a.txt", "text/plain")]) == "Processed 0 files, 1 failed"
+    assert recorder.completed == [([], [(1, "a.txt", "COPY failed")])]
+    assert recorder.dispatched == 1
+
+
+def test_a_file_that_cannot_be_stored_does_not_fail_the_others(monkeypatch, recorder):
+    async def ingest_file(user_id, filename, _content_type):
+        await asyncio.sleep(0)
+        return ingested(user_id, filename)
+
+    def store(ingested_files):
+        if any(file.metadata.filename == "bad.txt" for file in ingested_files):
+            msg = "invalid byte sequence"
+            raise ValueError(msg)
+        recorder.store(ingested_files)
+
+    monkeypatch.setattr(main, "ingest_file", ingest_file)
+    monkeypatch.setattr(main, "store_ingested_files", store)
+
+    message = main.process_files([(1, "a.txt", "text/plain"), (1, "bad.txt", "text/plain"), (2, "b.txt", "text/plain")])
+
+    assert message == "Processed 2 files, 1 failed"
+    assert [file.metadata.filename for file in recorder.stored] == ["a.txt", "b.txt"]
+    assert recorder.completed == [([(1, "a.txt"), (2, "b.txt")], [(1, "bad.txt", "invalid byte sequence")])]
+
+
+def test_files_over_the_time_limit_fail_and_are_cancelled(monkeypatch, recorder):
+    cancelled = []
+
+    async def ingest_file(_user_id, filename, _content_type):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(filename)
+            raise
+
+    monkeypatch.setattr(main, "ingest_file", ingest_file)
+    monkeypatch.setattr(main.settings, "ingest_time_limit", 0.05)
+
+    assert main.process_files([(1, "slow.txt", "text/plain")]) == "Processed 0 files, 1 failed"
+    assert recorder.completed == [([], [(1, "slow.txt", "TimeoutError")])]
+    main.run(asyncio.sleep(0.05))
+    assert cancelled == ["slow.txt"]
+
+
+def test_files_are_retried_when_the_worker_loop_stops(monkeypatch, recorder):
+    retries = []
+
+    def run(coroutine, _timeout=None):
+        coroutine.close()
+        msg = "The event loop of the worker process stopped"
+        raise RuntimeError(msg)
+
+    def retry(**kwargs):
+        retries.append(kwargs)
+        return Retry()
+
+    monkeypatch.setattr(main, "run", run)
+    monkeypatch.setattr(main.process_files, "retry", retry)
+
+    with pytest.raises(Retry):
+        main.process_files([(1, "a.txt", "text/plain"), (1, "a.txt", "text/plain")])
+    assert [(retry["args"], retry["countdown"]) for retry in retries] == [([[(1, "a.txt", "text/plain")]], 0)]
+    assert recorder.completed == []
+
+
+class Message:
+    def __init__(self):
+        self.acked = self.requeued = False
+
+    def ack(self):
+        self.acked = True
+
+    def requeue(self):
+        self.requeued = True
+
+
+def object_event(key: str, size: int) -> dict:
+    return {
+        "Records": [{"eventName": "s3:ObjectCreated:Put", "s3": {"object": {"key": key, "size": size, "eTag": "e"}}}],
+    }
+
+
+def test_object_events_are_handed_over_to_a_task(monkeypatch):
+    sent = []
+    monkeypatch.setattr(main.app, "send_task", lambda name, args: sent.append((name, args)))
+    consumer = main.ObjectEventsConsumer(None)
+
+    message = Message()
+    consumer.on_event('{"Records": []}', message)
+    assert sent == [("submit_object_events", [{"Records": []}])]
+    assert message.acked
+
+    message = Message()
+    consumer.on_event("not json", message)
+    assert len(sent) == 1
+    assert message.acked
+
+
+def test_object_events_queue_files_and_remove_oversized_ones(monkeypatch):
+    submitted, removed = [], []
+    monkeypatch.setattr(main.settings, "upload_max_bytes", 10)
+    monkeypatch.setattr(main, "Session", contextlib.nullcontext)
+    monkeypatch.setattr(
+        main.scheduling,
+        "submit_object",
+        lambda _session, _client, user_id, filename, size, etag: submitted.append((user_id, filename, size, etag)),
+    )
+    monkeypatch.setattr(
+        main.files,
+        "get_minio_client",
+        lambda: SimpleNamespace(remove_object=lambda _bucket, name: removed.append(name)),
+    )
+
+    main.submit_object_events(object_event("1/a+b.txt", 5))
+    main.submit_object_events(object_event("1/big.txt", 11))
+    main.submit_object_events(object_event("outside.txt", 5))
+
+    assert submitted == [(1, "a b.txt", 5, "e")]
+    assert removed == ["1/big.txt"]
+
+
+@pytest.fixture
+def worker_loop():
+    main.get_event_loop.cache_clear()
+    yield main.get_event_loop()
+    main.get_event_loop.cache_clear()
+
+
+def wait_closed(loop, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not loop.is_closed() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_concurrent_runs_share_the_worker_loop(worker_loop):
+    threads = 8
+    started = 0
+    all_started = asyncio.Event()
+
+    async def rendezvous():
+        nonlocal started
+        started += 1
+        if started == threads:
+            all_started.set()
+        # Only returns once every thread has its coroutine running on the loop at the same time
+        await all_started.wait()
+        return asyncio.get_running_loop()
+
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        loops = list(executor.map(lambda _: main.run(rendezvous(), 5), range(threads)))
+
+    assert loops == [worker_loop] * threads
+
+
+def test_run_gives_up_when_the_loop_stops(monkeypatch, worker_loop):
+    monkeypatch.setattr(main, "LOOP_CHECK_INTERVAL", 0.01)
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        waiting = executor.submit(main.run, asyncio.Event().wait())
+        time.sleep(0.05)
+        worker_loop.call_soon_threadsafe(worker_loop.stop)
+
+        with pytest.raises(RuntimeError, match="stopped"):
+            waiting.result(5)
+
+
+def test_worker_process_starts_and_stops_its_loop_and_clients(monkeypatch):
+    monkeypatch.setattr(main.settings, "embedding_provider", "hashing")
+    monkeypatch.setattr(main.files, "create_minio_client", lambda _host: SimpleNamespace(bucket_exists=lambda _: True))
+    main.get_event_loop.cache_clear()
+    try:
+        main.init_worker_process()
+        loop = main.get_event_loop()
+        assert main.run(asyncio.sleep(0, "ran"), 5) == "ran"
+        assert main.embeddings.get_provider.cache_info().currsize == 1
+
+        main.shutdown_worker_process()
+        wait_closed(loop)
+        assert loop.is_closed()
+        assert main.embeddings.get_provider.cache_info().currsize == 0
+    finally:
+        main.get_event_loop.cache_clear()
+        main.files.get_minio_client.cache_clear()
+
+
+def test_database_pool_has_a_connection_per_task_thread():
+    assert main.engine.pool.size() == main.settings.ingest_concurrency
+
+
+@pytest.mark.parametrize(("root_simhash", "linked"), [(0b1, True), (0b111111, False)])
+def test_near_duplicates_link_to_a_similar_root_only(monkeypatch, root_simhash, linked):
+    root = models.FileMetadata(id=1, user_id=1, filename="root.txt", content_type="text/plain", size=1, minio_path="")
+    root.simhash = root_simhash
+    linked_file = models.FileMetadata(
+        id=2,
+        user_id=1,
+        filename="copy.txt",
+        content_type="text/plain",
+        size=1,
+        minio_path="",
+    )
+    linked_file.simhash, linked_file.near_duplicate_of = 0b111, root.id
+    new_file = models.FileMetadata(user_id=1, filename="new.txt", content_type="text/plain", size=1, minio_path="")
+    new_file.simhash = 0
+
+    session = SimpleNamespace(get=lambda _model, file_id: root if file_id == root.id else None)
+    monkeypatch.setattr(main.settings, "near_duplicate_similarity", 0.95)
+    monkeypatch.setattr(main, "Session", lambda _engine: contextlib.nullcontext(session))
+    monkeypatch.setattr(main.simhash, "find_near_duplicate", lambda *_args: linked_file)
+
+    assert main.find_near_duplicate(new_file) is (root if linked else None)
+
+
+def test_worker_connects_to_the_broker_of_the_api():
+    assert main.app.conf.broker_url == main.celery.create_celery_client(main.settings.broker_host).conf.broker_url
@@ -0,0 +1,80 @@
+import asyncio
+
+import httpx
+import pytest
+
+from api.core.batching import MicroBatcher
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def bad_request() -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.com/embeddings")
+    return httpx.HTTPStatusError("bad request", request=request, response=httpx.Response(400, request=request))
+
+
+@pytest.mark.anyio
+async def test_concurrent_submissions_share_one_call():
+    calls = []
+
+    async def handler(texts):
+        await asyncio.sleep(0)
+        calls.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    batcher = MicroBatcher(handler, max_batch_size=10, max_wait=0.01)
+    results = await asyncio.gather(*(batcher.submit(text) for text in ["a", "bb", "ccc", "bb"]))
+
+    assert results == [[1.0], [2.0], [3.0], [2.0]]
+    assert calls == [["a", "bb", "ccc"]]
+
+
+@pytest.mark.anyio
+async def test_full_batch_is_sent_without_waiting():
+    calls = []
+
+    async def handler(texts):
+        await asyncio.sleep(0)
+        calls.append(texts)
+        return [[0.0] for _ in texts]
+
+    batcher = MicroBatcher(handler, max_batch_size=2, max_wait=60)
+    await asyncio.wait_for(asyncio.gather(*(batcher.submit(text) for text in ["a", "b", "c", "d"])), timeout=1)
+
+    assert calls == [["a", "b"], ["c", "d"]]
+
+
+@pytest.mark.anyio
+async def test_bad_input_only_fails_its_own_caller():
+    async def handler(texts):
+        await asyncio.sleep(0)
+        if "bad" in texts:
+            raise bad_request()
+        return [[1.0] for _ in texts]
+
+    batcher = MicroBatcher(handler, max_batch_size=10, max_wait=0.01)
+    results = await asyncio.gather(*(batcher.submit(text) for text in ["a", "bad", "b"]), return_exceptions=True)
+
+    assert results[0] == [1.0]
+    assert isinstance(results[1], httpx.HTTPStatusError)
+    assert results[2] == [1.0]
+
+
+@pytest.mark.anyio
+async def test_transient_error_fails_whole_batch():
+    calls = []
+
+    async def handler(texts):
+        await asyncio.sleep(0)
+        calls.append(texts)
+        msg = "timeout"
+        raise httpx.ConnectTimeout(msg)
+
+    batcher = MicroBatcher(handler, max_batch_size=10, max_wait=0.01)
+    results = await asyncio.gather(*(batcher.submit(text) for text in ["a", "b"]), return_exceptions=True)
+
+    assert all(isinstance(result, httpx.ConnectTimeout) for result in results)
+    assert len(calls) == 1
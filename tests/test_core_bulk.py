@@ -0,0 +1,14 @@
+from datetime import datetime
+
+import numpy as np
+
+from api.core import bulk
+
+
+def test_format_value_escapes_copy_text_format():
+    assert bulk.format_value(None) == "\\N"
+    assert bulk.format_value(value=True) == "t"
+    assert bulk.format_value(42) == "42"
+    assert bulk.format_value("a\tb\nc\\d\re") == "a\\tb\\nc\\\\d\\re"
+    assert bulk.format_value(datetime(2024, 1, 2, 3, 4, 5)) == "2024-01-02T03:04:05"  # noqa: DTZ001
+    assert bulk.format_value(np.array([0.5, -1.0], dtype=np.float32)) == "[0.5,-1]"
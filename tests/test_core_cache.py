@@ -0,0 +1,61 @@
+from api.core import cache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_key_normalizes_query():
+    assert cache.cache_key("  Hello   WORLD ", "model") == cache.cache_key("hello world", "model")
+    assert cache.cache_key("hello world", "model") != cache.cache_key("hello world", "other-model")
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = cache.MemoryCacheBackend(max_entries=2, max_bytes=1024)
+    backend.set("a", b"1", ttl=60)
+    backend.set("b", b"2", ttl=60)
+    backend.get("a")
+    backend.set("c", b"3", ttl=60)
+
+    assert backend.get("a") == b"1"
+    assert backend.get("b") is None
+    assert backend.get("c") == b"3"
+
+
+def test_memory_backend_bounded_by_bytes():
+    backend = cache.MemoryCacheBackend(max_entries=10, max_bytes=8)
+    backend.set("a", b"1234", ttl=60)
+    backend.set("b", b"5678", ttl=60)
+    backend.set("c", b"9", ttl=60)
+
+    assert backend.get("a") is None
+    assert backend.size == len(b"5678") + len(b"9")
+    backend.set("too-big", b"123456789", ttl=60)
+    assert backend.get("too-big") is None
+
+
+def test_memory_backend_expires_entries():
+    clock = FakeClock()
+    backend = cache.MemoryCacheBackend(max_entries=10, max_bytes=1024, clock=clock)
+    backend.set("a", b"1", ttl=10)
+
+    clock.now = 9
+    assert backend.get("a") == b"1"
+    clock.now = 10
+    assert backend.get("a") is None
+    assert len(backend) == 0
+
+
+def test_query_cache_counts_hits_and_misses():
+    query_cache = cache.QueryEmbeddingCache(cache.MemoryCacheBackend(max_entries=10, max_bytes=1024), ttl=60)
+
+    assert query_cache.get("query", "model") is None
+    query_cache.set("query", "model", [0.5, 0.25])
+
+    assert query_cache.get("Query ", "model").tolist() == [0.5, 0.25]
+    assert query_cache.get("query", "other-model") is None
+    assert (query_cache.hits, query_cache.misses) == (1, 2)
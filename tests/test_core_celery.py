@@ -0,0 +1,21 @@
+from api.core import celery
+
+
+def test_ingest_route_sends_large_files_to_their_queue_with_lower_priority():
+    assert celery.ingest_route(1000, "text/plain") == (celery.SMALL_FILES_QUEUE, celery.MAX_PRIORITY)
+    assert celery.ingest_route(64 * 1024, "text/plain") == (celery.SMALL_FILES_QUEUE, celery.MAX_PRIORITY - 4)
+    assert celery.ingest_route(64 * 1024 * 1024, "text/plain") == (celery.LARGE_FILES_QUEUE, 0)
+    assert celery.ingest_route(1000, "application/pdf")[0] == celery.LARGE_FILES_QUEUE
+
+
+def test_client_is_shared_by_the_process(monkeypatch):
+    monkeypatch.setattr(celery.settings, "broker_host", "localhost")
+    client = celery.get_celery_client()
+    try:
+        assert celery.get_celery_client() is client
+        assert "localhost" in client.conf.broker_url
+        assert client.conf.broker_transport_options == {"confirm_publish": True}
+    finally:
+        celery.close_celery_client(client)
+
+    assert celery.get_celery_client.cache_info().currsize == 0
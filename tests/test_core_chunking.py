@@ -0,0 +1,62 @@
+import pytest
+
+from api.core import chunking
+
+TEXT = "Hello, world! This is a test of the chunker. " * 3
+
+
+def test_chunks_are_bounded_and_overlap():
+    chunks = chunking.chunk_text(TEXT, window=8, overlap=2)
+
+    assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+    assert all(chunk.token_count <= 8 for chunk in chunks)  # noqa: PLR2004
+    assert all(TEXT[chunk.start_offset : chunk.end_offset] == chunk.text for chunk in chunks)
+    assert chunks[0].text == "Hello, world! This is a test"
+    assert chunks[1].text.startswith("a test")
+
+
+def test_streamed_pieces_produce_same_chunks():
+    pieces = [TEXT[i : i + 5] for i in range(0, len(TEXT), 5)]
+
+    assert list(chunking.iter_chunks(pieces, window=8, overlap=2)) == chunking.chunk_text(TEXT, window=8, overlap=2)
+
+
+def test_text_without_tokens_is_one_chunk():
+    assert chunking.chunk_text("   ", window=8, overlap=2) == [chunking.Chunk(0, "   ", 0, 3, 0)]
+
+
+def test_tail_inside_overlap_is_not_repeated():
+    chunks = chunking.chunk_text("a b c d", window=4, overlap=1)
+
+    assert [chunk.text for chunk in chunks] == ["a b c d"]
+
+
+def test_content_defined_chunks_survive_edits():
+    words = [f"w{i * 7919 % 1000}" for i in range(5000)]
+    text = " ".join(words)
+    edited = " ".join([*words[:2500], "an", "inserted", "sentence", *words[2500:]])
+
+    chunks = chunking.chunk_text(text, window=64, overlap=8, content_defined=True)
+    edited_chunks = chunking.chunk_text(edited, window=64, overlap=8, content_defined=True)
+
+    assert all(chunk.token_count <= 64 for chunk in chunks)  # noqa: PLR2004
+    assert all(text[chunk.start_offset : chunk.end_offset] == chunk.text for chunk in chunks)
+    known = {chunk.content_hash for chunk in chunks}
+    assert sum(chunk.content_hash not in known for chunk in edited_chunks) <= 3  # noqa: PLR2004
+
+
+def test_content_defined_streamed_pieces_produce_same_chunks():
+    text = " ".join(f"w{i * 31 % 97}" for i in range(2000))
+    pieces = [text[i : i + 7] for i in range(0, len(text), 7)]
+
+    assert list(chunking.iter_chunks(pieces, window=32, overlap=4, content_defined=True)) == chunking.chunk_text(
+        text,
+        window=32,
+        overlap=4,
+        content_defined=True,
+    )
+
+
+def test_invalid_overlap_rejected():
+    with pytest.raises(ValueError, match="overlap"):
+        chunking.chunk_text(TEXT, window=4, overlap=4)
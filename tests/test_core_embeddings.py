@@ -0,0 +1,127 @@
+import threading
+from unittest.mock import AsyncMock
+
+import pytest
+
+from api.core import cache, chunking, embeddings, providers
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeContentStore:
+    def __init__(self, stored):
+        self.stored = stored
+
+    def get_many(self, content_hashes):
+        return {
+            content_hash: self.stored[content_hash] for content_hash in content_hashes if content_hash in self.stored
+        }
+
+
+@pytest.mark.anyio
+async def test_chunk_embeddings_reuse_stored_content(monkeypatch):
+    known, new = chunking.Chunk(0, "known", 0, 5, 1), chunking.Chunk(1, "new", 6, 9, 1)
+    repeated = chunking.Chunk(2, "new", 10, 13, 1)
+    content_store = FakeContentStore({known.content_hash: [1.0]})
+    generate_embedding = AsyncMock(return_value=[2.0])
+    monkeypatch.setattr(embeddings, "generate_embedding", generate_embedding)
+
+    result = await embeddings.generate_chunk_embeddings([known, new, repeated], content_store)
+
+    assert result == [[1.0], [2.0], [2.0]]
+    generate_embedding.assert_awaited_once_with("new")
+
+
+@pytest.mark.anyio
+async def test_chunk_embeddings_reuse_previous_version_first(monkeypatch):
+    unchanged, edited = chunking.Chunk(0, "unchanged", 0, 9, 1), chunking.Chunk(1, "edited", 10, 16, 1)
+    content_store = FakeContentStore({})
+    generate_embedding = AsyncMock(return_value=[2.0])
+    monkeypatch.setattr(embeddings, "generate_embedding", generate_embedding)
+
+    result = await embeddings.generate_chunk_embeddings(
+        [unchanged, edited],
+        content_store,
+        reuse={unchanged.content_hash: [1.0]},
+    )
+
+    assert result == [[1.0], [2.0]]
+    generate_embedding.assert_awaited_once_with("edited")
+
+
+class ThreadRecordingBackend(cache.MemoryCacheBackend):
+    def __init__(self):
+        super().__init__(max_entries=10, max_bytes=1024)
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.current_thread())
+        return super().get(key)
+
+    def set(self, key, value, ttl):
+        self.threads.append(threading.current_thread())
+        super().set(key, value, ttl)
+
+
+@pytest.mark.anyio
+async def test_query_cache_is_used_off_the_event_loop(monkeypatch):
+    backend = ThreadRecordingBackend()
+    monkeypatch.setattr(embeddings.cache, "get_query_cache", lambda: cache.QueryEmbeddingCache(backend, ttl=60))
+    generate_embedding = AsyncMock(return_value=[1.0])
+    monkeypatch.setattr(embeddings, "generate_embedding", generate_embedding)
+
+    assert list(await embeddings.generate_query_embedding("query")) == [1.0]
+    assert list(await embeddings.generate_query_embedding("query")) == [1.0]
+
+    generate_embedding.assert_awaited_once()
+    assert len(backend.threads) == 3  # noqa: PLR2004
+    assert threading.current_thread() not in backend.threads
+
+
+@pytest.mark.anyio
+async def test_provider_client_is_shared_until_closed(monkeypatch):
+    monkeypatch.setattr(embeddings.settings, "embedding_provider", "openai")
+    monkeypatch.setattr(embeddings.settings, "embedding_http2", True)
+    monkeypatch.setattr(embeddings.settings, "embedding_fallback_endpoints", [])
+    closed = []
+    aclose = providers.OpenAICompatibleProvider.aclose
+
+    async def record_aclose(provider):
+        closed.append(provider)
+        await aclose(provider)
+
+    monkeypatch.setattr(providers.OpenAICompatibleProvider, "aclose", record_aclose)
+    embeddings.get_provider.cache_clear()
+    try:
+        provider = embeddings.get_provider()
+        assert embeddings.get_provider() is provider
+
+        await embeddings.close_provider()
+        assert len(closed) == 1
+        assert embeddings.get_provider.cache_info().currsize == 0
+        assert embeddings.get_provider() is not provider
+    finally:
+        await embeddings.close_provider()
+
+
+def test_pool_embeddings_is_normalized_mean():
+    assert embeddings.pool_embeddings([[1.0, 0.0], [0.0, 1.0]]) == pytest.approx([2**-0.5, 2**-0.5])
+
+
+@pytest.mark.anyio
+async def test_stream_embeddings_chunk_pieces_in_groups(monkeypatch):
+    generate_embedding = AsyncMock(return_value=[1.0])
+    monkeypatch.setattr(embeddings, "generate_embedding", generate_embedding)
+    monkeypatch.setattr(embeddings, "STREAM_GROUP_CHUNKS", 2)
+    monkeypatch.setattr(embeddings.settings, "chunk_window_tokens", 4)
+    monkeypatch.setattr(embeddings.settings, "chunk_overlap_tokens", 0)
+    monkeypatch.setattr(embeddings.settings, "chunk_boundaries", "fixed")
+    text = " ".join(f"word{i}" for i in range(20))
+
+    result = await embeddings.generate_embedding_from_stream(text[i : i + 3] for i in range(0, len(text), 3))
+
+    assert [chunk.text for chunk, _ in result] == [chunk.text for chunk in chunking.chunk_text(text, 4, 0)]
+    assert generate_embedding.await_count == 5  # noqa: PLR2004
@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+import pytest
+
+from api.core import events
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def listener(monkeypatch):
+    listener = events.StatusListener("postgresql://localhost/test")
+    monkeypatch.setattr(listener, "_listen", lambda: None)
+    return listener
+
+
+@pytest.mark.anyio
+async def test_status_changes_reach_only_their_user(listener):
+    queue = listener.subscribe(1)
+    other_queue = listener.subscribe(2)
+
+    listener.publish(json.dumps({"id": 7, "user_id": 1, "filename": "a.txt", "status": "stored"}))
+    event = await asyncio.wait_for(queue.get(), 1)
+
+    assert event == {"id": 7, "filename": "a.txt", "status": "stored"}
+    assert other_queue.empty()
+
+
+@pytest.mark.anyio
+async def test_unsubscribed_streams_receive_nothing(listener):
+    queue = listener.subscribe(1)
+    listener.unsubscribe(1, queue)
+
+    listener.publish(json.dumps({"id": 7, "user_id": 1, "filename": "a.txt", "status": "stored"}))
+    await asyncio.sleep(0)
+
+    assert queue.empty()
+
+
+def test_events_are_dropped_for_slow_streams():
+    queue = asyncio.Queue(1)
+
+    events.deliver(queue, {"id": 1})
+    events.deliver(queue, {"id": 2})
+
+    assert queue.get_nowait() == {"id": 1}
+    assert queue.empty()
@@ -0,0 +1,144 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from api.core import files
+
+
+class FakeMinio:
+    def __init__(self):
+        self.buckets = set()
+        self.checks = 0
+
+    def bucket_exists(self, bucket):
+        self.checks += 1
+        return bucket in self.buckets
+
+    def make_bucket(self, bucket):
+        self.buckets.add(bucket)
+
+
+def test_bucket_is_provisioned_once_per_process(monkeypatch):
+    fake = FakeMinio()
+    monkeypatch.setattr(files, "create_minio_client", lambda _host: fake)
+    files.get_minio_client.cache_clear()
+    try:
+        assert files.get_minio_client() is files.get_minio_client()
+    finally:
+        files.get_minio_client.cache_clear()
+
+    assert fake.buckets == {files.BUCKET}
+    assert fake.checks == 1
+
+
+def read_all(reader: files.ValidatingReader, size: int) -> bytes:
+    data = b""
+    while piece := reader.read(size):
+        data += piece
+    return data
+
+
+def test_reader_accepts_characters_split_between_reads():
+    content = "héllo wörld".encode()
+    reader = files.ValidatingReader(io.BytesIO(content), len(content))
+
+    assert read_all(reader, 2) == content
+    assert reader.size == len(content)
+
+
+def test_reader_rejects_invalid_text():
+    with pytest.raises(files.InvalidTextError):
+        read_all(files.ValidatingReader(io.BytesIO(b"abc\xff"), 100), 2)
+    with pytest.raises(files.InvalidTextError):
+        read_all(files.ValidatingReader(io.BytesIO("é".encode()[:1]), 100), 2)
+
+
+def test_reader_rejects_files_over_the_limit():
+    reader = files.ValidatingReader(io.BytesIO(b"a" * 10), 5)
+
+    with pytest.raises(files.FileTooLargeError):
+        read_all(reader, 4)
+
+
+def zip_archive(members: dict[str, bytes]) -> io.BytesIO:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    archive.seek(0)
+    return archive
+
+
+def tar_archive(members: dict[str, bytes]) -> io.BytesIO:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar_file:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar_file.addfile(info, io.BytesIO(content))
+    archive.seek(0)
+    return archive
+
+
+def summarize(entries) -> list[tuple[str, bytes | None]]:
+    return [(entry.filename, entry.content.read() if entry.content else None) for entry in entries]
+
+
+def test_archives_are_extracted_keeping_text_files_only():
+    members = {"a.txt": b"first", "docs/b.txt": b"second", "image.png": b"\x89PNG", "../escape.txt": b"no"}
+    expected = [("a.txt", b"first"), ("docs/b.txt", b"second"), ("image.png", None), ("../escape.txt", None)]
+
+    assert summarize(files.upload_entries(zip_archive(members), "batch.zip", "application/zip", 10)) == expected
+    assert summarize(files.upload_entries(tar_archive(members), "batch.tgz", "application/octet-stream", 9)) == expected
+
+
+def test_archive_files_over_the_limit_are_rejected(monkeypatch):
+    monkeypatch.setattr(files.settings, "upload_max_bytes", 4)
+
+    entries = list(
+        files.upload_entries(zip_archive({"a.txt": b"abc", "b.txt": b"abcdef"}), "batch.zip", "application/zip", 10),
+    )
+
+    assert [entry.error is None for entry in entries] == [True, False]
+
+
+def test_archives_are_not_extracted_beyond_the_file_limit():
+    members = {"a.txt": b"first", "b.txt": b"second", "c.txt": b"third"}
+    expected = [("a.txt", b"first"), ("b.txt", None)]
+
+    assert summarize(files.upload_entries(zip_archive(members), "batch.zip", "application/zip", 1)) == expected
+    assert summarize(files.upload_entries(tar_archive(members), "batch.tgz", "application/octet-stream", 1)) == expected
+
+
+def test_plain_files_are_named_as_archive_files():
+    entries = [
+        *files.upload_entries(io.BytesIO(b"text"), "docs//./a.txt", "text/plain", 10),
+        *files.upload_entries(io.BytesIO(b"text"), "../escape.txt", "text/plain", 10),
+    ]
+
+    assert [(entry.filename, entry.error) for entry in entries] == [
+        ("docs/a.txt", None),
+        ("../escape.txt", "Invalid path"),
+    ]
+
+
+def test_invalid_archive_is_rejected_as_a_whole():
+    entries = list(files.upload_entries(io.BytesIO(b"not a zip"), "batch.zip", "application/zip", 10))
+
+    assert len(entries) == 1
+    assert entries[0].error.startswith("Invalid zip archive")
+
+
+def test_upload_urls_are_signed_for_the_public_endpoint(monkeypatch):
+    monkeypatch.setattr(files.settings, "minio_public_endpoint", "files.example.com")
+    monkeypatch.setattr(files.settings, "upload_url_expiry", 600)
+    files.get_presign_client.cache_clear()
+    try:
+        url, _ = files.presign_upload(3, "docs/a b.txt")
+    finally:
+        files.get_presign_client.cache_clear()
+
+    assert url.startswith(f"http://files.example.com/{files.BUCKET}/3/docs/a%20b.txt?")
+    assert "X-Amz-Expires=600" in url
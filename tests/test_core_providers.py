@@ -0,0 +1,73 @@
+import base64
+import json
+
+import httpx
+import numpy as np
+import pytest
+
+from api.core import providers
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_hashing_provider_is_deterministic_and_normalized():
+    provider = providers.HashingProvider(dimensions=4096)
+
+    first, second, third = await provider.embed(["the quick brown fox", "the quick brown fox", "lorem ipsum"])
+
+    np.testing.assert_array_equal(first, second)
+    assert first.dtype == np.float32
+    assert len(first) == provider.dimensions
+    assert np.linalg.norm(first) == pytest.approx(1.0)
+    assert np.dot(first, second) > np.dot(first, third)
+
+
+@pytest.mark.anyio
+async def test_openai_compatible_provider_sends_one_request_per_batch():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        body = json.loads(request.content)
+        data = [
+            {"index": i, "embedding": base64.b64encode(np.array([i, -i], dtype="<f4").tobytes()).decode()}
+            for i in range(len(body["input"]))
+        ]
+        return httpx.Response(200, json={"data": list(reversed(data))})
+
+    provider = providers.OpenAICompatibleProvider(
+        "https://embeddings.example.com/v1/",
+        "test-model",
+        2,
+        "secret",
+        max_connections=1,
+        max_keepalive_connections=1,
+        keepalive_expiry=5,
+        timeout=5,
+        http2=False,
+        transport=httpx.MockTransport(handler),
+    )
+
+    embeddings = await provider.embed(["a", "b"])
+    await provider.aclose()
+
+    assert [embedding.tolist() for embedding in embeddings] == [[0.0, 0.0], [1.0, -1.0]]
+    assert len(requests) == 1
+    assert str(requests[0].url) == "https://embeddings.example.com/v1/embeddings"
+    assert requests[0].headers["Authorization"] == "Bearer secret"
+    assert json.loads(requests[0].content) == {
+        "model": "test-model",
+        "input": ["a", "b"],
+        "encoding_format": "base64",
+    }
+
+
+def test_decode_embedding_accepts_floats():
+    embedding = providers.decode_embedding([0.5, -0.25])
+
+    assert embedding.dtype == np.float32
+    assert embedding.tolist() == [0.5, -0.25]
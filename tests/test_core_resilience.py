@@ -0,0 +1,152 @@
+import asyncio
+
+import httpx
+import pytest
+
+from api.core import resilience
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyProvider:
+    model = "flaky"
+    dimensions = 1
+
+    def __init__(self, failures: list[int]):
+        self.failures = failures
+        self.calls = 0
+
+    async def embed(self, texts):
+        await asyncio.sleep(0)
+        self.calls += 1
+        if self.failures:
+            status_code = self.failures.pop(0)
+            request = httpx.Request("POST", "https://example.com/embeddings")
+            response = httpx.Response(status_code, request=request, headers={"Retry-After": "0"})
+            msg = "error"
+            raise httpx.HTTPStatusError(msg, request=request, response=response)
+        return [[1.0] for _ in texts]
+
+    async def aclose(self):
+        pass
+
+
+def resilient(provider, budget_ratio=1.0, failure_threshold=5):
+    return resilience.ResilientProvider(
+        provider,
+        resilience.AdaptiveConcurrencyLimiter(4, 1, 8, latency_target=10),
+        resilience.RetryBudget(budget_ratio, min_per_second=0, max_balance=10),
+        resilience.CircuitBreaker(failure_threshold, reset_timeout=30),
+        max_retries=3,
+        backoff=0,
+        max_backoff=0,
+    )
+
+
+def test_limiter_increases_additively_and_halves_on_overload():
+    clock = FakeClock()
+    limiter = resilience.AdaptiveConcurrencyLimiter(4, 1, 8, latency_target=1, clock=clock)
+
+    limiter.on_success(0.1)
+    assert limiter.limit == pytest.approx(4.25)
+
+    limiter.on_overload()
+    limiter.on_overload()
+    assert limiter.limit == pytest.approx(2.125)
+
+    clock.now = 2
+    limiter.on_success(5)
+    assert limiter.limit == pytest.approx(1.0625)
+
+
+def test_retry_budget_limits_retries_to_a_fraction_of_requests():
+    budget = resilience.RetryBudget(ratio=0.5, min_per_second=0, max_balance=10, clock=FakeClock())
+
+    budget.record_request()
+    assert not budget.try_withdraw()
+    budget.record_request()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+
+def test_circuit_breaker_opens_and_probes_after_timeout():
+    clock = FakeClock()
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+
+    with pytest.raises(resilience.ProviderUnavailableError):
+        breaker.before_call()
+
+    clock.now = 30
+    breaker.before_call()
+    with pytest.raises(resilience.ProviderUnavailableError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.anyio
+async def test_transient_failures_are_retried():
+    provider = FlakyProvider([429, 503])
+
+    assert await resilient(provider, budget_ratio=2).embed(["a"]) == [[1.0]]
+    assert provider.calls == 3  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_client_errors_are_not_retried():
+    provider = FlakyProvider([400])
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await resilient(provider).embed(["a"])
+    assert provider.calls == 1
+
+
+@pytest.mark.anyio
+async def test_exhausted_budget_stops_retries():
+    provider = FlakyProvider([500, 500])
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await resilient(provider, budget_ratio=0).embed(["a"])
+    assert provider.calls == 1
+
+
+@pytest.mark.anyio
+async def test_open_circuit_fails_fast():
+    provider = FlakyProvider([500] * 4)
+    protected = resilient(provider, budget_ratio=5, failure_threshold=2)
+
+    with pytest.raises(resilience.ProviderUnavailableError):
+        await protected.embed(["a"])
+    assert provider.calls == 2  # noqa: PLR2004
+
+
+@pytest.mark.anyio
+async def test_cancelled_probe_lets_another_call_probe():
+    clock = FakeClock()
+    breaker = resilience.CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    provider = resilient(FlakyProvider([]))
+    provider.circuit_breaker = breaker
+    breaker.record_failure()
+    clock.now = 30
+
+    probe = asyncio.create_task(provider.embed(["a"]))
+    await asyncio.sleep(0)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert await provider.embed(["a"]) == [[1.0]]
+    assert breaker.state == "closed"
@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+import pytest
+
+from api.core import resilience, routing
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeEndpoint:
+    dimensions = 1
+
+    def __init__(self, model: str, delay: float = 0.0, error: Exception | None = None):
+        self.model = model
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def embed(self, texts):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return [[float(self.calls)] for _ in texts]
+
+    async def aclose(self):
+        pass
+
+
+def router(*endpoints, initial_hedge_delay=0.01):
+    return routing.HedgedRouter(
+        list(endpoints),
+        alpha=0.5,
+        hedge_percentile=0.95,
+        min_hedge_delay=0.0,
+        initial_hedge_delay=initial_hedge_delay,
+    )
+
+
+def server_error():
+    request = httpx.Request("POST", "https://example.com/embeddings")
+    msg = "error"
+    return httpx.HTTPStatusError(msg, request=request, response=httpx.Response(503, request=request))
+
+
+@pytest.mark.anyio
+async def test_router_fails_over_and_ranks_by_ewma():
+    failing = FakeEndpoint("primary", error=server_error())
+    healthy = FakeEndpoint("secondary")
+    hedged_router = router(failing, healthy)
+
+    assert await hedged_router.embed(["a"]) == [[1.0]]
+    assert hedged_router.ranked() == [1, 0]
+    assert hedged_router.model == "primary"
+
+
+@pytest.mark.anyio
+async def test_router_does_not_fail_over_invalid_requests():
+    invalid = FakeEndpoint("primary", error=ValueError("invalid"))
+    healthy = FakeEndpoint("secondary")
+
+    with pytest.raises(ValueError, match="invalid"):
+        await router(invalid, healthy).embed(["a"])
+    assert healthy.calls == 0
+
+
+@pytest.mark.anyio
+async def test_hedged_request_returns_first_answer_and_cancels_the_rest():
+    slow = FakeEndpoint("primary", delay=1.0)
+    fast = FakeEndpoint("secondary")
+
+    embeddings = await router(slow, fast).embed_hedged(["a"])
+    await asyncio.sleep(0)
+
+    assert embeddings == [[1.0]]
+    assert fast.calls == 1
+    assert slow.cancelled == 1
+
+
+@pytest.mark.anyio
+async def test_hedged_request_is_not_sent_when_first_answer_is_in_time():
+    primary = FakeEndpoint("primary")
+    secondary = FakeEndpoint("secondary")
+
+    await router(primary, secondary, initial_hedge_delay=1.0).embed_hedged(["a"])
+
+    assert secondary.calls == 0
+
+
+@pytest.mark.anyio
+async def test_hedged_request_raises_when_every_endpoint_fails():
+    unavailable = resilience.ProviderUnavailableError("open", retry_after=1.0)
+    hedged_router = router(FakeEndpoint("primary", error=unavailable), FakeEndpoint("secondary", error=unavailable))
+
+    with pytest.raises(resilience.ProviderUnavailableError):
+        await hedged_router.embed_hedged(["a"])
+
+
+def test_hedge_delay_follows_latency_percentile():
+    stats = routing.EndpointStats(alpha=0.5, window=100)
+    for latency in range(1, 101):
+        stats.record_success(latency / 100)
+
+    assert stats.percentile(0.95) == pytest.approx(0.9505)
+    assert stats.percentile(0.5) == pytest.approx(0.505)
@@ -0,0 +1,38 @@
+from api.core import simhash
+
+DOCUMENT = " ".join(f"line {i}: request served in {i % 7} ms by worker {i % 3}" for i in range(200))
+
+
+def test_fingerprint_is_deterministic_and_fits_bigint():
+    value = simhash.fingerprint(DOCUMENT)
+
+    assert value == simhash.fingerprint(DOCUMENT)
+    assert -(2**63) <= value < 2**63
+    assert simhash.fingerprint("") == 0
+
+
+def test_small_edits_keep_fingerprints_similar():
+    revised = DOCUMENT.replace("line 42:", "line forty-two:")
+    unrelated = "The quick brown fox jumps over the lazy dog, again and again, until the dog finally wakes up."
+
+    assert simhash.similarity(simhash.fingerprint(DOCUMENT), simhash.fingerprint(revised)) >= 0.9  # noqa: PLR2004
+    assert simhash.similarity(simhash.fingerprint(DOCUMENT), simhash.fingerprint(unrelated)) < 0.9  # noqa: PLR2004
+
+
+def test_fingerprints_differing_in_few_bits_share_a_band():
+    value = simhash.fingerprint(DOCUMENT)
+    flipped = value ^ (1 << 3) ^ (1 << 20) ^ (1 << 40)
+
+    assert len(simhash.bands(value)) == simhash.BANDS
+    assert set(enumerate(simhash.bands(value))) & set(enumerate(simhash.bands(flipped)))
+    assert simhash.similarity(value, flipped) == 1 - 3 / simhash.FINGERPRINT_BITS
+
+
+def test_streamed_fingerprint_matches_whole_text(monkeypatch):
+    monkeypatch.setattr(simhash, "BLOCK_SIZE", 16)
+    hasher = simhash.SimHash()
+    for start in range(0, len(DOCUMENT), 7):
+        hasher.update(DOCUMENT[start : start + 7])
+
+    assert hasher.digest() == simhash.fingerprint(DOCUMENT)
+    assert simhash.fingerprint("two words") != 0
@@ -0,0 +1,39 @@
+import pytest
+from sqlmodel import Session
+
+from api.core import models, store, vectors
+
+
+def test_embeddings_are_reused_from_stored_chunks_until_their_file_is_deleted(session: Session):
+    embedding = [0.1] * vectors.storage_dimensions()
+    file = models.FileMetadata(
+        user_id=1,
+        filename="store.txt",
+        content_type="text/plain",
+        size=1,
+        minio_path="1/store.txt",
+        embedding=embedding,
+    )
+    session.add(file)
+    session.flush()
+    session.add(
+        models.FileChunk(
+            file_id=file.id,
+            chunk_index=0,
+            start_offset=0,
+            end_offset=1,
+            token_count=1,
+            content_hash="test-core-store-stored",
+            embedding=embedding,
+        ),
+    )
+    session.commit()
+    content_store = store.ContentEmbeddingStore(session.get_bind())
+
+    found = content_store.get_many(["test-core-store-stored", "test-core-store-new", "test-core-store-stored"])
+    assert list(found) == ["test-core-store-stored"]
+    assert found["test-core-store-stored"].tolist() == pytest.approx(embedding, rel=1e-3)
+
+    session.delete(file)
+    session.commit()
+    assert content_store.get_many(["test-core-store-stored"]) == {}
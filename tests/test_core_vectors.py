@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from api.core import vectors
+from api.core.config import settings
+
+
+@pytest.fixture
+def truncated_storage(monkeypatch):
+    monkeypatch.setattr(settings, "embedding_storage", "halfvec")
+    monkeypatch.setattr(settings, "embedding_storage_dimensions", 2)
+
+
+def test_full_storage_keeps_embeddings():
+    np.testing.assert_array_equal(vectors.prepare([0.6, 0.8, 0.0]), np.array([0.6, 0.8, 0.0], dtype=np.float32))
+    assert vectors.sql_type() == f"vector({settings.embedding_dimensions})"
+
+
+@pytest.mark.usefixtures("truncated_storage")
+def test_truncated_storage_renormalizes_prefix():
+    prepared = vectors.prepare([3.0, 4.0, 12.0])
+
+    assert prepared.tolist() == pytest.approx([0.6, 0.8])
+    assert np.linalg.norm(prepared) == pytest.approx(1.0)
+    assert vectors.sql_type() == "halfvec(2)"
+    assert vectors.is_indexable()
+
+
+def test_to_text_round_trips_float32():
+    embedding = np.random.default_rng(0).standard_normal(16).astype(np.float32)
+
+    text = vectors.to_text(embedding)
+
+    assert text.startswith("[")
+    assert text.endswith("]")
+    np.testing.assert_array_equal(np.array(text[1:-1].split(","), dtype=np.float32), embedding)